@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import cache, tasks
+from wagtailvideos.ffmpeg import ProbeResult
+from wagtailvideos.models import Video
+
+RESULT = ProbeResult(
+    duration=datetime.timedelta(seconds=5), container='mp4', bitrate=1000, streams=[])
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(len(lru), 2)
+
+
+@patch('wagtailvideos.ffmpeg.probe', return_value=RESULT)
+class TestProbeCache(TestCase):
+    def setUp(self):
+        cache.get_local_cache().clear()
+        caches['default'].clear()
+
+    def test_probe_once(self, probe):
+        key = cache.make_key('original_videos/small.mp4', 1234, 1.0)
+        self.assertEqual(cache.probe('/tmp/a.mp4', key=key), RESULT)
+        self.assertEqual(cache.probe('/tmp/b.mp4', key=key), RESULT)
+        self.assertEqual(probe.call_count, 1)
+
+    def test_shared_cache(self, probe):
+        key = cache.make_key(None, None, content_hash='abc')
+        cache.probe('/tmp/a.mp4', key=key)
+
+        # Another process only sees the shared cache
+        cache.get_local_cache().clear()
+        self.assertEqual(cache.probe('/tmp/a.mp4', key=key), RESULT)
+        self.assertEqual(probe.call_count, 1)
+
+    @override_settings(WAGTAILVIDEOS_PROBE_CACHE=None)
+    def test_shared_cache_disabled(self, probe):
+        key = cache.make_key(None, None, content_hash='abc')
+        cache.probe('/tmp/a.mp4', key=key)
+        cache.get_local_cache().clear()
+        cache.probe('/tmp/a.mp4', key=key)
+        self.assertEqual(probe.call_count, 2)
+
+    def test_failed_probe_not_cached(self, probe):
+        probe.return_value = None
+        key = cache.make_key(None, None, content_hash='abc')
+        cache.probe('/tmp/a.mp4', key=key)
+        cache.probe('/tmp/a.mp4', key=key)
+        self.assertEqual(probe.call_count, 2)
+
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    def test_upload_probe_reused(self, installed, probe):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        # As probed by the upload form
+        cache.set_cached(cache.get_hash_key(video.content_hash), RESULT)
+        tasks.validate_video_codec(video.pk)
+        self.assertFalse(probe.called)
+
+    @override_settings(WAGTAILVIDEOS_PROBE_CACHE_SIZE=1)
+    def test_local_cache_size(self, probe):
+        self.assertEqual(cache.get_local_cache().maxsize, 1)
+
+    def test_file_key(self, probe):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        key = cache.get_file_key(video.file)
+        self.assertEqual(key, cache.get_file_key(Video.objects.get(pk=video.pk).file))
+        self.assertNotEqual(key, cache.make_key(video.file.name, video.file.size + 1))
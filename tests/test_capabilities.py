@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import capabilities
+from wagtailvideos.apps import ffmpeg_check
+from wagtailvideos.models import TranscodeErrorType, Video
+
+ENCODERS_OUTPUT = b"""Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ V....D libvpx               libvpx VP8 (codec vp8)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+FILTERS_OUTPUT = b"""Filters:
+  T.. = Timeline support
+  ... = Legacy filter
+ ..C scale             V->V       Scale the input video size and/or convert the image format.
+ TSC overlay           VV->V      Overlay a video source on top of the input.
+"""
+
+
+def fake_ffmpeg(args, **kwargs):
+    return {
+        '-version': b'ffmpeg version 4.4.2 Copyright (c) 2000-2021 the FFmpeg developers\n',
+        '-encoders': ENCODERS_OUTPUT,
+        '-decoders': ENCODERS_OUTPUT,
+        '-filters': FILTERS_OUTPUT,
+        '-hwaccels': b'Hardware acceleration methods:\nvaapi\n\n',
+    }[args[-1]]
+
+
+def with_encoders(*encoders):
+    return patch('wagtailvideos.capabilities.get_capabilities', return_value=capabilities.Capabilities(
+        ffmpeg_path='/usr/bin/ffmpeg', ffprobe_path='/usr/bin/ffprobe', encoders=encoders))
+
+
+class TestCapabilities(TestCase):
+    @patch('wagtailvideos.capabilities.which', side_effect=lambda name: '/usr/bin/' + name)
+    @patch('wagtailvideos.runner.check_output', side_effect=fake_ffmpeg)
+    def test_probe(self, check_output, which):
+        result = capabilities.probe()
+        self.assertTrue(result.installed)
+        self.assertEqual(result.version, '4.4.2')
+        self.assertEqual(result.encoders, {'libx264', 'libvpx', 'aac'})
+        self.assertEqual(result.filters, {'scale', 'overlay'})
+        self.assertEqual(result.hwaccels, {'vaapi'})
+        self.assertEqual(result.get_missing_encoders({'libx264', 'libtheora'}), {'libtheora'})
+
+    @patch('wagtailvideos.capabilities.which', return_value=None)
+    def test_not_installed(self, which):
+        result = capabilities.probe()
+        self.assertFalse(result.installed)
+        # Transcoding may happen somewhere else, so nothing is ruled out
+        self.assertEqual(result.get_missing_encoders({'libx264'}), set())
+
+    @patch('wagtailvideos.capabilities.probe', return_value=capabilities.Capabilities())
+    def test_probed_once(self, probe):
+        capabilities.get_capabilities.cache_clear()
+        try:
+            capabilities.get_capabilities()
+            capabilities.get_capabilities()
+        finally:
+            capabilities.get_capabilities.cache_clear()
+        self.assertEqual(probe.call_count, 1)
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4', 'ogg'])
+    def test_system_check(self):
+        with with_encoders('libx264', 'aac'):
+            messages = ffmpeg_check(None)
+        self.assertEqual([message.id for message in messages], ['wagtailvideos.W003'])
+        self.assertIn('libtheora, libvorbis', messages[0].msg)
+
+    def test_unsupported_transcode_rejected(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        with with_encoders('libx264', 'aac'), patch('wagtailvideos.models.transcoding_task') as task:
+            video.do_transcodes(['ogg', 'mp4'])
+
+        ogg, mp4 = video.transcodes.get(media_format='ogg'), video.transcodes.get(media_format='mp4')
+        self.assertFalse(ogg.processing)
+        self.assertIs(ogg.error_type, TranscodeErrorType.missing_encoder)
+        self.assertEqual(ogg.error_message, 'ffmpeg has no libtheora, libvorbis encoder.')
+        task.apply_async.assert_called_once_with(
+            args=[mp4.pk], kwargs={'stage': 'final', 'lease_owner': mp4.lease_owner}, priority=3)
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import complexity, formats
+from wagtailvideos.models import Video, VideoQuality
+
+
+class TestComplexity(TestCase):
+    @override_settings(WAGTAILVIDEOS_COMPLEXITY_SAMPLES=2)
+    @patch('wagtailvideos.ffmpeg.get_sample_size', return_value=25000)
+    def test_measure(self, get_sample_size):
+        result = complexity.measure('/tmp/video.mp4', datetime.timedelta(seconds=20))
+        # 50kB over 4 seconds
+        self.assertEqual(result, 100)
+        self.assertEqual([call[0][1] for call in get_sample_size.call_args_list], [4, 14])
+
+        self.assertIsNone(complexity.measure('/tmp/video.mp4', None))
+        get_sample_size.return_value = None
+        self.assertIsNone(complexity.measure('/tmp/video.mp4', datetime.timedelta(seconds=20)))
+
+    @override_settings(WAGTAILVIDEOS_REFERENCE_COMPLEXITY=400)
+    def test_crf_adjustment(self):
+        self.assertEqual(complexity.get_crf_adjustment(400), 0)
+        self.assertEqual(complexity.get_crf_adjustment(100), 6)
+        self.assertEqual(complexity.get_crf_adjustment(800), -3)
+        self.assertEqual(complexity.get_crf_adjustment(1), 6)
+        self.assertEqual(complexity.get_crf_adjustment(None), 0)
+
+    @override_settings(WAGTAILVIDEOS_REFERENCE_COMPLEXITY=400)
+    def test_quality_param(self):
+        mp4 = formats.get_format('mp4')
+        self.assertEqual(mp4.get_quality_param(VideoQuality.default, 100), '30')
+        self.assertEqual(mp4.get_quality_param(VideoQuality.default), '24')
+        # Only formats with a CRF are adjusted
+        ogg = formats.get_format('ogg')
+        self.assertEqual(ogg.get_quality_param(VideoQuality.default, 100), '7')
+
+    @override_settings(WAGTAILVIDEOS_PER_TITLE_ENCODING=True, WAGTAILVIDEOS_REFERENCE_COMPLEXITY=400)
+    def test_transcode_output(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file(), complexity=100)
+        transcode = video.transcodes.create(media_format='mp4')
+        args, output_file = transcode.get_output('/tmp')
+        self.assertEqual(args[args.index('-crf') + 1], '30')
+        self.assertEqual(transcode.quality_param, '30')
@@ -0,0 +1,28 @@
+from __future__ import unicode_literals
+
+import subprocess
+
+from django.test import TestCase
+
+from wagtailvideos import failures
+
+
+def failed(output):
+    return subprocess.CalledProcessError(1, ['ffmpeg'], output=output)
+
+
+class TestFailures(TestCase):
+    def test_classify(self):
+        self.assertEqual(failures.classify(failed(b"Unknown encoder 'libsvtav1'")), 'missing_encoder')
+        self.assertEqual(
+            failures.classify(failed(b'in.mp4: Invalid data found when processing input')), 'corrupt_input')
+        self.assertEqual(failures.classify(failed(b'[mp4 @ 0x1] moov atom not found')), 'corrupt_input')
+        self.assertEqual(
+            failures.classify(failed(b'av_interleaved_write_frame(): No space left on device')), 'disk_full')
+        self.assertEqual(failures.classify(subprocess.TimeoutExpired(['ffmpeg'], 10)), 'timeout')
+        self.assertEqual(failures.classify(failed(b'Conversion failed!')), 'unknown')
+        self.assertEqual(failures.classify(failed(None)), 'unknown')
+
+    def test_message(self):
+        self.assertEqual(failures.get_message(failed(b'bad \xff byte')), 'bad � byte')
+        self.assertEqual(failures.get_message(failed('text')), 'text')
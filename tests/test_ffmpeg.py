@@ -0,0 +1,125 @@
+from __future__ import unicode_literals
+
+import datetime
+import json
+import os
+import struct
+
+from django.test import TestCase
+from mock import patch
+
+import tests
+from wagtailvideos import ffmpeg
+
+PROBE_OUTPUT = json.dumps({
+    'streams': [
+        {
+            'index': 0,
+            'codec_name': 'h264',
+            'codec_type': 'video',
+            'width': 1920,
+            'height': 1080,
+            'avg_frame_rate': '30000/1001',
+            'bit_rate': '4000000',
+            'side_data_list': [{'rotation': -90}],
+        },
+        {
+            'index': 1,
+            'codec_name': 'aac',
+            'codec_type': 'audio',
+            'channels': 2,
+            'avg_frame_rate': '0/0',
+            'bit_rate': '128000',
+        },
+    ],
+    'format': {
+        'format_name': 'mov,mp4,m4a,3gp,3g2,mj2',
+        'duration': '12.500000',
+        'bit_rate': '4130000',
+    },
+}).encode()
+
+
+class TestParseProbeResult(TestCase):
+    def test_parse(self):
+        result = ffmpeg.parse_probe_result(PROBE_OUTPUT)
+
+        self.assertEqual(result.duration, datetime.timedelta(seconds=12.5))
+        self.assertEqual(result.container, 'mov,mp4,m4a,3gp,3g2,mj2')
+        self.assertEqual(result.bitrate, 4130000)
+        self.assertEqual(result.video_codec, 'h264')
+        self.assertEqual(result.audio_codec, 'aac')
+        self.assertEqual((result.width, result.height), (1920, 1080))
+        self.assertEqual(result.fps, 29.97)
+        self.assertEqual(result.rotation, -90)
+        self.assertEqual(result.audio_channels, 2)
+        self.assertIsNone(result.audio_stream.fps)
+
+    def test_parse_rotate_tag(self):
+        output = json.dumps({'streams': [{
+            'codec_type': 'video', 'codec_name': 'h264', 'tags': {'rotate': '90'},
+        }]})
+        self.assertEqual(ffmpeg.parse_probe_result(output).rotation, 90)
+
+    def test_parse_audio_only(self):
+        output = json.dumps({'streams': [{'codec_type': 'audio', 'codec_name': 'mp3'}]})
+        result = ffmpeg.parse_probe_result(output)
+
+        self.assertIsNone(result.video_codec)
+        self.assertIsNone(result.width)
+        self.assertIsNone(result.duration)
+
+    def test_parse_garbage(self):
+        self.assertIsNone(ffmpeg.parse_probe_result(b'not json'))
+
+
+@patch('wagtailvideos.ffmpeg.installed', return_value=True)
+class TestProbe(TestCase):
+    @patch('wagtailvideos.ffmpeg.os.path.exists', return_value=True)
+    @patch('wagtailvideos.runner.check_output', return_value=PROBE_OUTPUT)
+    def test_single_ffprobe_call(self, check_output, exists, installed):
+        result = ffmpeg.probe('/tmp/video.mp4')
+
+        self.assertEqual(check_output.call_count, 1)
+        args = check_output.call_args[0][0]
+        self.assertEqual(args[0], 'ffprobe')
+        self.assertIn('-show_format', args)
+        self.assertIn('-show_streams', args)
+        self.assertEqual(result.video_codec, 'h264')
+
+    @patch('wagtailvideos.runner.check_output')
+    def test_missing_file(self, check_output, installed):
+        self.assertIsNone(ffmpeg.probe('/does/not/exist.mp4'))
+        self.assertFalse(check_output.called)
+
+    @patch('wagtailvideos.runner.check_output', return_value=PROBE_OUTPUT)
+    def test_probe_bytes(self, check_output, installed):
+        self.assertEqual(ffmpeg.get_video_codec_from_bytes(b'data'), 'h264')
+        self.assertEqual(check_output.call_args[1]['input'], b'data')
+
+
+def box(box_type, payload=b''):
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+
+class TestNeedsTail(TestCase):
+    def test_faststart_mp4(self):
+        header = box(b'ftyp', b'isom') + box(b'moov', b'x' * 16) + box(b'mdat', b'x' * 64)
+        self.assertFalse(ffmpeg.needs_tail(header))
+
+    def test_moov_at_end(self):
+        header = box(b'ftyp', b'isom') + box(b'free') + box(b'mdat', b'x' * 64)
+        self.assertTrue(ffmpeg.needs_tail(header))
+
+    def test_moov_beyond_window(self):
+        header = box(b'ftyp', b'isom') + struct.pack('>I', 1000) + b'free'
+        self.assertTrue(ffmpeg.needs_tail(header))
+
+    def test_other_container(self):
+        # Matroska/WebM EBML header
+        self.assertFalse(ffmpeg.needs_tail(b'\x1a\x45\xdf\xa3' + b'\x00' * 60))
+
+    def test_test_video(self):
+        # small.mp4 was not written with +faststart
+        with open(os.path.join(tests.__path__[0], 'small.mp4'), 'rb') as f:
+            self.assertTrue(ffmpeg.needs_tail(f.read(4096)))
@@ -0,0 +1,66 @@
+from __future__ import unicode_literals
+
+import struct
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from mock import patch
+
+from wagtailvideos.ffmpeg import ProbeResult, StreamInfo
+from wagtailvideos.fields import WagtailVideoField
+
+
+def probe_result(codec):
+    stream = StreamInfo(0, 'video', codec, 640, 480, 25.0, None, None, None)
+    return ProbeResult(None, 'mp4', None, [stream])
+
+
+def mp4(moov_first, size):
+    ftyp = struct.pack('>I', 12) + b'ftypisom'
+    moov = struct.pack('>I', 16) + b'moov' + b'\x00' * 8
+    mdat = struct.pack('>I', size) + b'mdat' + b'\x00' * (size - 8)
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+@override_settings(WAGTAILVIDEOS_ALLOWED_CODECS=['h264'], WAGTAILVIDEOS_CODEC_PROBE_WINDOW=1024)
+@patch('wagtailvideos.ffmpeg.installed', return_value=True)
+class TestVideoCodecCheck(TestCase):
+    def upload(self, content):
+        return SimpleUploadedFile('video.mp4', content, 'video/mp4')
+
+    @patch('wagtailvideos.ffmpeg.probe')
+    @patch('wagtailvideos.ffmpeg.probe_bytes', return_value=probe_result('h264'))
+    def test_probes_header_window(self, probe_bytes, probe, installed):
+        f = self.upload(mp4(True, 100000))
+        WagtailVideoField().check_video_codec(f)
+
+        self.assertEqual(len(probe_bytes.call_args[0][0]), 1024)
+        self.assertFalse(probe.called)
+        self.assertEqual(f.tell(), 0)
+
+    @patch('wagtailvideos.ffmpeg.probe', return_value=probe_result('h264'))
+    @patch('wagtailvideos.ffmpeg.probe_bytes')
+    def test_moov_at_end_is_spooled(self, probe_bytes, probe, installed):
+        content = mp4(False, 100000)
+        WagtailVideoField().check_video_codec(self.upload(content))
+
+        self.assertFalse(probe_bytes.called)
+        self.assertTrue(probe.called)
+
+    @patch('wagtailvideos.ffmpeg.probe')
+    @patch('wagtailvideos.ffmpeg.probe_bytes', return_value=probe_result('vp8'))
+    def test_codec_not_allowed(self, probe_bytes, probe, installed):
+        with self.assertRaises(ValidationError):
+            WagtailVideoField().check_video_codec(self.upload(mp4(True, 100)))
+        self.assertFalse(probe.called)
+
+    @patch('wagtailvideos.ffmpeg.probe_bytes', return_value=probe_result('h264'))
+    def test_uses_upload_handler_header(self, probe_bytes, installed):
+        f = self.upload(mp4(True, 100000))
+        f.content_header = f.read(2048)
+        WagtailVideoField().check_video_codec(f)
+
+        # The file itself was not read again
+        self.assertEqual(f.tell(), 2048)
+        self.assertEqual(len(probe_bytes.call_args[0][0]), 2048)
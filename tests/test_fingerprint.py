@@ -0,0 +1,105 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from mock import patch
+from wagtail.tests.utils import WagtailTestUtils
+
+from tests.utils import create_test_video_file
+from wagtailvideos import ffmpeg, fingerprint, tasks
+from wagtailvideos.ffmpeg import ProbeResult, StreamInfo
+from wagtailvideos.models import Video
+
+
+class TestFingerprint(TestCase):
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    @patch('wagtailvideos.runner.check_output')
+    def test_frame_hash(self, check_output, installed):
+        # Every row gets darker from left to right
+        check_output.return_value = bytes(range(9, 0, -1)) * 8
+        self.assertEqual(ffmpeg.get_frame_hash('/tmp/video.mp4', 1.5), 2 ** 64 - 1)
+        self.assertIn('1.500', check_output.call_args[0][0])
+
+        check_output.return_value = b''
+        self.assertIsNone(ffmpeg.get_frame_hash('/tmp/video.mp4', 1.5))
+
+    @override_settings(WAGTAILVIDEOS_FINGERPRINT_SAMPLES=4)
+    @patch('wagtailvideos.ffmpeg.get_frame_hash', side_effect=[1, 2, 3, 4])
+    def test_compute(self, get_frame_hash):
+        result = fingerprint.compute('/tmp/video.mp4', datetime.timedelta(seconds=8))
+        self.assertEqual(fingerprint.unpack(result), [1, 2, 3, 4])
+        self.assertEqual([call[0][1] for call in get_frame_hash.call_args_list], [1, 3, 5, 7])
+
+    def test_distance(self):
+        a = fingerprint.pack([0b1111, 0])
+        b = fingerprint.pack([0b0011, 0b1])
+        self.assertEqual(fingerprint.distance(a, b), 1.5)
+        self.assertIsNone(fingerprint.distance(a, fingerprint.pack([0])))
+        self.assertIsNone(fingerprint.distance(None, None))
+
+    def test_bands(self):
+        bands = fingerprint.get_bands(fingerprint.pack([0x0004000300020001, 0xffff]))
+        self.assertEqual(bands, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 0xffff), (5, 0), (6, 0), (7, 0)])
+
+
+class TestNearDuplicates(TestCase):
+    def create_video(self, title, hashes):
+        video = Video.objects.create(
+            title=title, file=create_test_video_file(), fingerprint=fingerprint.pack(hashes))
+        video.index_fingerprint()
+        return video
+
+    def test_find_near_duplicates(self):
+        video = self.create_video("Original", [0x0123456789abcdef, 0xfedcba9876543210])
+        reencode = self.create_video("Re-encode", [0x0123456789abcdee, 0xfedcba9876543211])
+        self.create_video("Different", [0x0123ffffffffffff, 0xffffffffffffffff])
+        self.create_video("Unrelated", [0, 0])
+
+        self.assertEqual(video.find_near_duplicates(), [(reencode, 1)])
+
+    def test_no_fingerprint(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        self.assertEqual(video.find_near_duplicates(), [])
+
+
+# The upload must not be matched with the original by its hash
+@override_settings(WAGTAILVIDEOS_DEDUPLICATE_UPLOADS=False)
+class TestUploadWarning(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.login()
+        self.original = Video.objects.create(
+            title="Original", file=create_test_video_file(), fingerprint=fingerprint.pack([1, 2]))
+        self.original.index_fingerprint()
+
+    def get_near_duplicates(self, video):
+        response = self.client.get(reverse('wagtailvideos:near_duplicates', args=[video.pk]))
+        return response.json()
+
+    @patch('wagtailvideos.models.chain')
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    @patch('wagtailvideos.ffmpeg.get_thumbnail', return_value=ContentFile(b'thumb', name='thumb.jpg'))
+    @patch('wagtailvideos.cache.probe', return_value=ProbeResult(
+        datetime.timedelta(seconds=10), 'mp4', None,
+        [StreamInfo(0, 'video', 'h264', 640, 480, 25.0, None, None, None)]))
+    def test_warning_once_fingerprinted(self, probe, get_thumbnail, installed, chain):
+        response = self.client.post(reverse('wagtailvideos:add_multiple'), {
+            'files[]': SimpleUploadedFile('copy.mp4', create_test_video_file().read(), "video/mp4"),
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        video = Video.objects.get(pk=response.json()['video_id'])
+        self.assertIn(reverse('wagtailvideos:near_duplicates', args=[video.pk]), response.json()['form'])
+
+        # Not fingerprinted yet
+        result = self.get_near_duplicates(video)
+        self.assertFalse(result['done'])
+        self.assertNotIn("looks like a copy of", result['html'])
+
+        with patch('wagtailvideos.fingerprint.compute', return_value=fingerprint.pack([1, 3])):
+            tasks.get_video_metadata(video.pk)
+        result = self.get_near_duplicates(video)
+        self.assertTrue(result['done'])
+        self.assertIn("looks like a copy of", result['html'])
+        self.assertIn(reverse('wagtailvideos:edit', args=[self.original.pk]), result['html'])
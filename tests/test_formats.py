@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+
+from tests.utils import create_test_video_file
+from wagtailvideos import formats
+from wagtailvideos.forms import VideoTranscodeAdminForm
+from wagtailvideos.models import MediaFormats, Video, VideoQuality
+
+
+class TestFormats(TestCase):
+    def test_builtin(self):
+        self.assertEqual(
+            list(formats.get_formats()),
+            ['webm', 'mp4', 'ogg', 'default', 'hls', 'vp9', 'av1', 'hevc'])
+
+    def test_args(self):
+        vp9 = formats.get_format('vp9')
+        args = vp9.get_ffmpeg_args(VideoQuality.highest)
+        self.assertEqual(args[args.index('-crf') + 1], '24')
+        self.assertIn('libopus', args)
+        self.assertEqual(vp9.get_mime_type(), 'video/webm; codecs="vp9, opus"')
+        self.assertEqual(formats.get_format('mp4').get_mime_type(), 'video/mp4')
+        self.assertEqual(formats.get_format('webm').get_mime_type(), 'video/webm')
+        # Not audio/ogg, which the mime type database may have for .ogg
+        self.assertEqual(formats.get_format('ogg').get_mime_type(), 'video/ogg')
+
+    def test_old_enum(self):
+        self.assertEqual(formats.get_format(MediaFormats.webm).name, 'webm')
+        self.assertIsNone(formats.get_format('nope'))
+
+    @override_settings(WAGTAILVIDEOS_AV1_ENCODER='libaom-av1')
+    def test_av1_encoder(self):
+        self.assertIn('libaom-av1', formats.get_format('av1').get_ffmpeg_args(VideoQuality.default))
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_COMPRESSION_ARGS=None)
+    def test_default_not_configured(self):
+        self.assertIsNone(formats.get_format('default').get_ffmpeg_args(VideoQuality.default))
+
+    @override_settings(WAGTAILVIDEOS_MEDIA_FORMATS={
+        'ogg': None,
+        'h264_high': {
+            'label': "H.264 High profile",
+            'extension': 'mp4',
+            'args': ['-codec:v', 'libx264', '-profile:v', 'high', '-crf', '{quality}'],
+            'quality_params': {'default': '23'},
+        },
+    })
+    def test_settings(self):
+        self.assertIsNone(formats.get_format('ogg'))
+        h264_high = formats.get_format('h264_high')
+        self.assertEqual(
+            h264_high.get_ffmpeg_args(VideoQuality.default),
+            ['-codec:v', 'libx264', '-profile:v', 'high', '-crf', '23'])
+
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        form = VideoTranscodeAdminForm(video=video)
+        choices = [name for name, label in form.fields['media_format'].choices]
+        self.assertIn('h264_high', choices)
+        self.assertNotIn('ogg', choices)
+
+    def test_encoder_profiles(self):
+        preview = formats.get_encoder_profile('preview')
+        mp4 = formats.get_format('mp4')
+        self.assertEqual(preview.get_args(mp4), ['-preset', 'ultrafast', '-vf', 'scale=-2:min(360\\,ih)'])
+        self.assertIn('realtime', preview.get_args(formats.get_format('webm')))
+        self.assertIs(preview.get_quality(VideoQuality.highest), VideoQuality.lowest)
+        self.assertEqual(formats.get_encoder_profile('final').get_args(mp4), [])
+
+    @override_settings(WAGTAILVIDEOS_ENCODER_PROFILES={
+        'final': {'preset': {'mp4': 'veryslow'}, 'tune': 'film', 'threads': 4, 'gop': 48},
+    })
+    def test_encoder_profile_settings(self):
+        final = formats.get_encoder_profile('final')
+        self.assertEqual(
+            final.get_args(formats.get_format('mp4')),
+            ['-preset', 'veryslow', '-tune', 'film', '-threads', '4', '-g', '48'])
+        self.assertNotIn('-preset', final.get_args(formats.get_format('webm')))
+
+    @override_settings(WAGTAILVIDEOS_ENCODER_PROFILES={'final': {'bitrate': '2M'}})
+    def test_encoder_profile_bitrate(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        transcode = video.transcodes.create(media_format='mp4')
+        args, output_file = formats.get_format('mp4').get_output(
+            transcode, '/tmp', formats.get_encoder_profile('final'))
+        self.assertNotIn('-crf', args)
+        self.assertEqual(args[args.index('-b:v') + 1], '2M')
+        self.assertEqual(transcode.quality_param, '')
+
+    @override_settings(WAGTAILVIDEOS_ENCODER_PROFILES={'final': {'two_pass': True}})
+    def test_two_pass_needs_bitrate(self):
+        with self.assertRaises(ImproperlyConfigured):
+            formats.get_encoder_profile('final')
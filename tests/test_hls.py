@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from tests.utils import create_test_video_file
+from wagtailvideos import hls
+from wagtailvideos.models import Video, VideoTranscode
+
+
+class TestHLS(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(
+            title="Test video", file=create_test_video_file(),
+            container='mp4', video_codec='h264', audio_codec='aac', height=720)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ladder_fits_video(self):
+        self.assertEqual([rendition[0] for rendition in hls.get_ladder(720)], [720, 480, 360])
+        self.assertEqual([rendition[0] for rendition in hls.get_ladder(240)], [360])
+        self.assertEqual(len(hls.get_ladder()), 4)
+
+    def test_output(self):
+        args, output_file = hls.get_output(self.video, self.directory)
+
+        self.assertEqual(output_file, os.path.join(self.directory, 'stream_%v.m3u8'))
+        self.assertEqual(args[args.index('-var_stream_map') + 1], 'v:0,a:0 v:1,a:1 v:2,a:2')
+        self.assertEqual(args[args.index('-filter:v:1') + 1], 'scale=-2:480')
+        self.assertEqual(args[args.index('-hls_segment_type') + 1], 'mpegts')
+
+    @override_settings(WAGTAILVIDEOS_HLS_SEGMENT_TYPE='fmp4')
+    def test_output_without_audio(self):
+        self.video.audio_codec = ''
+        args, output_file = hls.get_output(self.video, self.directory)
+
+        self.assertEqual(args[args.index('-var_stream_map') + 1], 'v:0 v:1 v:2')
+        self.assertNotIn('0:a:0', args)
+        self.assertIn('-hls_fmp4_init_filename', args)
+
+    def test_save_and_delete(self):
+        for filename in ['master.m3u8', 'stream_0.m3u8', 'stream_0_00000.ts']:
+            with open(os.path.join(self.directory, filename), 'w') as f:
+                f.write(filename)
+        transcode = self.video.transcodes.create(media_format='hls')
+        transcode.save_output(os.path.join(self.directory, 'stream_%v.m3u8'))
+        transcode.save()
+
+        storage = transcode.file.storage
+        stored_dir = os.path.dirname(transcode.file.name)
+        self.assertTrue(transcode.file.name.endswith('/master.m3u8'))
+        self.assertEqual(sorted(storage.listdir(stored_dir)[1]),
+                         ['master.m3u8', 'stream_0.m3u8', 'stream_0_00000.ts'])
+        self.assertIn("type='application/x-mpegURL'", self.video.video_tag())
+
+        VideoTranscode.objects.get(pk=transcode.pk).delete()
+        self.assertEqual(storage.listdir(stored_dir)[1], [])
@@ -0,0 +1,85 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import leases, tasks
+from wagtailvideos.models import TranscodeErrorType, Video, VideoTranscode
+
+
+class TestLeases(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(title="Test video", file=create_test_video_file())
+        self.transcode = self.video.transcodes.create(media_format='webm')
+
+    def expire(self, transcode):
+        VideoTranscode.objects.filter(pk=transcode.pk).update(
+            lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_claim_is_exclusive(self):
+        other = VideoTranscode.objects.get(pk=self.transcode.pk)
+        self.assertTrue(leases.claim(self.transcode, 'first'))
+        self.assertFalse(leases.claim(other, 'second'))
+        self.assertEqual(VideoTranscode.objects.get(pk=self.transcode.pk).lease_owner, 'first')
+
+        self.expire(self.transcode)
+        self.assertTrue(leases.claim(other, 'second'))
+        self.assertFalse(leases.is_held(self.transcode))
+        self.assertTrue(leases.is_held(other))
+
+    @override_settings(WAGTAILVIDEOS_TRANSCODE_LEASE=60)
+    def test_renew(self):
+        leases.claim(self.transcode, 'owner')
+        self.expire(self.transcode)
+        leases.renew([self.transcode])
+        expires_at = VideoTranscode.objects.get(pk=self.transcode.pk).lease_expires_at
+        self.assertGreater(expires_at, timezone.now() + datetime.timedelta(seconds=50))
+
+    def test_lock_skips_held_transcodes(self):
+        leases.claim(self.transcode, 'someone else')
+        self.assertEqual(self.video.lock_transcodes(['webm', 'mp4']), [self.video.transcodes.get(media_format='mp4')])
+
+    @patch('wagtailvideos.models.VideoTranscode.run_transcodings')
+    def test_task_skips_handed_on_transcodes(self, run_transcodings):
+        leases.claim(self.transcode, 'new owner')
+        tasks.transcoding_task(self.transcode.pk, lease_owner='old owner')
+        self.assertFalse(run_transcodings.called)
+
+        tasks.transcoding_task(self.transcode.pk, lease_owner='new owner')
+        self.assertEqual(run_transcodings.call_args[0][0], [self.transcode])
+
+    @patch('wagtailvideos.models.transcoding_task')
+    def test_reaper_requeues(self, transcoding_task):
+        leases.claim(self.transcode, 'crashed', attempts=1)
+        tasks.reap_expired_leases()
+        self.assertFalse(transcoding_task.apply_async.called)
+
+        self.expire(self.transcode)
+        tasks.reap_expired_leases()
+        transcode = VideoTranscode.objects.get(pk=self.transcode.pk)
+        self.assertEqual(transcode.attempts, 2)
+        self.assertNotEqual(transcode.lease_owner, 'crashed')
+        transcoding_task.apply_async.assert_called_once_with(
+            args=[transcode.pk], kwargs={'stage': 'final', 'lease_owner': transcode.lease_owner}, priority=3)
+
+    @override_settings(WAGTAILVIDEOS_MAX_TRANSCODE_ATTEMPTS=2)
+    @patch('wagtailvideos.models.transcoding_task')
+    def test_reaper_gives_up(self, transcoding_task):
+        leases.claim(self.transcode, 'crashed', attempts=2)
+        self.expire(self.transcode)
+        tasks.reap_expired_leases()
+
+        transcode = VideoTranscode.objects.get(pk=self.transcode.pk)
+        self.assertFalse(transcode.processing)
+        self.assertIs(transcode.error_type, TranscodeErrorType.abandoned)
+        self.assertFalse(transcoding_task.apply_async.called)
+
+    @patch('wagtailvideos.models.transcoding_task')
+    def test_stuck_rows_without_lease_are_reaped(self, transcoding_task):
+        VideoTranscode.objects.filter(pk=self.transcode.pk).update(processing=True)
+        tasks.reap_expired_leases()
+        self.assertTrue(transcoding_task.apply_async.called)
@@ -0,0 +1,338 @@
+from __future__ import unicode_literals
+
+import datetime
+import os
+import subprocess
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import capabilities, formats, leases, tasks
+from wagtailvideos.models import (
+    ProcessingStatus, TranscodeErrorType, TranscodeStage, ValidationStatus,
+    Video, VideoTranscode,
+)
+
+
+def upload(title):
+    video = Video(title=title)
+    video.file = create_test_video_file()
+    video.save()
+    return video
+
+
+@patch('wagtailvideos.models.chain')
+class TestDeduplication(TestCase):
+    def setUp(self):
+        self.original = Video.objects.create(
+            title="Original", file=create_test_video_file(),
+            thumbnail=ContentFile(b'thumb', name='small_thumb.jpg'),
+            duration=datetime.timedelta(seconds=5), video_codec='h264', width=320, height=240)
+        self.original.transcodes.create(
+            media_format='webm', file=ContentFile(b'webm', name='small.webm'))
+
+    def test_content_hash(self, chain):
+        self.assertEqual(len(self.original.content_hash), 64)
+
+    def test_reuses_original(self, chain):
+        video = upload("Duplicate")
+
+        self.assertEqual(video.file.name, self.original.file.name)
+        self.assertEqual(video.thumbnail.name, self.original.thumbnail.name)
+        self.assertEqual(video.duration, self.original.duration)
+        self.assertEqual(video.video_codec, 'h264')
+        transcode = video.transcodes.get()
+        self.assertEqual(transcode.media_format, 'webm')
+        self.assertEqual(transcode.file.name, self.original.transcodes.get().file.name)
+        self.assertFalse(chain.called)
+
+    def test_original_still_processing(self, chain):
+        self.original.thumbnail = None
+        self.original.save()
+        self.original.transcodes.all().delete()
+        upload("Duplicate")
+
+        metadata, transcodes = chain.call_args[0]
+        self.assertEqual(metadata.task, 'wagtailvideos.tasks.get_video_metadata')
+        self.assertEqual(
+            [job.task for job in transcodes.tasks], ['wagtailvideos.tasks.schedule_default_transcode'])
+
+    def test_copied_from_original_still_processing(self, chain):
+        self.original.processing_status = ProcessingStatus.processing
+        self.original.save()
+        video = upload("Duplicate")
+
+        self.assertFalse(chain.called)
+        self.assertIs(Video.objects.get(pk=video.pk).processing_status, ProcessingStatus.ready)
+
+    def test_original_pending_validation(self, chain):
+        self.original.validation_status = ValidationStatus.pending
+        self.original.save()
+        video = upload("Copy")
+        self.assertNotEqual(video.file.name, self.original.file.name)
+
+    @override_settings(WAGTAILVIDEOS_DEDUPLICATE_UPLOADS=False)
+    def test_disabled(self, chain):
+        video = upload("Copy")
+        self.assertNotEqual(video.file.name, self.original.file.name)
+        self.assertEqual(video.content_hash, self.original.content_hash)
+
+    def test_delete_keeps_shared_files(self, chain):
+        video = upload("Duplicate")
+        storage = video.file.storage
+        names = [video.file.name, video.thumbnail.name, video.transcodes.get().file.name]
+
+        video.delete()
+        for name in names:
+            self.assertTrue(storage.exists(name))
+
+        self.original.delete()
+        for name in names:
+            self.assertFalse(storage.exists(name))
+
+
+def fake_ffmpeg(args, **kwargs):
+    # Write every output file
+    for arg in args[args.index('-i') + 2:]:
+        if arg.startswith('/') and not os.path.exists(arg):
+            with open(arg, 'wb') as f:
+                f.write(b'transcoded')
+    return b''
+
+
+@override_settings(WAGTAILVIDEOS_SOURCE_CACHE_SIZE=0)
+# Whatever ffmpeg is installed here does not matter
+@patch('wagtailvideos.capabilities.get_capabilities', new=capabilities.Capabilities)
+@patch('wagtailvideos.progress.run', side_effect=fake_ffmpeg)
+class TestRunTranscoding(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(title="Test video", file=create_test_video_file())
+
+    def test_saved_to_storage(self, check_output):
+        transcode = self.video.transcodes.create(media_format='webm', processing=True)
+        transcode.run_transcoding()
+
+        transcode = VideoTranscode.objects.get(pk=transcode.pk)
+        self.assertFalse(transcode.processing)
+        self.assertEqual(transcode.progress, 100)
+        self.assertTrue(transcode.file.name.startswith('video_transcodes/small'))
+        self.assertTrue(transcode.file.name.endswith('.webm'))
+        self.assertEqual(transcode.file.read(), b'transcoded')
+        output_file = check_output.call_args[0][0][-1]
+        self.assertFalse(os.path.exists(os.path.dirname(output_file)))
+
+    def test_replaces_old_file(self, check_output):
+        transcode = self.video.transcodes.create(
+            media_format='webm', file=ContentFile(b'old', name='small.webm'))
+        storage = transcode.file.storage
+        old_name = transcode.file.name
+        transcode.run_transcoding()
+
+        # The old file is only removed once the new one is in place
+        self.assertNotEqual(transcode.file.name, old_name)
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(transcode.file.name))
+
+    def test_single_decode(self, check_output):
+        transcodes = [
+            self.video.transcodes.create(media_format=media_format, processing=True)
+            for media_format in ['webm', 'mp4']]
+        VideoTranscode.run_transcodings(transcodes)
+
+        self.assertEqual(check_output.call_count, 1)
+        args = check_output.call_args[0][0]
+        self.assertEqual(args.count('-i'), 1)
+        self.assertIn('libvpx', args)
+        self.assertIn('libx264', args)
+        for transcode in VideoTranscode.objects.all():
+            self.assertFalse(transcode.processing)
+            self.assertEqual(transcode.file.read(), b'transcoded')
+
+    def test_failure_retried_per_output(self, check_output):
+        def fail_webm(args, **kwargs):
+            if 'libvpx' in args:
+                raise subprocess.CalledProcessError(1, args, output='no libvpx')
+            return fake_ffmpeg(args)
+        check_output.side_effect = fail_webm
+
+        webm, mp4 = [
+            self.video.transcodes.create(media_format=media_format, processing=True)
+            for media_format in ['webm', 'mp4']]
+        VideoTranscode.run_transcodings([webm, mp4])
+
+        self.assertEqual(check_output.call_count, 3)
+        webm, mp4 = VideoTranscode.objects.get(pk=webm.pk), VideoTranscode.objects.get(pk=mp4.pk)
+        self.assertEqual(webm.error_message, 'no libvpx')
+        self.assertIs(webm.error_type, TranscodeErrorType.unknown)
+        self.assertFalse(webm.file)
+        self.assertEqual(mp4.error_message, '')
+        self.assertIsNone(mp4.error_type)
+        self.assertTrue(mp4.file)
+
+    def test_lost_lease(self, check_output):
+        transcode = self.video.transcodes.create(media_format='webm')
+        leases.claim(transcode, 'stalled')
+
+        def hand_on(args, **kwargs):
+            VideoTranscode.objects.filter(pk=transcode.pk).update(lease_owner='another worker')
+            return fake_ffmpeg(args)
+        check_output.side_effect = hand_on
+        transcode.run_transcoding()
+
+        transcode = VideoTranscode.objects.get(pk=transcode.pk)
+        self.assertTrue(transcode.processing)
+        self.assertEqual(transcode.lease_owner, 'another worker')
+        self.assertFalse(transcode.file)
+
+    def test_lease_lost_while_saving(self, check_output):
+        transcode = self.video.transcodes.create(media_format='webm')
+        leases.claim(transcode, 'stalled')
+        save_output = formats.MediaFormat.save_output
+        stored = []
+
+        def hand_on(media_format, transcode, output_file):
+            save_output(media_format, transcode, output_file)
+            stored.append(transcode.file.name)
+            VideoTranscode.objects.filter(pk=transcode.pk).update(lease_owner='another worker')
+        with patch('wagtailvideos.formats.MediaFormat.save_output', new=hand_on):
+            transcode.run_transcoding()
+
+        transcode = VideoTranscode.objects.get(pk=transcode.pk)
+        self.assertTrue(transcode.processing)
+        self.assertEqual(transcode.lease_owner, 'another worker')
+        self.assertFalse(transcode.file)
+        self.assertFalse(transcode.file.storage.exists(stored[0]))
+
+    def test_disk_full_not_retried(self, check_output):
+        check_output.side_effect = subprocess.CalledProcessError(
+            1, ['ffmpeg'], output=b'Error writing trailer: No space left on device')
+
+        transcodes = [
+            self.video.transcodes.create(media_format=media_format, processing=True)
+            for media_format in ['webm', 'mp4']]
+        VideoTranscode.run_transcodings(transcodes)
+
+        self.assertEqual(check_output.call_count, 1)
+        for transcode in VideoTranscode.objects.all():
+            self.assertIs(transcode.error_type, TranscodeErrorType.disk_full)
+            self.assertEqual(transcode.error_message, 'Error writing trailer: No space left on device')
+
+    @override_settings(WAGTAILVIDEOS_MULTI_OUTPUT_TRANSCODING=False)
+    def test_multi_output_disabled(self, check_output):
+        transcodes = [
+            self.video.transcodes.create(media_format=media_format, processing=True)
+            for media_format in ['webm', 'mp4']]
+        VideoTranscode.run_transcodings(transcodes)
+        self.assertEqual(check_output.call_count, 2)
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4', 'webm'])
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    def test_schedule_default_transcode(self, installed, check_output):
+        tasks.schedule_default_transcode(self.video.pk)
+
+        self.assertEqual(check_output.call_count, 1)
+        self.assertEqual(
+            sorted(t.media_format for t in self.video.transcodes.filter(processing=False)),
+            ['mp4', 'webm'])
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4', 'webm'])
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    def test_last_job_finalises(self, installed, check_output):
+        Video.objects.filter(pk=self.video.pk).update(processing_status=ProcessingStatus.processing)
+
+        tasks.schedule_default_transcode(self.video.pk, 'mp4', finalise=True)
+        self.assertIs(Video.objects.get(pk=self.video.pk).processing_status, ProcessingStatus.processing)
+        tasks.schedule_default_transcode(self.video.pk, 'webm', finalise=True)
+        self.assertIs(Video.objects.get(pk=self.video.pk).processing_status, ProcessingStatus.ready)
+
+    @override_settings(WAGTAILVIDEOS_SEGMENT_DURATION=60)
+    @patch('wagtailvideos.cache.probe', return_value=None)
+    @patch('wagtailvideos.segments.transcode', side_effect=lambda input_file, outputs, *args, **kwargs: [
+        fake_ffmpeg(['-i', input_file, output_file]) for _, output_file in outputs])
+    def test_long_video_segmented(self, transcode, probe, check_output):
+        self.video.duration = datetime.timedelta(hours=2)
+        self.video.save()
+        self.video.transcodes.create(media_format='webm', processing=True).run_transcoding()
+
+        self.assertFalse(check_output.called)
+        self.assertEqual(transcode.call_count, 1)
+        self.assertEqual(self.video.transcodes.get().file.read(), b'transcoded')
+
+    def test_remux(self, check_output):
+        self.video.container = 'mov,mp4,m4a,3gp,3g2,mj2'
+        self.video.video_codec = 'h264'
+        self.video.audio_codec = 'aac'
+        self.video.save()
+        mp4, webm = [
+            self.video.transcodes.create(media_format=media_format, processing=True)
+            for media_format in ['mp4', 'webm']]
+        VideoTranscode.run_transcodings([mp4, webm])
+
+        args = check_output.call_args[0][0]
+        self.assertNotIn('libx264', args)
+        self.assertIn('+faststart', args)
+        self.assertIn('libvpx', args)
+        self.assertTrue(VideoTranscode.objects.get(pk=mp4.pk).remuxed)
+        self.assertFalse(VideoTranscode.objects.get(pk=webm.pk).remuxed)
+
+    def test_no_remux_for_incompatible_audio(self, check_output):
+        self.video.container = 'mov,mp4,m4a,3gp,3g2,mj2'
+        self.video.video_codec = 'h264'
+        self.video.audio_codec = 'pcm_s16le'
+        self.video.save()
+        transcode = self.video.transcodes.create(media_format='mp4', processing=True)
+        self.assertFalse(transcode.can_remux())
+
+    @override_settings(WAGTAILVIDEOS_ENCODER_PROFILES={'final': {'two_pass': True, 'bitrate': '2M'}})
+    def test_two_pass(self, check_output):
+        self.video.transcodes.create(media_format='mp4', processing=True).run_transcoding()
+
+        first_pass, second_pass = [call[0][0] for call in check_output.call_args_list]
+        self.assertEqual(first_pass[first_pass.index('-pass') + 1], '1')
+        # Written nowhere, so there is no file for ffmpeg to refuse to overwrite
+        self.assertEqual(first_pass[-3:], ['-f', 'null', '-'])
+        self.assertEqual(second_pass[second_pass.index('-pass') + 1], '2')
+        self.assertEqual(
+            first_pass[first_pass.index('-passlogfile') + 1],
+            second_pass[second_pass.index('-passlogfile') + 1])
+        # x264 refuses a constant rate factor in the second pass
+        for args in [first_pass, second_pass]:
+            self.assertNotIn('-crf', args)
+            self.assertEqual(args[args.index('-b:v') + 1], '2M')
+        self.assertEqual(self.video.transcodes.get().file.read(), b'transcoded')
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4'],
+                       WAGTAILVIDEOS_TWO_STAGE_TRANSCODING=True)
+    @patch('wagtailvideos.models.transcoding_task')
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    def test_two_stage(self, installed, transcoding_task, check_output):
+        tasks.schedule_default_transcode(self.video.pk)
+
+        args = check_output.call_args[0][0]
+        self.assertEqual(args[args.index('-preset', args.index('slow')) + 1], 'ultrafast')
+        self.assertEqual(args[args.index('-crf') + 1], '28')
+        transcode = self.video.transcodes.get()
+        self.assertIs(transcode.stage, TranscodeStage.preview)
+        # The preview is served while the final encode is queued
+        self.assertTrue(transcode.processing)
+        self.assertIn(transcode.url, self.video.video_tag())
+        self.assertTrue(transcode.lease_owner)
+        transcoding_task.apply_async.assert_called_once_with(
+            args=[transcode.pk], kwargs={'stage': 'final', 'lease_owner': transcode.lease_owner}, priority=3)
+
+        tasks.transcoding_task(transcode.pk, stage='final', lease_owner=transcode.lease_owner)
+        transcode = self.video.transcodes.get()
+        self.assertIs(transcode.stage, TranscodeStage.final)
+        self.assertFalse(transcode.processing)
+        self.assertNotIn('ultrafast', check_output.call_args[0][0])
+
+    @override_settings(WAGTAILVIDEOS_FINAL_TRANSCODE_QUEUE='slow')
+    @patch('wagtailvideos.models.transcoding_task')
+    def test_final_transcode_queue(self, transcoding_task, check_output):
+        self.video.do_transcodes(['webm'])
+        transcode = self.video.transcodes.get()
+        transcoding_task.apply_async.assert_called_once_with(
+            args=[transcode.pk], kwargs={'stage': 'final', 'lease_owner': transcode.lease_owner},
+            queue='slow', priority=3)
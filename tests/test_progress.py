@@ -0,0 +1,101 @@
+from __future__ import unicode_literals
+
+import datetime
+import io
+import os
+import subprocess
+
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import progress
+from wagtailvideos.models import Video, VideoTranscode
+
+
+def fake_popen(lines, returncode=0):
+    process = MagicMock()
+    process.stdout = io.BytesIO(b''.join(line + b'\n' for line in lines))
+    process.wait.return_value = returncode
+    return process
+
+
+class TestRun(TestCase):
+    @patch('wagtailvideos.runner.subprocess.Popen')
+    def test_progress_blocks(self, popen):
+        popen.return_value = fake_popen([
+            b'Input #0, mov,mp4,m4a,3gp,3g2,mj2, from in.mp4:',
+            b'frame=10', b'out_time_us=500000', b'speed=2.5x', b'progress=continue',
+            b'frame=20', b'out_time_us=1000000', b'progress=end',
+        ])
+        blocks = []
+        output = progress.run(['ffmpeg', '-i', 'in.mp4', 'out.webm'], callback=lambda values: blocks.append(values))
+
+        command = popen.call_args[0][0]
+        self.assertEqual(command[:4], ['ffmpeg', '-nostats', '-progress', 'pipe:1'])
+        self.assertEqual([block['out_time_us'] for block in blocks], ['500000', '1000000'])
+        self.assertEqual(blocks[0]['speed'], '2.5x')
+        self.assertEqual(output, b'Input #0, mov,mp4,m4a,3gp,3g2,mj2, from in.mp4:\n')
+
+    @patch('wagtailvideos.runner.subprocess.Popen')
+    def test_failure(self, popen):
+        popen.return_value = fake_popen([b'Unknown encoder', b'progress=end'], returncode=1)
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            progress.run(['ffmpeg', '-i', 'in.mp4', 'out.webm'])
+        self.assertEqual(cm.exception.output, b'Unknown encoder\n')
+
+    @override_settings(WAGTAILVIDEOS_FFMPEG_LOG_LINES=2)
+    @patch('wagtailvideos.runner.subprocess.Popen')
+    def test_log_tail(self, popen):
+        popen.return_value = fake_popen([b'one', b'two', b'progress=end', b'three'], returncode=1)
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            progress.run(['ffmpeg', '-i', 'in.mp4', 'out.webm'])
+        self.assertEqual(cm.exception.output, b'two\nthree\n')
+
+    @patch('wagtailvideos.runner.kill')
+    @patch('wagtailvideos.runner.subprocess.Popen')
+    def test_timeout(self, popen, kill):
+        read_fd, write_fd = os.pipe()
+        process = MagicMock()
+        process.stdout = os.fdopen(read_fd, 'rb')
+        # Reading blocks until the process is killed
+        kill.side_effect = lambda process: os.close(write_fd)
+        popen.return_value = process
+
+        with self.assertRaises(subprocess.TimeoutExpired):
+            progress.run(['ffmpeg', '-i', 'in.mp4', 'out.webm'], timeout=0.1)
+        kill.assert_called_once_with(process)
+
+
+class TestProgressTracker(TestCase):
+    def setUp(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        self.transcode = video.transcodes.create(media_format='webm', processing=True)
+
+    @patch('wagtailvideos.progress.time.monotonic')
+    def test_stage(self, monotonic):
+        monotonic.side_effect = [0, 10]
+        tracker = progress.ProgressTracker([self.transcode], datetime.timedelta(seconds=100))
+        tracker.stage(0.5, 0.5)({'out_time_us': '40000000', 'progress': 'continue'})
+
+        transcode = VideoTranscode.objects.get(pk=self.transcode.pk)
+        self.assertEqual(transcode.progress, 70)
+        self.assertEqual(transcode.speed, 7)
+        self.assertEqual(transcode.eta, datetime.timedelta(seconds=4))
+
+    @override_settings(WAGTAILVIDEOS_PROGRESS_INTERVAL=5)
+    @patch('wagtailvideos.progress.time.monotonic')
+    def test_throttled(self, monotonic):
+        monotonic.side_effect = [0, 1, 2, 7]
+        tracker = progress.ProgressTracker([self.transcode], datetime.timedelta(seconds=100))
+        with patch.object(VideoTranscode.objects, 'filter', wraps=VideoTranscode.objects.filter) as filter:
+            tracker.report(0.1)
+            tracker.report(0.2)
+            tracker.report(0.3)
+        self.assertEqual(filter.call_count, 2)
+        self.assertEqual(VideoTranscode.objects.get(pk=self.transcode.pk).progress, 30)
+
+    def test_unknown_duration(self):
+        tracker = progress.ProgressTracker([self.transcode], None)
+        tracker.stage()({'out_time_us': '40000000'})
+        self.assertIsNone(VideoTranscode.objects.get(pk=self.transcode.pk).progress)
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+
+from django.test import TestCase
+from mock import patch
+
+from wagtailvideos import runner
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class TestRunner(TestCase):
+    def test_check_output(self):
+        self.assertEqual(runner.check_output(python('print("hello")')), b'hello\n')
+        self.assertEqual(
+            runner.check_output(python('import sys; sys.stdout.write(sys.stdin.read())'), input=b'data'),
+            b'data')
+
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            runner.check_output(python('print("partial"); raise SystemExit(2)'))
+        self.assertEqual(cm.exception.returncode, 2)
+        self.assertEqual(cm.exception.output, b'partial\n')
+
+    def test_timeout_kills_process_group(self):
+        # The child starts a grandchild that would outlive it
+        code = 'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]); ' \
+            'print("started", flush=True); time.sleep(30)'
+        start = time.monotonic()
+        with patch('wagtailvideos.runner.kill', wraps=runner.kill) as kill:
+            with self.assertRaises(subprocess.TimeoutExpired) as cm:
+                runner.check_output(python(code), timeout=1)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(cm.exception.output, b'started\n')
+        self.assertEqual(kill.call_count, 1)
+
+    def test_concurrency_limit(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        class FakeProcess(object):
+            def __init__(self, *args, **kwargs):
+                with lock:
+                    running.append(self)
+                    peak.append(len(running))
+
+            def poll(self):
+                return 0
+
+        def use_process():
+            with runner.popen(['ffmpeg']) as process:
+                time.sleep(0.05)
+                with lock:
+                    running.remove(process)
+
+        with patch('wagtailvideos.runner._semaphore', threading.BoundedSemaphore(2)), \
+                patch('wagtailvideos.runner.subprocess.Popen', FakeProcess):
+            runner.run_concurrently(*[use_process] * 6)
+        self.assertEqual(max(peak), 2)
+
+    def test_run_concurrently(self):
+        self.assertEqual(runner.run_concurrently(lambda: 1, lambda: 2), [1, 2])
+        with self.assertRaises(ValueError):
+            runner.run_concurrently(lambda: 1, lambda: int('x'))
+
+    def test_async(self):
+        loop = asyncio.new_event_loop()
+        try:
+            output = loop.run_until_complete(runner.check_output_async(python('print("hello")')))
+        finally:
+            loop.close()
+        self.assertEqual(output, b'hello\n')
@@ -0,0 +1,115 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import scheduling
+from wagtailvideos.models import ProcessingStatus, Video
+
+
+class TestScheduling(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.busy_user = User.objects.create_user('busy', 'busy@example.com', 'password')
+        self.other_user = User.objects.create_user('other', 'other@example.com', 'password')
+
+    def create_video(self, user, **kwargs):
+        return Video.objects.create(
+            title="Test video", file=create_test_video_file(), uploaded_by_user=user, **kwargs)
+
+    def test_kinds(self):
+        video = self.create_video(self.other_user)
+        self.assertGreater(
+            scheduling.get_priority(video, 'metadata'), scheduling.get_priority(video, 'preview'))
+        self.assertGreater(
+            scheduling.get_priority(video, 'preview'), scheduling.get_priority(video, 'encode'))
+        self.assertGreater(
+            scheduling.get_priority(video, 'encode', interactive=True), scheduling.get_priority(video, 'encode'))
+
+    def test_short_videos_first(self):
+        short = self.create_video(self.other_user, duration=datetime.timedelta(minutes=1))
+        long = self.create_video(self.other_user, duration=datetime.timedelta(hours=1))
+        self.assertGreater(scheduling.get_priority(short, 'encode'), scheduling.get_priority(long, 'encode'))
+
+    @override_settings(WAGTAILVIDEOS_FAIR_SHARE_STEP=2, WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4'],
+                       WAGTAILVIDEOS_DEDUPLICATE_UPLOADS=False)
+    @patch('wagtailvideos.scheduling.can_join', return_value=False)
+    @patch('wagtailvideos.models.chain')
+    def test_fair_share(self, chain, can_join):
+        for i in range(5):
+            self.upload(self.busy_user)
+        other = self.upload(self.other_user)
+
+        # Nothing has been picked up by a worker yet
+        self.assertEqual(scheduling.get_backlog(other), 1)
+        priorities = [call[0][1].tasks[0].options['priority'] for call in chain.call_args_list]
+        self.assertEqual(priorities, [3, 3, 2, 2, 1, 3])
+
+    @override_settings(WAGTAILVIDEOS_TASK_PRIORITY_LOW_FIRST=True)
+    def test_low_first(self):
+        video = self.create_video(self.other_user)
+        self.assertEqual(scheduling.get_priority(video, 'metadata'), 9 - scheduling.BASE_PRIORITIES['metadata'])
+
+    @override_settings(WAGTAILVIDEOS_TASK_QUEUES={'metadata': 'fast', 'encode': 'slow'})
+    def test_queues(self):
+        video = self.create_video(self.other_user)
+        self.assertEqual(scheduling.get_options(video, 'metadata')['queue'], 'fast')
+        self.assertEqual(scheduling.get_options(video, 'encode')['queue'], 'slow')
+        self.assertNotIn('queue', scheduling.get_options(video, 'preview'))
+
+    def upload(self, user=None):
+        video = Video(title="Test video", uploaded_by_user=user or self.other_user)
+        video.file = create_test_video_file()
+        video.save()
+        return video
+
+    @override_settings(WAGTAILVIDEOS_TASK_QUEUES={'metadata': 'fast', 'encode': 'slow'},
+                       WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4', 'webm'])
+    @patch('wagtailvideos.scheduling.can_join', return_value=True)
+    @patch('wagtailvideos.models.chain')
+    def test_upload_fans_out(self, chain, can_join):
+        video = self.upload()
+        metadata, transcodes = chain.call_args[0]
+
+        self.assertIs(video.processing_status, ProcessingStatus.processing)
+        self.assertEqual(metadata.options['queue'], 'fast')
+        self.assertEqual([job.args for job in transcodes.tasks], [(video.pk, 'mp4'), (video.pk, 'webm')])
+        self.assertEqual([job.options['queue'] for job in transcodes.tasks], ['slow', 'slow'])
+        self.assertFalse(transcodes.tasks[0].kwargs['finalise'])
+        self.assertEqual(transcodes.body.task, 'wagtailvideos.tasks.finalise_video')
+        self.assertEqual(transcodes.body.options['queue'], 'fast')
+        # Every job marks the video as failed if it raises
+        for job in [metadata, transcodes.body] + list(transcodes.tasks):
+            self.assertEqual(
+                [errback['task'] for errback in job.options['link_error']],
+                ['wagtailvideos.tasks.video_processing_failed'])
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4', 'webm'],
+                       WAGTAILVIDEOS_FAN_OUT_TRANSCODES=False)
+    @patch('wagtailvideos.scheduling.can_join', return_value=True)
+    @patch('wagtailvideos.models.chain')
+    def test_fan_out_disabled(self, chain, can_join):
+        video = self.upload()
+        metadata, transcodes = chain.call_args[0]
+        self.assertEqual([job.args for job in transcodes.tasks], [(video.pk, 'mp4', 'webm')])
+
+    @override_settings(WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS=['mp4', 'webm'])
+    @patch('wagtailvideos.scheduling.can_join', return_value=False)
+    @patch('wagtailvideos.models.chain')
+    def test_upload_without_result_backend(self, chain, can_join):
+        self.upload()
+        metadata, transcodes = chain.call_args[0]
+        # The jobs finalise the video themselves
+        self.assertEqual(transcodes.task, 'celery.group')
+        self.assertTrue(all(job.kwargs['finalise'] for job in transcodes.tasks))
+
+    @patch('wagtailvideos.models.transcoding_task')
+    def test_editor_requested(self, transcoding_task):
+        video = self.create_video(self.other_user)
+        video.do_transcode('webm', video.transcodes.model._meta.get_field('quality').default)
+        priority = transcoding_task.apply_async.call_args[1]['priority']
+        self.assertEqual(priority, scheduling.get_priority(video, 'encode', interactive=True))
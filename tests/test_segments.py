@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+import datetime
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from wagtailvideos import segments
+
+
+def fake_run(command):
+    output = command[-1]
+    if 'segment' in command:
+        for n in range(3):
+            open(output % n, 'wb').close()
+    else:
+        open(output, 'wb').close()
+    return b''
+
+
+@override_settings(WAGTAILVIDEOS_SEGMENT_DURATION=60)
+class TestSegments(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_segment(self):
+        self.assertFalse(segments.should_segment(datetime.timedelta(seconds=119)))
+        self.assertTrue(segments.should_segment(datetime.timedelta(hours=2)))
+        self.assertFalse(segments.should_segment(None))
+        with override_settings(WAGTAILVIDEOS_SEGMENT_DURATION=None):
+            self.assertFalse(segments.should_segment(datetime.timedelta(hours=2)))
+
+    @patch('wagtailvideos.segments.run', side_effect=fake_run)
+    def test_transcode(self, run):
+        output_file = os.path.join(self.directory, 'out.webm')
+        segments.transcode('/tmp/in.mp4', [(['-codec:v', 'libvpx'], output_file)], self.directory)
+
+        commands = [call[0][0] for call in run.call_args_list]
+        split, audio, concat = commands[0], commands[1], commands[-1]
+        self.assertIn('segment', split)
+        self.assertIn('-vn', audio)
+        encodes = commands[2:-1]
+        self.assertEqual(len(encodes), 3)
+        for command in encodes:
+            self.assertIn('-an', command)
+            self.assertIn('libvpx', command)
+        self.assertEqual(concat[concat.index('-f') + 1], 'concat')
+        self.assertEqual(concat[-3:], ['-codec', 'copy', output_file])
+        with open(concat[concat.index('-f') + 5]) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    @patch('wagtailvideos.segments.run', side_effect=fake_run)
+    def test_transcode_without_audio(self, run):
+        output_file = os.path.join(self.directory, 'out.webm')
+        segments.transcode('/tmp/in.mp4', [([], output_file)], self.directory, has_audio=False)
+
+        commands = [call[0][0] for call in run.call_args_list]
+        self.assertFalse(any('-vn' in command for command in commands))
+        self.assertNotIn('1:a', commands[-1])
+
+    @override_settings(WAGTAILVIDEOS_SEGMENT_RETRIES=1)
+    @patch('wagtailvideos.segments.run')
+    def test_segment_retry(self, run):
+        run.side_effect = [subprocess.CalledProcessError(1, 'ffmpeg'), b'']
+        segments.encode_segment('/tmp/source_00000.mkv', [], '/tmp/out.webm')
+        self.assertEqual(run.call_count, 2)
+
+        run.side_effect = subprocess.CalledProcessError(1, 'ffmpeg')
+        with self.assertRaises(subprocess.CalledProcessError):
+            segments.encode_segment('/tmp/source_00000.mkv', [], '/tmp/out.webm')
@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import stat
+import struct
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.test_ffmpeg import PROBE_OUTPUT
+from tests.utils import create_test_video_file
+from wagtailvideos import cache, sources
+from wagtailvideos.models import Video
+from wagtailvideos.sources import open_source
+
+
+def box(box_type, payload=b''):
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+
+# An mp4 written with +faststart, which can be read without seeking
+FASTSTART = box(b'ftyp', b'isom') + box(b'moov', b'x' * 16) + box(b'mdat', b'x' * 200000)
+
+
+@override_settings(WAGTAILVIDEOS_SOURCE_CACHE_SIZE=0)
+class TestOpenSource(TestCase):
+    def create_video(self, content):
+        return Video.objects.create(title="Test video", file=ContentFile(content, name='video.mp4'))
+
+    def test_stream(self):
+        video = self.create_video(FASTSTART)
+        with open_source(video.file) as path:
+            self.assertTrue(stat.S_ISFIFO(os.stat(path).st_mode))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), FASTSTART)
+        self.assertFalse(os.path.exists(path))
+
+    def test_stream_not_read(self):
+        video = self.create_video(FASTSTART)
+        with open_source(video.file) as path:
+            pass
+        self.assertFalse(os.path.exists(path))
+
+    def test_seekable_is_downloaded(self):
+        video = self.create_video(FASTSTART)
+        with open_source(video.file, seekable=True) as path:
+            self.assertTrue(os.path.isfile(path))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), FASTSTART)
+
+    def test_moov_at_end_is_downloaded(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        with open_source(video.file) as path:
+            self.assertTrue(os.path.isfile(path))
+
+    @override_settings(MEDIA_URL='https://media.example.com/')
+    def test_url(self):
+        video = self.create_video(FASTSTART)
+        with open_source(video.file, seekable=True) as path:
+            self.assertEqual(path, 'https://media.example.com/' + video.file.name)
+
+    @override_settings(MEDIA_URL='https://media.example.com/')
+    @patch('wagtailvideos.ffmpeg.installed', return_value=True)
+    @patch('wagtailvideos.runner.check_output', return_value=PROBE_OUTPUT)
+    def test_probe_url(self, check_output, installed):
+        video = self.create_video(FASTSTART)
+        with open_source(video.file) as path:
+            result = cache.probe(path)
+        self.assertEqual(check_output.call_args[0][0][-1], path)
+        self.assertEqual(result.video_codec, 'h264')
+
+
+class TestSourceCache(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = override_settings(WAGTAILVIDEOS_SOURCE_CACHE_DIR=self.cache_dir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def create_video(self, content, name='video.mp4'):
+        return Video.objects.create(title="Test video", file=ContentFile(content, name=name))
+
+    def test_download_once(self):
+        video = Video.objects.create(title="Test video", file=create_test_video_file())
+        with patch('wagtailvideos.sources.download', wraps=sources.download) as download:
+            with sources.get_local_file(video.file) as first:
+                with open_source(video.file) as second:
+                    self.assertEqual(first, second)
+            with open_source(Video.objects.get(pk=video.pk).file, seekable=True) as third:
+                self.assertEqual(first, third)
+        self.assertEqual(download.call_count, 1)
+        self.assertTrue(first.startswith(self.cache_dir))
+
+    def test_evicts_least_recently_used(self):
+        source_cache = sources.SourceCache(self.cache_dir, 250)
+        old, used, new = [self.create_video(b'x' * 100, name) for name in ['a.mp4', 'b.mp4', 'c.mp4']]
+        with source_cache.get_file(old.file) as old_path:
+            pass
+        with source_cache.get_file(used.file) as used_path:
+            # Make sure the copies have different ages
+            os.utime(old_path, (0, 0))
+            with source_cache.get_file(new.file) as new_path:
+                pass
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(used_path))
+        self.assertTrue(os.path.exists(new_path))
+
+    def test_in_use_not_evicted(self):
+        source_cache = sources.SourceCache(self.cache_dir, 150)
+        first, second = [self.create_video(b'x' * 100, name) for name in ['a.mp4', 'b.mp4']]
+        with source_cache.get_file(first.file) as first_path:
+            with source_cache.get_file(second.file):
+                self.assertTrue(os.path.exists(first_path))
+
+    def test_no_lock_files_left(self):
+        source_cache = sources.SourceCache(self.cache_dir, 150)
+        first, second = [self.create_video(b'x' * 100, name) for name in ['a.mp4', 'b.mp4']]
+        with source_cache.get_file(first.file, download=False) as path:
+            self.assertIsNone(path)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+        with source_cache.get_file(first.file) as first_path:
+            os.utime(first_path, (0, 0))
+        # Left behind by a worker that was stopped
+        open(os.path.join(self.cache_dir, 'gone.mp4.lock'), 'w').close()
+        with source_cache.get_file(second.file) as second_path:
+            pass
+        name = os.path.basename(second_path)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), [name, name + '.lock'])
+
+    @override_settings(MEDIA_URL='https://media.example.com/')
+    def test_cached_before_url(self):
+        video = self.create_video(FASTSTART)
+        with patch('wagtailvideos.sources.download', wraps=sources.download) as download:
+            with open_source(video.file) as path:
+                self.assertEqual(path, 'https://media.example.com/' + video.file.name)
+            with open_source(video.file, seekable=True) as first:
+                self.assertTrue(first.startswith(self.cache_dir))
+            with open_source(video.file) as second:
+                self.assertEqual(first, second)
+        self.assertEqual(download.call_count, 1)
+
+    @override_settings(WAGTAILVIDEOS_SOURCE_CACHE_SIZE=0)
+    def test_disabled(self):
+        video = self.create_video(FASTSTART)
+        with sources.get_local_file(video.file) as path:
+            self.assertFalse(path.startswith(self.cache_dir))
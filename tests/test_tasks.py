@@ -0,0 +1,88 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase, override_settings
+from mock import patch
+
+from tests.utils import create_test_video_file
+from wagtailvideos import tasks
+from wagtailvideos.ffmpeg import ProbeResult, StreamInfo
+from wagtailvideos.models import ProcessingStatus, ValidationStatus, Video
+
+
+def probe_result(codec):
+    stream = StreamInfo(0, 'video', codec, 640, 480, 25.0, None, None, None)
+    return ProbeResult(None, 'mp4', None, [stream])
+
+
+@override_settings(WAGTAILVIDEOS_ALLOWED_CODECS=['h264'], WAGTAILVIDEOS_DEFERRED_CODEC_VALIDATION=True)
+@patch('wagtailvideos.ffmpeg.installed', return_value=True)
+class TestDeferredValidation(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(
+            title="Test video",
+            file=create_test_video_file(),
+            validation_status=ValidationStatus.pending,
+        )
+
+    # The upload would otherwise reuse the already validated setUp video
+    @override_settings(WAGTAILVIDEOS_DEDUPLICATE_UPLOADS=False)
+    @patch('wagtailvideos.models.chain')
+    def test_new_file_is_pending(self, chain, installed):
+        video = Video(title="Pending video")
+        video.file = create_test_video_file()
+        video.save()
+
+        self.assertIs(video.validation_status, ValidationStatus.pending)
+        self.assertEqual(chain.call_args[0][0].task, 'wagtailvideos.tasks.validate_video_codec')
+
+    def test_pending_not_shown(self, installed):
+        self.assertEqual(self.video.video_tag(), '')
+        self.assertFalse(Video.objects.valid().filter(pk=self.video.pk).exists())
+
+    @patch('wagtailvideos.cache.probe', return_value=probe_result('h264'))
+    def test_accept(self, probe, installed):
+        tasks.validate_video_codec(self.video.pk)
+
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertIs(video.validation_status, ValidationStatus.valid)
+        self.assertTrue(video.file)
+        self.assertIn('<video', video.video_tag())
+
+    @patch('wagtailvideos.cache.probe', return_value=probe_result('vp8'))
+    def test_reject(self, probe, installed):
+        storage = self.video.file.storage
+        name = self.video.file.name
+        tasks.validate_video_codec(self.video.pk)
+
+        video = Video.objects.get(pk=self.video.pk)
+        self.assertIs(video.validation_status, ValidationStatus.rejected)
+        self.assertIn('vp8', video.validation_message)
+        self.assertFalse(video.file)
+        self.assertFalse(storage.exists(name))
+        self.assertEqual(video.video_tag(), '')
+
+    @override_settings(WAGTAILVIDEOS_DELETE_REJECTED_VIDEOS=True)
+    @patch('wagtailvideos.cache.probe', return_value=probe_result('vp8'))
+    def test_reject_and_delete(self, probe, installed):
+        tasks.validate_video_codec(self.video.pk)
+        self.assertFalse(Video.objects.filter(pk=self.video.pk).exists())
+
+
+class TestProcessingStatus(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(
+            title="Test video", file=create_test_video_file(), processing_status=ProcessingStatus.processing)
+
+    def get_status(self):
+        return Video.objects.get(pk=self.video.pk).processing_status
+
+    def test_finalise(self):
+        tasks.finalise_video(self.video.pk)
+        self.assertIs(self.get_status(), ProcessingStatus.ready)
+
+    def test_failed(self):
+        tasks.video_processing_failed(self.video.pk)
+        self.assertIs(self.get_status(), ProcessingStatus.failed)
+        # The jobs that did not fail still finish
+        tasks.finalise_video(self.video.pk)
+        self.assertIs(self.get_status(), ProcessingStatus.failed)
@@ -0,0 +1,126 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from mock import patch
+from wagtail.tests.utils import WagtailTestUtils
+
+from tests.utils import create_test_video_file
+from wagtailvideos.models import Video
+from wagtailvideos.uploadhandler import VideoUploadHandler, hash_file
+
+
+class TestVideoUploadHandler(TestCase):
+    @override_settings(WAGTAILVIDEOS_CODEC_PROBE_WINDOW=10)
+    def test_hash_and_header(self):
+        handler = VideoUploadHandler()
+        handler.new_file('file', 'video.mp4', 'video/mp4', 24)
+        for start, chunk in enumerate([b'abcdef', b'ghijkl', b'mnopqrstuvwx']):
+            handler.receive_data_chunk(chunk, start)
+        f = handler.file_complete(24)
+
+        self.assertEqual(f.content_hash, hashlib.sha256(b'abcdefghijklmnopqrstuvwx').hexdigest())
+        self.assertEqual(f.content_header, b'abcdefghij')
+        self.assertTrue(f.temporary_file_path())
+        f.close()
+
+    def test_hash_file(self):
+        content = create_test_video_file().read()
+        f = SimpleUploadedFile('small.mp4', content, 'video/mp4')
+        self.assertEqual(hash_file(f), hashlib.sha256(content).hexdigest())
+        self.assertEqual(f.tell(), 0)
+
+
+class TestUploadViewsUseHandler(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.login()
+
+    # Reject the upload once it has been inspected, so nothing is saved
+    @patch('wagtailvideos.fields.WagtailVideoField.check_video_codec',
+           side_effect=ValidationError("Rejected"))
+    def test_add(self, check_video_codec):
+        content = create_test_video_file().read()
+        self.client.post(reverse('wagtailvideos:add'), {
+            'title': "Test video",
+            'file': SimpleUploadedFile('small.mp4', content, "video/mp4"),
+        })
+
+        f = check_video_codec.call_args[0][0]
+        self.assertEqual(f.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(f.content_header, content[:len(f.content_header)])
+
+
+class TestChunkedUpload(TestCase, WagtailTestUtils):
+    def setUp(self):
+        self.login()
+        self.upload_dir = tempfile.mkdtemp()
+        self.content = create_test_video_file().read()
+        self.settings = override_settings(WAGTAILVIDEOS_CHUNKED_UPLOAD_DIR=self.upload_dir)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    def post_chunk(self, start, end):
+        return self.client.post(reverse('wagtailvideos:add_multiple'), {
+            'files[]': SimpleUploadedFile('small.mp4', self.content[start:end], "video/mp4"),
+            'upload_key': 'small.mp4-1234',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            HTTP_CONTENT_RANGE='bytes {}-{}/{}'.format(start, end - 1, len(self.content)))
+
+    def get_offset(self):
+        response = self.client.get(reverse('wagtailvideos:upload_status'), {'upload_key': 'small.mp4-1234'})
+        return json.loads(response.content.decode())['offset']
+
+    def test_resume(self):
+        self.assertEqual(self.get_offset(), 0)
+
+        response = self.post_chunk(0, 1000)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode())['offset'], 1000)
+        self.assertEqual(response['Range'], '0-999')
+        self.assertEqual(self.get_offset(), 1000)
+
+        # A chunk that does not follow on is refused, with the real offset
+        response = self.post_chunk(2000, 3000)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content.decode())['offset'], 1000)
+
+    @patch('wagtailvideos.models.chain')
+    def test_complete(self, chain):
+        self.post_chunk(0, 100000)
+        response = self.post_chunk(100000, len(self.content))
+
+        response_json = json.loads(response.content.decode())
+        self.assertTrue(response_json['success'])
+        video = Video.objects.get(pk=response_json['video_id'])
+        self.assertEqual(video.file.size, len(self.content))
+        self.assertEqual(video.file.read(), self.content)
+        self.assertEqual(self.get_offset(), 0)
+
+    def test_needs_add_permission(self):
+        user = get_user_model().objects.create_user('editor', 'editor@example.com', 'password')
+        user.user_permissions.add(Permission.objects.get(
+            content_type__app_label='wagtailadmin', codename='access_admin'))
+        self.client.login(username='editor', password='password')
+
+        response = self.client.get(reverse('wagtailvideos:upload_status'), {'upload_key': 'small.mp4-1234'})
+        self.assertEqual(response.status_code, 302)
+        # Ajax requests are refused rather than redirected
+        self.assertEqual(self.post_chunk(0, 1000).status_code, 403)
+
+    @override_settings(WAGTAILVIDEOS_MAX_UPLOAD_SIZE=1000)
+    def test_too_large(self):
+        response = self.post_chunk(0, 500)
+        self.assertFalse(json.loads(response.content.decode())['success'])
+        self.assertEqual(self.get_offset(), 0)
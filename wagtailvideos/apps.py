@@ -1,7 +1,8 @@
 from django.apps import AppConfig
+from django.conf import settings
 from django.core.checks import Warning, register
 
-from wagtailvideos import ffmpeg
+from wagtailvideos import capabilities, ffmpeg, formats
 
 
 def ffmpeg_check(app_configs, **kwargs):
@@ -14,6 +15,33 @@ def ffmpeg_check(app_configs, **kwargs):
                 id='wagtailvideos.W001',
             )
         )
+        return messages
+
+    ffmpeg_capabilities = capabilities.get_capabilities()
+    if ffmpeg_capabilities.ffprobe_path is None:
+        messages.append(
+            Warning(
+                'ffprobe could not be found on your system. Video metadata will not be available',
+                hint='ffprobe is usually installed along with ffmpeg',
+                id='wagtailvideos.W002',
+            )
+        )
+    media_formats = getattr(settings, 'WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS', ['default'])
+    for name in media_formats:
+        media_format = formats.get_format(name)
+        if media_format is None:
+            continue
+        missing_encoders = media_format.get_missing_encoders()
+        if missing_encoders:
+            messages.append(
+                Warning(
+                    'ffmpeg has no {} encoder, so videos can not be transcoded to {}'.format(
+                        ', '.join(sorted(missing_encoders)), name),
+                    hint='Install an ffmpeg build with these encoders, or change '
+                         'WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS',
+                    id='wagtailvideos.W003',
+                )
+            )
     return messages
 
 
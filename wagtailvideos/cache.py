@@ -0,0 +1,166 @@
+"""
+Caching of ffprobe results, so that the same stored file is only probed once.
+
+Results are cached in two layers: a small LRU cache in the current process,
+and a shared Django cache. The Django cache is chosen with the
+``WAGTAILVIDEOS_PROBE_CACHE`` setting (an alias in ``CACHES``, ``'default'``
+unless set, or ``None`` to disable). Use a database or memcached backend to
+share results between workers; eviction is left to the cache backend and
+``WAGTAILVIDEOS_PROBE_CACHE_TIMEOUT``.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+
+from wagtailvideos import ffmpeg
+
+log = logging.getLogger(__name__)
+
+KEY_PREFIX = 'wagtailvideos:probe:'
+
+
+class LRUCache(object):
+    """
+    A small thread safe least-recently-used cache.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local_cache = None
+
+
+def get_local_cache():
+    """
+    The in-process cache, of ``WAGTAILVIDEOS_PROBE_CACHE_SIZE`` results. It
+    is made on first use, and made again if the setting has changed.
+    """
+    global _local_cache
+    maxsize = getattr(settings, 'WAGTAILVIDEOS_PROBE_CACHE_SIZE', 512)
+    if _local_cache is None or _local_cache.maxsize != maxsize:
+        _local_cache = LRUCache(maxsize)
+    return _local_cache
+
+
+def get_shared_cache():
+    alias = getattr(settings, 'WAGTAILVIDEOS_PROBE_CACHE', 'default')
+    if alias is None:
+        return None
+    try:
+        return caches[alias]
+    except InvalidCacheBackendError:
+        log.warning("Probe cache %r is not configured", alias)
+        return None
+
+
+def make_key(name, size, mtime=None, content_hash=None):
+    """
+    Build a cache key identifying a file. A content hash identifies a file
+    on its own, otherwise the name, size and modification time are used.
+    """
+    if content_hash:
+        identity = 'hash:{}'.format(content_hash)
+    else:
+        identity = 'file:{}:{}:{}'.format(name, size, mtime)
+    return KEY_PREFIX + hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def get_hash_key(content_hash):
+    return make_key(None, None, content_hash=content_hash)
+
+
+def get_path_key(file_path):
+    stat = os.stat(file_path)
+    return make_key(os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+
+
+def get_file_key(field_file):
+    """
+    Build a cache key for a file in a storage backend, without downloading
+    it.
+    """
+    storage = field_file.storage
+    try:
+        mtime = storage.get_modified_time(field_file.name).timestamp()
+    except (NotImplementedError, AttributeError, OSError):
+        mtime = None
+    return make_key(field_file.name, storage.size(field_file.name), mtime)
+
+
+def get_video_key(video):
+    """
+    Build a cache key for the file of ``video``. Its content hash is used
+    when known, so the probe made while the file was uploaded is found.
+    """
+    if video.content_hash:
+        return get_hash_key(video.content_hash)
+    return get_file_key(video.file)
+
+
+def get_cached(key):
+    local_cache = get_local_cache()
+    result = local_cache.get(key)
+    if result is not None:
+        return result
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        result = shared_cache.get(key)
+        if result is not None:
+            local_cache.set(key, result)
+    return result
+
+
+def set_cached(key, result):
+    get_local_cache().set(key, result)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        timeout = getattr(settings, 'WAGTAILVIDEOS_PROBE_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
+        shared_cache.set(key, result, timeout)
+
+
+def probe(file_path, key=None):
+    """
+    A cached version of ``ffmpeg.probe``. Pass ``key`` (see ``get_file_key``)
+    to identify the file by where it is stored rather than by its local path.
+    """
+    if key is None:
+        if not os.path.exists(file_path):
+            return ffmpeg.probe(file_path)
+        key = get_path_key(file_path)
+
+    result = get_cached(key)
+    if result is None:
+        result = ffmpeg.probe(file_path)
+        if result is not None:
+            set_cached(key, result)
+    return result
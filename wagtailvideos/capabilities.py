@@ -0,0 +1,96 @@
+"""
+What the local ffmpeg can do.
+
+The binaries, the version and the encoders, decoders, filters and hardware
+acceleration methods of the ffmpeg build are found once per process, the
+first time they are needed, so that checking them is free afterwards.
+Transcodes to formats the build has no encoders for fail straight away
+rather than after the source has been fetched and partly decoded.
+"""
+import re
+import subprocess
+from functools import lru_cache
+from shutil import which
+
+from wagtailvideos import runner
+
+FLAGS = re.compile(r'^[A-Z.|]{2,6}$')
+
+
+class Capabilities(object):
+    def __init__(self, ffmpeg_path=None, ffprobe_path=None, version=None, encoders=(), decoders=(),
+                 filters=(), hwaccels=()):
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        self.version = version
+        self.encoders = frozenset(encoders)
+        self.decoders = frozenset(decoders)
+        self.filters = frozenset(filters)
+        self.hwaccels = frozenset(hwaccels)
+
+    @property
+    def installed(self):
+        return self.ffmpeg_path is not None
+
+    def get_missing_encoders(self, encoders):
+        """
+        Which of ``encoders`` this build does not have. Nothing is reported
+        missing when ffmpeg is not installed here, as transcoding may happen
+        on another machine.
+        """
+        if not self.installed:
+            return set()
+        return set(encoders) - self.encoders
+
+
+def run(ffmpeg_path, *args):
+    try:
+        output = runner.check_output(
+            [ffmpeg_path, '-hide_banner'] + list(args),
+            stderr=subprocess.STDOUT, timeout=runner.get_probe_timeout())
+    except (OSError, subprocess.SubprocessError):
+        return ''
+    return output.decode('utf-8', 'replace')
+
+
+def parse_names(output):
+    """
+    The names in a listing from ``-encoders``, ``-decoders`` or
+    ``-filters``: each line is a column of flags followed by the name.
+    Legend lines have ``=`` where the name would be.
+    """
+    names = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and FLAGS.match(parts[0]) and parts[1] != '=':
+            names.add(parts[1])
+    return names
+
+
+def parse_version(output):
+    match = re.match(r'\S+ version (\S+)', output)
+    return match.group(1) if match else None
+
+
+def probe():
+    """
+    Find out what the ffmpeg on the ``PATH`` can do.
+    """
+    ffmpeg_path = which('ffmpeg')
+    if ffmpeg_path is None:
+        return Capabilities(ffprobe_path=which('ffprobe'))
+    hwaccels = run(ffmpeg_path, '-hwaccels').splitlines()[1:]
+    return Capabilities(
+        ffmpeg_path=ffmpeg_path,
+        ffprobe_path=which('ffprobe'),
+        version=parse_version(run(ffmpeg_path, '-version')),
+        encoders=parse_names(run(ffmpeg_path, '-encoders')),
+        decoders=parse_names(run(ffmpeg_path, '-decoders')),
+        filters=parse_names(run(ffmpeg_path, '-filters')),
+        hwaccels=[name.strip() for name in hwaccels if name.strip()],
+    )
+
+
+@lru_cache(maxsize=None)
+def get_capabilities():
+    return probe()
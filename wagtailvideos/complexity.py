@@ -0,0 +1,71 @@
+"""
+Per-title encoding: choosing the quality parameter of each video to suit its
+content, rather than using the same one for everything.
+
+The complexity of a video is the bitrate, in kbit/s, of a quick low
+resolution encode of short samples taken through it (see
+``ffmpeg.get_sample_size``). Slides and screen recordings come out at a
+fraction of the bitrate of sports footage at the same constant rate factor,
+and can be encoded at a higher CRF without visible loss; hard footage gets
+a lower one.
+
+Each halving of the complexity below ``WAGTAILVIDEOS_REFERENCE_COMPLEXITY``
+raises the CRF by ``CRF_STEP``, and each doubling above it lowers the CRF by
+the same, up to ``WAGTAILVIDEOS_MAX_CRF_ADJUSTMENT`` either way. Turn it on
+with ``WAGTAILVIDEOS_PER_TITLE_ENCODING``.
+"""
+import math
+
+from django.conf import settings
+
+from wagtailvideos import ffmpeg
+
+SAMPLE_LENGTH = 2
+CRF_STEP = 3
+
+
+def enabled():
+    return getattr(settings, 'WAGTAILVIDEOS_PER_TITLE_ENCODING', False)
+
+
+def get_sample_count():
+    return getattr(settings, 'WAGTAILVIDEOS_COMPLEXITY_SAMPLES', 4)
+
+
+def get_reference_complexity():
+    return getattr(settings, 'WAGTAILVIDEOS_REFERENCE_COMPLEXITY', 400)
+
+
+def get_max_adjustment():
+    return getattr(settings, 'WAGTAILVIDEOS_MAX_CRF_ADJUSTMENT', 6)
+
+
+def measure(file_path, duration):
+    """
+    Measure the complexity of the video at ``file_path``. Returns ``None`` if
+    the video has no duration or a sample could not be encoded.
+    """
+    if not duration:
+        return None
+    seconds = duration.total_seconds()
+    length = min(SAMPLE_LENGTH, seconds)
+    samples = get_sample_count()
+    total_size = 0
+    for i in range(samples):
+        start = max(0, seconds * (i + 0.5) / samples - length / 2)
+        size = ffmpeg.get_sample_size(file_path, start, length)
+        if size is None:
+            return None
+        total_size += size
+    return total_size * 8 / 1000 / (length * samples)
+
+
+def get_crf_adjustment(complexity):
+    """
+    How much to add to the CRF of a video of ``complexity``.
+    """
+    if not complexity:
+        return 0
+    adjustment = int(round(-CRF_STEP * math.log(complexity / get_reference_complexity(), 2)))
+    max_adjustment = get_max_adjustment()
+    return max(-max_adjustment, min(max_adjustment, adjustment))
@@ -0,0 +1,50 @@
+"""
+Sorting failed ffmpeg runs in to kinds, from the end of the ffmpeg log, so
+they can be told apart without reading the log: an encoder or other part of
+ffmpeg that is not available, an input that can not be decoded, a full disk,
+or a run that took longer than ``WAGTAILVIDEOS_TRANSCODE_TIMEOUT``.
+"""
+import re
+import subprocess
+
+from django.utils.encoding import force_text
+
+PATTERNS = [
+    ('disk_full', re.compile(r'No space left on device|Disk quota exceeded')),
+    ('missing_encoder', re.compile(
+        r'Unknown encoder|Encoder not found|Unknown decoder|Decoder not found|'
+        r'Unrecognized option|No such filter|Requested output format .* is not a suitable output format')),
+    ('corrupt_input', re.compile(
+        r'Invalid data found when processing input|moov atom not found|'
+        r'could not find codec parameters|Error while decoding|Invalid NAL unit|'
+        r'corrupt (?:input )?packet|Truncating packet', re.IGNORECASE)),
+]
+
+
+def get_message(error):
+    """
+    The log of a failed ffmpeg run, as text.
+    """
+    return force_text(error.output or '', errors='replace')
+
+
+def classify(error):
+    """
+    The kind of failure of ``error``, a ``subprocess.SubprocessError``
+    from an ffmpeg run, as the name of a ``TranscodeErrorType``.
+    """
+    if isinstance(error, subprocess.TimeoutExpired):
+        return 'timeout'
+    message = get_message(error)
+    for error_type, pattern in PATTERNS:
+        if pattern.search(message):
+            return error_type
+    return 'unknown'
+
+
+def is_retryable(error_type):
+    """
+    Whether a failed run of several outputs should be tried again one output
+    at a time. A full disk or a slow source fails the same way again.
+    """
+    return error_type not in ('disk_full', 'timeout')
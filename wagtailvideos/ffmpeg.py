@@ -1,42 +1,32 @@
 import datetime
+import json
 import logging
 import os
-import re
 import shutil
+import struct
 import subprocess
 import tempfile
-import json
+from collections import namedtuple
 from shutil import which
+from urllib.parse import urlparse
 
 from django.core.files.base import ContentFile
+from django.utils.encoding import force_text
 
-logger = logging.getLogger(__name__)
-
-
+from wagtailvideos import capabilities, runner
 
-def DEVNULL():
-    return open(os.devnull, 'r+b')
+logger = logging.getLogger(__name__)
 
 
 def installed(path=None):
-    return which('ffmpeg', path=path) is not None
+    if path is not None:
+        return which('ffmpeg', path=path) is not None
+    return capabilities.get_capabilities().installed
 
 
 def get_duration(file_path):
-    if not installed():
-        raise RuntimeError('ffmpeg is not installed')
-
-    try:
-        show_format = subprocess.check_output(
-            ['ffprobe', file_path, '-show_format', '-v', 'quiet'],
-            stdin=DEVNULL(), stderr=DEVNULL())
-        show_format = show_format.decode("utf-8")
-        # show_format comes out in key=value pairs seperated by newlines
-        duration = re.findall(r'([duration^=]+)=([^=]+)(?:\n|$)', show_format)[0][1]
-        return datetime.timedelta(seconds=float(duration))
-    except subprocess.CalledProcessError:
-        logger.exception("Getting video duration failed")
-        return None
+    result = probe(file_path)
+    return result.duration if result is not None else None
 
 
 def get_thumbnail(file_path):
@@ -50,7 +40,7 @@ def get_thumbnail(file_path):
         output_dir = tempfile.mkdtemp()
         output_file = os.path.join(output_dir, thumb_name)
         try:
-            subprocess.check_call([
+            runner.check_output([
                 'ffmpeg',
                 '-v', 'quiet',
                 '-itsoffset', '-4',
@@ -60,61 +50,297 @@ def get_thumbnail(file_path):
                 '-an', '-f', 'rawvideo',
                 '-s', '320x240',
                 output_file,
-            ], stdin=DEVNULL(), stdout=DEVNULL())
-        except subprocess.CalledProcessError:
+            ], timeout=runner.get_probe_timeout())
+        except subprocess.SubprocessError:
             return None
         return ContentFile(open(output_file, 'rb').read(), thumb_name)
     finally:
         shutil.rmtree(output_dir, ignore_errors=True)
 
 
-def get_video_codec(file_path):
+def get_frame_hash(file_path, seconds):
+    """
+    Get a 64 bit difference hash (dHash) of the frame at ``seconds``: the
+    frame is shrunk to 9x8 greyscale pixels and each bit records whether a
+    pixel is brighter than its right hand neighbour. Re-encodes, rescales
+    and small colour changes of a frame give the same or a very similar
+    hash.
+    """
     if not installed():
         raise RuntimeError('ffmpeg is not installed')
-    if not os.path.exists(file_path):
-        logger.exception("Video file not found")
+
+    try:
+        output = runner.check_output([
+            'ffmpeg',
+            '-v', 'quiet',
+            '-ss', '{:.3f}'.format(seconds),
+            '-i', file_path,
+            '-frames:v', '1',
+            '-an',
+            '-vf', 'scale=9:8:flags=area,format=gray',
+            '-f', 'rawvideo',
+            '-',
+        ], timeout=runner.get_probe_timeout())
+    except subprocess.SubprocessError:
+        return None
+    if len(output) < 72:
         return None
 
+    value = 0
+    for row in range(8):
+        pixels = output[row * 9:row * 9 + 9]
+        for left, right in zip(pixels, pixels[1:]):
+            value = (value << 1) | (left > right)
+    return value
+
+
+def get_sample_size(file_path, seconds, length, height=240):
+    """
+    Encode ``length`` seconds of video from ``seconds`` in at ``height``
+    pixels high with a fast fixed quality H.264 encode, and return the size
+    of the result in bytes. Footage that is harder to compress gives bigger
+    samples. Returns ``None`` if the sample could not be encoded.
+    """
+    if not installed():
+        raise RuntimeError('ffmpeg is not installed')
+
     try:
-        fprobe_result = subprocess.check_output(
-            ['ffprobe', file_path, '-show_entries', 'stream=codec_name,codec_type', '-of', 'json', '-v', 'quiet'],
-            stdin=DEVNULL(), stderr=DEVNULL())
-        return parse_fprobe_result(fprobe_result)
-    except subprocess.CalledProcessError:
-        logger.exception("Getting video duration failed")
+        output = runner.check_output([
+            'ffmpeg',
+            '-v', 'quiet',
+            '-ss', '{:.3f}'.format(seconds),
+            '-t', '{:.3f}'.format(length),
+            '-i', file_path,
+            '-an',
+            '-vf', 'scale=-2:{}'.format(height),
+            '-codec:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-crf', '23',
+            '-f', 'matroska',
+            '-',
+        ], timeout=runner.get_probe_timeout())
+    except subprocess.SubprocessError:
         return None
+    return len(output) or None
+
+
+def get_video_codec(file_path):
+    result = probe(file_path)
+    return result.video_codec if result is not None else None
 
 
 def get_video_codec_from_bytes(bytes_data):
+    result = probe_bytes(bytes_data)
+    return result.video_codec if result is not None else None
+
+
+class StreamInfo(namedtuple('StreamInfo', [
+        'index', 'codec_type', 'codec_name', 'width', 'height', 'fps',
+        'bitrate', 'channels', 'rotation'])):
+    """A single stream as reported by ffprobe."""
+    __slots__ = ()
+
+
+class ProbeResult(namedtuple('ProbeResult', [
+        'duration', 'container', 'bitrate', 'streams'])):
+    """
+    Everything we need to know about a media file, gathered from a single
+    ffprobe call. Convenience properties read from the first video and audio
+    streams.
+    """
+    __slots__ = ()
+
+    def get_stream(self, codec_type):
+        for stream in self.streams:
+            if stream.codec_type == codec_type:
+                return stream
+        return None
+
+    @property
+    def video_stream(self):
+        return self.get_stream('video')
+
+    @property
+    def audio_stream(self):
+        return self.get_stream('audio')
+
+    def _video_attr(self, name):
+        stream = self.video_stream
+        return getattr(stream, name) if stream is not None else None
+
+    @property
+    def video_codec(self):
+        return self._video_attr('codec_name')
+
+    @property
+    def audio_codec(self):
+        stream = self.audio_stream
+        return stream.codec_name if stream is not None else None
+
+    @property
+    def width(self):
+        return self._video_attr('width')
+
+    @property
+    def height(self):
+        return self._video_attr('height')
+
+    @property
+    def fps(self):
+        return self._video_attr('fps')
+
+    @property
+    def rotation(self):
+        return self._video_attr('rotation')
+
+    @property
+    def audio_channels(self):
+        stream = self.audio_stream
+        return stream.channels if stream is not None else None
+
+
+def is_url(file_path):
+    return urlparse(file_path).scheme in ('http', 'https')
+
+
+PROBE_ARGS = ['-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams']
+
+
+def probe(file_path):
+    """
+    Run ffprobe once over ``file_path`` and return a ``ProbeResult``, or
+    ``None`` if the file could not be probed.
+    """
     if not installed():
         raise RuntimeError('ffmpeg is not installed')
+    # URLs are left for ffprobe to fetch
+    if not is_url(file_path) and not os.path.exists(file_path):
+        logger.error("Video file not found: %s", file_path)
+        return None
+
     try:
-        fprobe_result = subprocess.check_output(
-            ['ffprobe', '-show_entries', 'stream=codec_name,codec_type', '-of', 'json', '-v', 'quiet', '-'],
-            stderr=DEVNULL(), input=bytes_data)
-        return parse_fprobe_result(fprobe_result)
-    except subprocess.CalledProcessError:
-        logger.exception("Getting video duration failed")
+        output = runner.check_output(
+            ['ffprobe'] + PROBE_ARGS + [file_path], timeout=runner.get_probe_timeout())
+    except subprocess.SubprocessError:
+        logger.exception("Probing video failed")
         return None
+    return parse_probe_result(output)
 
 
-def parse_fprobe_result(fprobe_result):
+def probe_bytes(bytes_data):
+    """
+    Like ``probe``, but reads the media from ``bytes_data`` via stdin.
+    """
+    if not installed():
+        raise RuntimeError('ffmpeg is not installed')
+
     try:
-        fprobe_result = json.loads(fprobe_result)
-        video_stream = get_videostream_data(fprobe_result)
-        if video_stream is None:
-            return None
-        else:
-            return video_stream["codec_name"]
-    except json.JSONDecodeError:
-        logger.exception("Parsing fprobe result failed")
+        output = runner.check_output(
+            ['ffprobe'] + PROBE_ARGS + ['-'],
+            input=bytes_data, timeout=runner.get_probe_timeout())
+    except subprocess.SubprocessError:
+        logger.exception("Probing video failed")
+        return None
+    return parse_probe_result(output)
+
+
+# Top level boxes that can start an ISO base media (MP4, MOV) file
+ISO_BMFF_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+
+def needs_tail(header):
+    """
+    Check whether the stream information of a file starting with ``header``
+    may only be found further into the file. This is the case for MP4/MOV
+    files that were written with the ``moov`` box after the media data.
+    Other containers keep their stream information at the start.
+    """
+    if header[4:8] not in ISO_BMFF_BOXES:
+        return False
+
+    offset = 0
+    while offset + 8 <= len(header):
+        size = struct.unpack('>I', header[offset:offset + 4])[0]
+        box_type = header[offset + 4:offset + 8]
+        if box_type == b'moov':
+            return False
+        if box_type == b'mdat':
+            return True
+        if size == 1:
+            if offset + 16 > len(header):
+                break
+            size = struct.unpack('>Q', header[offset + 8:offset + 16])[0]
+        if size < 8:
+            # A size of zero means the box extends to the end of the file
+            break
+        offset += size
+    # The moov box was not found within the header
+    return True
+
+
+def parse_probe_result(output):
+    try:
+        data = json.loads(force_text(output))
+    except ValueError:
+        logger.exception("Parsing ffprobe result failed")
+        return None
+
+    fmt = data.get('format', {})
+    duration = _parse_float(fmt.get('duration'))
+    return ProbeResult(
+        duration=datetime.timedelta(seconds=duration) if duration is not None else None,
+        container=fmt.get('format_name', ''),
+        bitrate=_parse_int(fmt.get('bit_rate')),
+        streams=[_parse_stream(stream) for stream in data.get('streams', [])],
+    )
+
+
+def _parse_stream(stream):
+    return StreamInfo(
+        index=stream.get('index'),
+        codec_type=stream.get('codec_type'),
+        codec_name=stream.get('codec_name'),
+        width=_parse_int(stream.get('width')),
+        height=_parse_int(stream.get('height')),
+        fps=_parse_frame_rate(stream.get('avg_frame_rate') or stream.get('r_frame_rate')),
+        bitrate=_parse_int(stream.get('bit_rate')),
+        channels=_parse_int(stream.get('channels')),
+        rotation=_parse_rotation(stream),
+    )
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_frame_rate(value):
+    # Frame rates are reported as fractions, such as "30000/1001" or "0/0"
+    if not value:
+        return None
+    num, _, den = value.partition('/')
+    num = _parse_float(num)
+    den = _parse_float(den or 1)
+    if not num or not den:
         return None
+    return round(num / den, 3)
 
 
-def get_videostream_data(fprobe_res_dict):
-    streams = fprobe_res_dict.get('streams', None)
-    if streams is not None:
-        streams = list(filter(lambda s: s['codec_type'] == 'video', streams))
-        if len(streams) > 0:
-            return streams[0]
+def _parse_rotation(stream):
+    # Older ffmpeg builds report rotation as a tag, newer ones as side data
+    rotation = _parse_int(stream.get('tags', {}).get('rotate'))
+    if rotation is not None:
+        return rotation
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return _parse_int(side_data['rotation'])
     return None
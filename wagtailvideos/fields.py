@@ -1,9 +1,12 @@
+import os
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files.temp import NamedTemporaryFile
 from django.forms.fields import FileField
 from django.template.defaultfilters import filesizeformat
 from django.utils.translation import ugettext_lazy as _
-from wagtailvideos.ffmpeg import get_video_codec, get_video_codec_from_bytes
+from wagtailvideos import cache, ffmpeg
 import logging
 log = logging.getLogger(__name__)
 
@@ -61,23 +64,68 @@ class WagtailVideoField(FileField):
         if len(allowed_codecs) < 1:
             return
 
-        if hasattr(f, "temporary_file_path"):
-            file_path = f.temporary_file_path()
-            log.debug("temp video file: %s", file_path)
-            result = get_video_codec(file_path)
-        else:
-            ff = f.read()
-            result = get_video_codec_from_bytes(ff)
+        result = self.get_video_codec(f)
         log.debug("video codec is %s", result)
         if result not in settings.WAGTAILVIDEOS_ALLOWED_CODECS:
             raise ValidationError(self.error_messages['codec_is_not_allowed'] % result)
 
+    def get_video_codec(self, f):
+        result = self.probe(f)
+        return result.video_codec if result is not None else None
+
+    def probe(self, f):
+        # Files received by VideoUploadHandler come with their first few MB
+        # already in memory. Otherwise only hand ffprobe the start of the
+        # file, rather than reading the whole upload in to memory. Most
+        # containers keep their stream information at the start of the file.
+        header = getattr(f, 'content_header', None)
+        if header is None and not hasattr(f, 'temporary_file_path'):
+            window = getattr(settings, 'WAGTAILVIDEOS_CODEC_PROBE_WINDOW', 4 * 1024 * 1024)
+            f.seek(0)
+            header = f.read(window)
+            f.seek(0)
+
+        if header is not None and not ffmpeg.needs_tail(header):
+            result = ffmpeg.probe_bytes(header)
+            whole_file = f.size is not None and f.size <= len(header)
+            if whole_file or (result is not None and result.video_codec):
+                return result
+
+        content_hash = getattr(f, 'content_hash', None)
+        key = cache.get_hash_key(content_hash) if content_hash else None
+
+        if hasattr(f, "temporary_file_path"):
+            file_path = f.temporary_file_path()
+            log.debug("temp video file: %s", file_path)
+            return self._probe_path(file_path, key)
+
+        # The stream information is further in to the file, so spool it to
+        # disk a chunk at a time and let ffprobe seek around it.
+        log.debug("probing spooled copy of %s", f.name)
+        _, ext = os.path.splitext(f.name or '')
+        with NamedTemporaryFile(prefix='wagtailvideo-', suffix=ext) as tmp:
+            for chunk in f.chunks():
+                tmp.write(chunk)
+            tmp.flush()
+            result = self._probe_path(tmp.name, key)
+        f.seek(0)
+        return result
+
+    def _probe_path(self, file_path, key):
+        # Temporary files only get a useful cache key from a content hash
+        if key is None:
+            return ffmpeg.probe(file_path)
+        return cache.probe(file_path, key=key)
+
     def to_python(self, data):
         f = super(WagtailVideoField, self).to_python(data)
 
         if f is not None:
             self.check_video_file_size(f)
             self.check_video_file_format(f)
-            self.check_video_codec(f)
+            # With deferred validation the codec is checked by a task after
+            # the video has been saved, see tasks.validate_video_codec
+            if not getattr(settings, 'WAGTAILVIDEOS_DEFERRED_CODEC_VALIDATION', False):
+                self.check_video_codec(f)
 
         return f
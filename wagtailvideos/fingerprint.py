@@ -0,0 +1,85 @@
+"""
+Perceptual fingerprints for spotting re-encodes and re-exports of the same
+footage.
+
+A fingerprint is the dHash (see ``ffmpeg.get_frame_hash``) of frames sampled
+at evenly spaced points through the video, packed as big endian 64 bit
+integers. Two videos are likely duplicates when the average number of
+differing bits between their frame hashes is at most
+``WAGTAILVIDEOS_NEAR_DUPLICATE_DISTANCE``.
+
+Comparing every video with every other does not scale, so each frame hash
+is also split in to ``BANDS`` bands that are stored in an indexed table.
+Frames a few bits apart almost always still share at least one band
+exactly, so candidates are found with indexed equality lookups on the bands
+and then compared in full.
+"""
+import struct
+
+from django.conf import settings
+
+from wagtailvideos import ffmpeg
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def get_sample_count():
+    return getattr(settings, 'WAGTAILVIDEOS_FINGERPRINT_SAMPLES', 8)
+
+
+def get_max_distance():
+    return getattr(settings, 'WAGTAILVIDEOS_NEAR_DUPLICATE_DISTANCE', 10)
+
+
+def pack(hashes):
+    return struct.pack('>{}Q'.format(len(hashes)), *hashes)
+
+
+def unpack(fingerprint):
+    fingerprint = bytes(fingerprint or b'')
+    return list(struct.unpack('>{}Q'.format(len(fingerprint) // 8), fingerprint))
+
+
+def compute(file_path, duration):
+    """
+    Fingerprint the video at ``file_path``. Returns ``None`` if the video has
+    no duration or a sampled frame could not be decoded.
+    """
+    if not duration:
+        return None
+    seconds = duration.total_seconds()
+    samples = get_sample_count()
+    hashes = []
+    for i in range(samples):
+        frame_hash = ffmpeg.get_frame_hash(file_path, seconds * (i + 0.5) / samples)
+        if frame_hash is None:
+            return None
+        hashes.append(frame_hash)
+    return pack(hashes)
+
+
+def distance(a, b):
+    """
+    The average number of bits that differ between the frame hashes of two
+    fingerprints, or ``None`` if they can not be compared.
+    """
+    a, b = unpack(a), unpack(b)
+    if not a or len(a) != len(b):
+        return None
+    return sum(bin(x ^ y).count('1') for x, y in zip(a, b)) / len(a)
+
+
+def get_bands(fingerprint):
+    """
+    Split a fingerprint in to ``(position, value)`` pairs for the band
+    index. ``position`` identifies both the frame and the band in it, so
+    only bands from the same point in two videos match.
+    """
+    bands = []
+    for frame, frame_hash in enumerate(unpack(fingerprint)):
+        for band in range(BANDS):
+            value = (frame_hash >> (band * BAND_BITS)) & BAND_MASK
+            bands.append((frame * BANDS + band, value))
+    return bands
@@ -0,0 +1,409 @@
+"""
+The formats videos can be transcoded to.
+
+Each format is a ``MediaFormat``: the ffmpeg options for an output, the
+container extension, the quality levels and the mime type used in
+``video_tag``. Transcodes refer to a format by name.
+
+Formats can be added, changed or removed with the
+``WAGTAILVIDEOS_MEDIA_FORMATS`` setting, a dict of format names to the
+keyword arguments of ``MediaFormat`` (or ``None`` to remove a format)::
+
+    WAGTAILVIDEOS_MEDIA_FORMATS = {
+        'ogg': None,
+        'h264_high': {
+            'label': "H.264 High profile in Mp4",
+            'extension': 'mp4',
+            'args': ['-codec:v', 'libx264', '-profile:v', 'high', '-crf', '{quality}', '-codec:a', 'aac'],
+            'quality_params': {'lowest': '28', 'default': '23', 'highest': '18'},
+        },
+    }
+
+Formats that need more than that, such as HLS, subclass ``MediaFormat`` and
+are added with ``register_format``.
+
+How hard the encoders work is set by ``EncoderProfile``s, see
+``get_encoder_profiles``. Formats with a ``crf_range`` have their quality
+parameter adjusted to each video with per-title encoding, see
+``wagtailvideos.complexity``.
+"""
+import mimetypes
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+
+from wagtailvideos import capabilities
+from wagtailvideos import complexity as per_title
+from wagtailvideos import hls
+
+CODEC_OPTIONS = {'-codec', '-c', '-codec:v', '-c:v', '-vcodec', '-codec:a', '-c:a', '-acodec'}
+
+
+def get_encoders(args):
+    """
+    The encoders that the ffmpeg options ``args`` use.
+    """
+    return {
+        value for option, value in zip(args, args[1:])
+        if option in CODEC_OPTIONS and value != 'copy'}
+
+
+class TranscodeOutputFile(File):
+    """
+    A finished ffmpeg output on local disk. Like ``TemporaryUploadedFile``,
+    storages that can (such as ``FileSystemStorage``) move it in to place
+    instead of copying it; others stream it from disk.
+    """
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class MediaFormat(object):
+    # Whether long videos can be encoded in parallel segments, see
+    # ``wagtailvideos.segments``
+    segmentable = True
+
+    def __init__(self, name, label, extension, args, quality_params=None, mime_type=None,
+                 remux_codecs=None, remux_args=None, crf_range=None):
+        self.name = name
+        self.label = label
+        self.extension = extension
+        # ``{quality}`` in an argument is replaced by the quality parameter
+        self.args = args
+        self.quality_params = quality_params or {}
+        self.mime_type = mime_type
+        # The video and audio codecs that can be copied in to this format
+        # as they are, and any options needed to do so
+        self.remux_codecs = remux_codecs or (set(), set())
+        self.remux_args = remux_args or []
+        # The lowest and highest CRF, if the quality parameter is one
+        self.crf_range = crf_range
+
+    def __str__(self):
+        return self.label
+
+    def get_quality_param(self, quality, complexity=None):
+        """
+        The quality parameter for ``quality``, adjusted to a video of
+        ``complexity`` if that is known and this format uses a CRF.
+        """
+        quality_param = self.quality_params.get(quality.name, '')
+        if complexity is None or self.crf_range is None or not quality_param:
+            return quality_param
+        lowest, highest = self.crf_range
+        crf = int(quality_param) + per_title.get_crf_adjustment(complexity)
+        return str(max(lowest, min(highest, crf)))
+
+    def get_extension(self):
+        return self.extension
+
+    def get_mime_type(self):
+        return self.mime_type or mimetypes.guess_type('video.' + self.get_extension())[0]
+
+    def get_ffmpeg_args(self, quality, complexity=None):
+        """
+        The ffmpeg options for an output in this format, or ``None`` if this
+        format has not been configured.
+        """
+        quality_param = self.get_quality_param(quality, complexity)
+        return [arg.format(quality=quality_param) for arg in self.args]
+
+    def get_encoders(self):
+        return get_encoders(self.args or [])
+
+    def get_missing_encoders(self):
+        """
+        The encoders this format needs that the local ffmpeg does not have.
+        """
+        return capabilities.get_capabilities().get_missing_encoders(self.get_encoders())
+
+    def get_remux_codecs(self):
+        return self.remux_codecs
+
+    def get_remux_args(self):
+        return ['-map', '0:v:0', '-map', '0:a?', '-codec', 'copy'] + self.remux_args
+
+    def get_output(self, transcode, directory, profile):
+        """
+        The ffmpeg options and output path to write ``transcode`` in to
+        ``directory`` with the encoder ``profile``, or ``None`` if it can
+        not be produced.
+        """
+        transcode.quality_param = ''
+        if transcode.remuxed:
+            args = self.get_remux_args()
+        else:
+            quality = profile.get_quality(transcode.quality)
+            complexity = transcode.video.complexity if per_title.enabled() else None
+            args = self.get_ffmpeg_args(quality, complexity)
+            if args is not None and profile.bitrate is not None:
+                # Encode to the bitrate of the profile instead
+                args = without_constant_quality(args) + profile.get_args(self)
+            elif args is not None:
+                args = args + profile.get_args(self)
+                transcode.quality_param = self.get_quality_param(quality, complexity)
+        if args is None:
+            return None
+        return args, os.path.join(directory, transcode.get_output_name())
+
+    def save_output(self, transcode, output_file):
+        name = os.path.basename(output_file)
+        with open(output_file, 'rb') as f:
+            transcode.file.save(name, TranscodeOutputFile(f, name=name), save=False)
+
+    def delete_output(self, storage, name):
+        storage.delete(name)
+
+
+class DefaultFormat(MediaFormat):
+    """
+    The format set with ``WAGTAILVIDEOS_DEFAULT_COMPRESSION_ARGS`` and
+    ``WAGTAILVIDEOS_DEFAULT_COMPRESSION_EXT``.
+    """
+    def __init__(self):
+        super(DefaultFormat, self).__init__('default', 'Default codec', None, None)
+
+    def get_extension(self):
+        return getattr(settings, "WAGTAILVIDEOS_DEFAULT_COMPRESSION_EXT", "mov")
+
+    def get_ffmpeg_args(self, quality, complexity=None):
+        default_compression_args = getattr(settings, "WAGTAILVIDEOS_DEFAULT_COMPRESSION_ARGS", None)
+        if default_compression_args is None:
+            return None
+        return default_compression_args.split()
+
+    def get_encoders(self):
+        return get_encoders(self.get_ffmpeg_args(None) or [])
+
+
+class HLSFormat(MediaFormat):
+    """
+    An HLS rendition ladder, see ``wagtailvideos.hls``.
+    """
+    segmentable = False
+
+    def __init__(self):
+        super(HLSFormat, self).__init__(
+            'hls', 'HLS adaptive bitrate ladder', 'm3u8', None, mime_type='application/x-mpegURL')
+
+    def get_encoders(self):
+        return {'libx264', 'aac'}
+
+    def get_output(self, transcode, directory, profile):
+        # The ladder has encoder settings of its own
+        return hls.get_output(transcode.video, directory)
+
+    def save_output(self, transcode, output_file):
+        hls.save(transcode, os.path.dirname(output_file))
+
+    def delete_output(self, storage, name):
+        hls.delete(storage, name)
+
+
+# Options that pick a constant quality rather than a bitrate
+CONSTANT_QUALITY_OPTIONS = {'-crf', '-qscale:v'}
+
+
+def without_constant_quality(args):
+    """
+    Remove the constant quality options, and their values, from ``args``.
+    """
+    result = []
+    options = iter(args)
+    for arg in options:
+        if arg in CONSTANT_QUALITY_OPTIONS:
+            next(options, None)
+        else:
+            result.append(arg)
+    return result
+
+
+class EncoderProfile(object):
+    """
+    How hard to work at encoding, independent of the format: the encoder
+    preset and tuning, the number of threads, the key frame interval, an
+    optional maximum height, a video bitrate to encode to instead of a
+    constant quality, and whether to encode in two passes. Encoders only
+    make use of two passes when aiming for a bitrate, so ``two_pass`` needs
+    a ``bitrate``.
+
+    ``preset``, ``tune`` and ``extra_args`` can be a dict of format names to
+    values, as encoders name their presets differently. Formats that are
+    not in the dict keep their own settings.
+    """
+    def __init__(self, name, preset=None, tune=None, threads=None, gop=None, height=None,
+                 bitrate=None, two_pass=False, quality=None, extra_args=None):
+        if two_pass and bitrate is None:
+            raise ImproperlyConfigured(
+                "The {} encoder profile encodes in two passes, which needs a bitrate".format(name))
+        self.name = name
+        self.preset = preset
+        self.tune = tune
+        self.threads = threads
+        self.gop = gop
+        self.height = height
+        self.bitrate = bitrate
+        self.two_pass = two_pass
+        # The name of a ``VideoQuality`` to use instead of the requested one
+        self.quality = quality
+        self.extra_args = extra_args
+
+    def _for_format(self, value, media_format):
+        if isinstance(value, dict):
+            return value.get(media_format.name)
+        return value
+
+    def get_quality(self, quality):
+        if self.quality is None:
+            return quality
+        return type(quality)[self.quality]
+
+    def get_args(self, media_format):
+        """
+        The ffmpeg options for this profile, to go after those of the
+        format so that they take precedence.
+        """
+        args = []
+        preset = self._for_format(self.preset, media_format)
+        if preset is not None:
+            args += ['-preset', str(preset)]
+        tune = self._for_format(self.tune, media_format)
+        if tune is not None:
+            args += ['-tune', str(tune)]
+        if self.threads is not None:
+            args += ['-threads', str(self.threads)]
+        if self.gop is not None:
+            args += ['-g', str(self.gop)]
+        if self.height is not None:
+            # Never scale up
+            args += ['-vf', 'scale=-2:min({}\\,ih)'.format(self.height)]
+        if self.bitrate is not None:
+            args += ['-b:v', str(self.bitrate)]
+        args += self._for_format(self.extra_args, media_format) or []
+        return args
+
+
+def get_encoder_profiles():
+    """
+    All encoder profiles, by name. ``final`` is used for normal transcodes
+    and ``preview`` for the quick first pass of two stage transcoding, see
+    ``WAGTAILVIDEOS_TWO_STAGE_TRANSCODING``. Profiles can be added or
+    changed with the ``WAGTAILVIDEOS_ENCODER_PROFILES`` setting, a dict of
+    names to the keyword arguments of ``EncoderProfile``.
+    """
+    realtime_vpx = ['-deadline', 'realtime', '-cpu-used', '8']
+    profiles = OrderedDict([
+        ('final', EncoderProfile('final')),
+        ('preview', EncoderProfile(
+            'preview',
+            preset={'mp4': 'ultrafast', 'hevc': 'ultrafast', 'av1': '12'},
+            height=360,
+            quality='lowest',
+            extra_args={'webm': realtime_vpx, 'vp9': realtime_vpx})),
+    ])
+    for name, options in getattr(settings, 'WAGTAILVIDEOS_ENCODER_PROFILES', {}).items():
+        profiles[name] = EncoderProfile(name, **options)
+    return profiles
+
+
+def get_encoder_profile(name):
+    return get_encoder_profiles()[name]
+
+
+def get_av1_args():
+    encoder = getattr(settings, 'WAGTAILVIDEOS_AV1_ENCODER', 'libsvtav1')
+    if encoder == 'libaom-av1':
+        video_args = ['-codec:v', 'libaom-av1', '-crf', '{quality}', '-b:v', '0', '-cpu-used', '6', '-row-mt', '1']
+    else:
+        video_args = ['-codec:v', 'libsvtav1', '-crf', '{quality}', '-preset', '8']
+    return video_args + ['-codec:a', 'libopus', '-b:a', '128k']
+
+
+def get_builtin_formats():
+    return [
+        MediaFormat(
+            'webm', 'VP8 and Vorbis in WebM', 'webm',
+            ['-codec:v', 'libvpx', '-crf', '{quality}', '-codec:a', 'libvorbis'],
+            quality_params={'lowest': '50', 'default': '22', 'highest': '4'},
+            mime_type='video/webm',
+            remux_codecs=({'vp8'}, {'vorbis'}),
+            crf_range=(4, 63)),
+        MediaFormat(
+            'mp4', 'H.264 and MP3 in Mp4', 'mp4',
+            ['-codec:v', 'libx264', '-preset', 'slow', '-crf', '{quality}', '-codec:a', 'copy'],
+            quality_params={'lowest': '28', 'default': '24', 'highest': '18'},
+            mime_type='video/mp4',
+            remux_codecs=({'h264'}, {'aac', 'mp3'}),
+            crf_range=(0, 51),
+            # Put the index first, so playback can start before the whole
+            # file has been downloaded
+            remux_args=['-movflags', '+faststart']),
+        MediaFormat(
+            'ogg', 'Theora and Voris in Ogg', 'ogg',
+            ['-codec:v', 'libtheora', '-qscale:v', '{quality}', '-codec:a', 'libvorbis', '-qscale:a', '5'],
+            quality_params={'lowest': '5', 'default': '7', 'highest': '9'},
+            mime_type='video/ogg',
+            remux_codecs=({'theora'}, {'vorbis'})),
+        DefaultFormat(),
+        HLSFormat(),
+        MediaFormat(
+            'vp9', 'VP9 and Opus in WebM', 'webm',
+            ['-codec:v', 'libvpx-vp9', '-crf', '{quality}', '-b:v', '0', '-row-mt', '1',
+             '-codec:a', 'libopus', '-b:a', '128k'],
+            quality_params={'lowest': '40', 'default': '32', 'highest': '24'},
+            mime_type='video/webm; codecs="vp9, opus"',
+            remux_codecs=({'vp9'}, {'opus'}),
+            crf_range=(0, 63)),
+        MediaFormat(
+            'av1', 'AV1 and Opus in WebM', 'webm', get_av1_args(),
+            quality_params={'lowest': '45', 'default': '35', 'highest': '25'},
+            mime_type='video/webm; codecs="av01.0.08M.08, opus"',
+            remux_codecs=({'av1'}, {'opus'}),
+            crf_range=(0, 63)),
+        MediaFormat(
+            'hevc', 'HEVC and AAC in Mp4', 'mp4',
+            ['-codec:v', 'libx265', '-preset', 'medium', '-crf', '{quality}', '-tag:v', 'hvc1',
+             '-codec:a', 'aac', '-b:a', '128k', '-movflags', '+faststart'],
+            quality_params={'lowest': '32', 'default': '28', 'highest': '22'},
+            mime_type='video/mp4; codecs="hvc1, mp4a.40.2"',
+            remux_codecs=({'hevc'}, {'aac'}),
+            crf_range=(0, 51),
+            remux_args=['-tag:v', 'hvc1', '-movflags', '+faststart']),
+    ]
+
+
+_registered_formats = []
+
+
+def register_format(media_format):
+    _registered_formats.append(media_format)
+
+
+def get_formats():
+    """
+    All available formats, by name.
+    """
+    media_formats = OrderedDict()
+    for media_format in get_builtin_formats() + _registered_formats:
+        media_formats[media_format.name] = media_format
+    for name, options in getattr(settings, 'WAGTAILVIDEOS_MEDIA_FORMATS', {}).items():
+        if options is None:
+            media_formats.pop(name, None)
+        else:
+            media_formats[name] = MediaFormat(name, **options)
+    return media_formats
+
+
+def get_format(name):
+    """
+    Get a format by name. Also accepts members of the old ``MediaFormats``
+    enum. Returns ``None`` for unknown formats.
+    """
+    return get_formats().get(getattr(name, 'name', name))
+
+
+def get_choices():
+    return [(name, media_format.label) for name, media_format in get_formats().items()]
@@ -7,8 +7,9 @@ from wagtail.admin import widgets
 from wagtail.admin.forms.collections import (
     BaseCollectionMemberForm, collection_member_permission_formset_factory)
 
+from wagtailvideos import formats
 from wagtailvideos.fields import WagtailVideoField
-from wagtailvideos.models import MediaFormats, Video, VideoQuality
+from wagtailvideos.models import Video, VideoQuality
 from wagtailvideos.permissions import \
     permission_policy as video_permission_policy
 
@@ -61,7 +62,7 @@ def get_video_form(model):
 
 
 class VideoTranscodeAdminForm(forms.Form):
-    media_format = EnumField(MediaFormats)
+    media_format = forms.ChoiceField(choices=formats.get_choices)
     quality = EnumField(VideoQuality)
 
     def __init__(self, video, data=None, **kwargs):
@@ -0,0 +1,117 @@
+"""
+HTTP Live Streaming output: a ladder of renditions at different sizes and
+bitrates, and a master playlist that lets players pick between them.
+
+All renditions come from a single ffmpeg run. The ladder is set with
+``WAGTAILVIDEOS_HLS_LADDER``, a list of ``(height, video bitrate, audio
+bitrate)`` tuples; renditions taller than the video are left out.
+``WAGTAILVIDEOS_HLS_SEGMENT_TYPE`` chooses between ``'mpegts'`` and
+``'fmp4'`` segments, ``WAGTAILVIDEOS_HLS_SEGMENT_DURATION`` their length in
+seconds.
+
+The playlists and segments of a transcode are stored together in a
+directory of their own, and the file of the transcode is the master
+playlist.
+"""
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+
+MASTER_PLAYLIST = 'master.m3u8'
+
+DEFAULT_LADDER = [
+    (1080, '5000k', '128k'),
+    (720, '2800k', '128k'),
+    (480, '1400k', '96k'),
+    (360, '800k', '96k'),
+]
+
+
+def get_ladder(height=None):
+    ladder = sorted(
+        getattr(settings, 'WAGTAILVIDEOS_HLS_LADDER', DEFAULT_LADDER),
+        key=lambda rendition: rendition[0], reverse=True)
+    if height:
+        fitting = [rendition for rendition in ladder if rendition[0] <= height]
+        # Always keep at least the smallest rendition
+        ladder = fitting or ladder[-1:]
+    return ladder
+
+
+def get_output(video, directory):
+    """
+    The ffmpeg options and output path to write the ladder for ``video`` in
+    to ``directory``.
+    """
+    segment_type = getattr(settings, 'WAGTAILVIDEOS_HLS_SEGMENT_TYPE', 'mpegts')
+    segment_duration = getattr(settings, 'WAGTAILVIDEOS_HLS_SEGMENT_DURATION', 6)
+    segment_ext = '.m4s' if segment_type == 'fmp4' else '.ts'
+    # Assume there is audio until the video has been probed
+    has_audio = bool(video.audio_codec) or not video.container
+    ladder = get_ladder(video.height)
+
+    args = []
+    for i, (height, video_bitrate, audio_bitrate) in enumerate(ladder):
+        args += ['-map', '0:v:0']
+        if has_audio:
+            args += ['-map', '0:a:0']
+    for i, (height, video_bitrate, audio_bitrate) in enumerate(ladder):
+        args += [
+            '-filter:v:{}'.format(i), 'scale=-2:{}'.format(height),
+            '-b:v:{}'.format(i), video_bitrate,
+            '-maxrate:v:{}'.format(i), video_bitrate,
+            '-bufsize:v:{}'.format(i), video_bitrate,
+        ]
+        if has_audio:
+            args += ['-b:a:{}'.format(i), audio_bitrate]
+
+    stream_map = [
+        'v:{0},a:{0}'.format(i) if has_audio else 'v:{}'.format(i)
+        for i in range(len(ladder))]
+    args += [
+        '-codec:v', 'libx264',
+        '-preset', 'veryfast',
+        # Key frames at the same times in every rendition, so players can
+        # switch between them at any segment
+        '-force_key_frames', 'expr:gte(t,n_forced*{})'.format(segment_duration),
+        '-sc_threshold', '0',
+        '-codec:a', 'aac',
+        '-f', 'hls',
+        '-hls_time', str(segment_duration),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', segment_type,
+        '-hls_segment_filename', os.path.join(directory, 'stream_%v_%05d' + segment_ext),
+        '-master_pl_name', MASTER_PLAYLIST,
+        '-var_stream_map', ' '.join(stream_map),
+    ]
+    if segment_type == 'fmp4':
+        args += ['-hls_fmp4_init_filename', 'stream_%v_init.mp4']
+    return args, os.path.join(directory, 'stream_%v.m3u8')
+
+
+def save(transcode, directory):
+    """
+    Store the playlists and segments in ``directory`` and point the file of
+    ``transcode`` at the master playlist.
+    """
+    storage = transcode.file.storage
+    # A new directory every time, so the stored names are the ones the
+    # playlists refer to
+    stored_dir = os.path.join(
+        os.path.dirname(transcode.get_upload_to(MASTER_PLAYLIST)), 'hls', uuid.uuid4().hex)
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            storage.save(os.path.join(stored_dir, filename), File(f))
+    transcode.file.name = os.path.join(stored_dir, MASTER_PLAYLIST)
+
+
+def delete(storage, name):
+    """
+    Delete a stored master playlist with everything next to it.
+    """
+    stored_dir = os.path.dirname(name)
+    directories, files = storage.listdir(stored_dir)
+    for filename in files:
+        storage.delete(os.path.join(stored_dir, filename))
@@ -0,0 +1,130 @@
+"""
+Claiming transcodes, so that each is worked on by one worker at a time.
+
+A transcode is claimed with a single conditional ``UPDATE``, which only
+matches while nobody holds it, so two nodes can never both claim it. A
+claim is a lease: it names its owner and runs out after
+``WAGTAILVIDEOS_TRANSCODE_LEASE`` seconds unless the worker doing the work
+renews it with ``heartbeat``. A worker that crashes stops renewing, and
+``reap_expired_leases`` (run it every few minutes, with celery beat for
+example) hands the transcode to another worker. After
+``WAGTAILVIDEOS_MAX_TRANSCODE_ATTEMPTS`` claims it is given up on.
+"""
+import datetime
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+
+def get_lease_duration():
+    return datetime.timedelta(seconds=getattr(settings, 'WAGTAILVIDEOS_TRANSCODE_LEASE', 600))
+
+
+def get_max_attempts():
+    return getattr(settings, 'WAGTAILVIDEOS_MAX_TRANSCODE_ATTEMPTS', 3)
+
+
+def new_owner():
+    return uuid.uuid4().hex
+
+
+def expired(now=None):
+    """
+    Matches transcodes that are being processed but whose lease has run out.
+    Transcodes from before leases were added have none.
+    """
+    now = now or timezone.now()
+    return Q(processing=True) & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+
+
+def claim(transcode, owner, **fields):
+    """
+    Mark ``transcode`` as processing under a lease for ``owner``, and update
+    ``fields``, if nobody else holds it. Returns whether it was claimed.
+    """
+    now = timezone.now()
+    fields.update(processing=True, lease_owner=owner, lease_expires_at=now + get_lease_duration())
+    claimed = type(transcode).objects \
+        .filter(Q(processing=False) | expired(now), pk=transcode.pk) \
+        .update(**fields)
+    if not claimed:
+        return False
+    for name, value in fields.items():
+        setattr(transcode, name, value)
+    return True
+
+
+def is_held(transcode):
+    """
+    Whether the lease on ``transcode`` is still the one it was claimed with.
+    """
+    if not transcode.lease_owner:
+        return True
+    return type(transcode).objects.filter(pk=transcode.pk, lease_owner=transcode.lease_owner).exists()
+
+
+def save_if_held(transcode, owner):
+    """
+    Save ``transcode`` with a single conditional ``UPDATE`` that only
+    matches while ``owner`` holds its lease. Returns whether it was saved.
+    """
+    fields = {
+        field.attname: getattr(transcode, field.attname)
+        for field in transcode._meta.concrete_fields if not field.primary_key}
+    return type(transcode).objects.filter(pk=transcode.pk, lease_owner=owner).update(**fields) == 1
+
+
+def release(transcode):
+    """
+    Give up the lease on ``transcode``. Save it afterwards, with
+    ``save_if_held``.
+    """
+    transcode.processing = False
+    transcode.lease_owner = ''
+    transcode.lease_expires_at = None
+
+
+def renew(transcodes):
+    """
+    Extend the leases on ``transcodes`` that are still held.
+    """
+    if not transcodes:
+        return
+    model = type(transcodes[0])
+    expires_at = timezone.now() + get_lease_duration()
+    for owner in {transcode.lease_owner for transcode in transcodes if transcode.lease_owner}:
+        model.objects.filter(
+            pk__in=[transcode.pk for transcode in transcodes], lease_owner=owner, processing=True,
+        ).update(lease_expires_at=expires_at)
+
+
+@contextmanager
+def heartbeat(transcodes):
+    """
+    Keep renewing the leases on ``transcodes`` for as long as the block
+    runs.
+    """
+    transcodes = list(transcodes)
+    interval = get_lease_duration().total_seconds() / 3
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                renew(transcodes)
+        finally:
+            connection.close()
+
+    renew(transcodes)
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
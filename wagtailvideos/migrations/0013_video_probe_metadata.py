@@ -0,0 +1,58 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0012_auto_20190320_1602'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='audio_channels',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='audio channels'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='audio_codec',
+            field=models.CharField(blank=True, editable=False, max_length=50, verbose_name='audio codec'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='bitrate',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='bitrate'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='container',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='container'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='fps',
+            field=models.FloatField(editable=False, null=True, verbose_name='frames per second'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='height',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='height'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='rotation',
+            field=models.SmallIntegerField(editable=False, null=True, verbose_name='rotation'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='video_codec',
+            field=models.CharField(blank=True, editable=False, max_length=50, verbose_name='video codec'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='width',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='width'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:30
+
+from django.db import migrations, models
+import enumchoicefield.fields
+import wagtailvideos.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0013_video_probe_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='validation_message',
+            field=models.TextField(blank=True, editable=False, verbose_name='validation message'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='validation_status',
+            field=enumchoicefield.fields.EnumChoiceField(default=wagtailvideos.models.ValidationStatus(1), editable=False, enum_class=wagtailvideos.models.ValidationStatus, max_length=8, verbose_name='validation status'),
+        ),
+    ]
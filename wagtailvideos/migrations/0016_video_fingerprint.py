@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0015_video_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='fingerprint',
+            field=models.BinaryField(null=True, verbose_name='fingerprint'),
+        ),
+        migrations.CreateModel(
+            name='VideoFingerprintBand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('value', models.PositiveIntegerField()),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint_bands', to='wagtailvideos.Video')),
+            ],
+            options={
+                'index_together': {('position', 'value')},
+            },
+        ),
+    ]
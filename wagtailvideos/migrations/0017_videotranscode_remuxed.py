@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0016_video_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videotranscode',
+            name='remuxed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='remuxed'),
+        ),
+    ]
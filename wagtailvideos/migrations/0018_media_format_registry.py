@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0017_videotranscode_remuxed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videotranscode',
+            name='media_format',
+            field=models.CharField(default='default', max_length=50, verbose_name='media format'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:51
+
+from django.db import migrations
+import enumchoicefield.fields
+import wagtailvideos.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0018_media_format_registry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videotranscode',
+            name='stage',
+            field=enumchoicefield.fields.EnumChoiceField(default=wagtailvideos.models.TranscodeStage(2), editable=False, enum_class=wagtailvideos.models.TranscodeStage, max_length=7, verbose_name='stage'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0019_videotranscode_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='complexity',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='complexity'),
+        ),
+        migrations.AddField(
+            model_name='videotranscode',
+            name='quality_param',
+            field=models.CharField(blank=True, editable=False, max_length=20, verbose_name='quality parameter'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0020_per_title_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videotranscode',
+            name='eta',
+            field=models.DurationField(blank=True, editable=False, null=True, verbose_name='time left'),
+        ),
+        migrations.AddField(
+            model_name='videotranscode',
+            name='progress',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='progress'),
+        ),
+        migrations.AddField(
+            model_name='videotranscode',
+            name='speed',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='speed'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:55
+
+from django.db import migrations
+import enumchoicefield.fields
+import wagtailvideos.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0021_videotranscode_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videotranscode',
+            name='error_type',
+            field=enumchoicefield.fields.EnumChoiceField(blank=True, editable=False, enum_class=wagtailvideos.models.TranscodeErrorType, max_length=15, null=True, verbose_name='error type'),
+        ),
+    ]
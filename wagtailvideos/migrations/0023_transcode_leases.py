@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0022_videotranscode_error_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videotranscode',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='attempts'),
+        ),
+        migrations.AddField(
+            model_name='videotranscode',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='lease expires at'),
+        ),
+        migrations.AddField(
+            model_name='videotranscode',
+            name='lease_owner',
+            field=models.CharField(blank=True, editable=False, max_length=32, verbose_name='lease owner'),
+        ),
+    ]
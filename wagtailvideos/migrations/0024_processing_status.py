@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:06
+
+from django.db import migrations
+import enumchoicefield.fields
+import wagtailvideos.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailvideos', '0023_transcode_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='processing_status',
+            field=enumchoicefield.fields.EnumChoiceField(default=wagtailvideos.models.ProcessingStatus(2), editable=False, enum_class=wagtailvideos.models.ProcessingStatus, max_length=10, verbose_name='processing status'),
+        ),
+    ]
@@ -16,8 +16,8 @@ from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
-from django.db import models
-from celery import chain
+from django.db import models, transaction
+from celery import chain, chord, group
 from enumchoicefield import ChoiceEnum, EnumChoiceField
 from taggit.managers import TaggableManager
 from wagtail.admin.models import get_object_usage
@@ -25,9 +25,15 @@ from wagtail.core.models import CollectionMember
 from wagtail.search import index
 from wagtail.search.queryset import SearchableQuerySetMixin
 
+from wagtailvideos import (
+    cache, failures, fingerprint, formats, leases, progress, scheduling, segments,
+)
+from wagtailvideos.sources import open_source
 from wagtailvideos.tasks import (
-    get_video_metadata, schedule_default_transcode, transcoding_task,
+    finalise_video, get_video_metadata, schedule_default_transcode,
+    transcoding_task, validate_video_codec, video_processing_failed,
 )
+from wagtailvideos.uploadhandler import hash_file
 
 
 log = logging.getLogger(__name__)
@@ -40,36 +46,77 @@ class VideoQuality(ChoiceEnum):
 
 
 class MediaFormats(ChoiceEnum):
+    """
+    The formats transcodes used to be limited to. Old migrations refer to
+    this; formats are now defined in ``wagtailvideos.formats``.
+    """
     webm = 'VP8 and Vorbis in WebM'
     mp4 = 'H.264 and MP3 in Mp4'
     ogg = 'Theora and Voris in Ogg'
     default = 'Default codec'
 
-    def get_quality_param(self, quality):
-        if self is MediaFormats.webm:
-            return {
-                VideoQuality.lowest: '50',
-                VideoQuality.default: '22',
-                VideoQuality.highest: '4'
-            }[quality]
-        elif self is MediaFormats.mp4:
-            return {
-                VideoQuality.lowest: '28',
-                VideoQuality.default: '24',
-                VideoQuality.highest: '18'
-            }[quality]
-        elif self is MediaFormats.ogg:
-            return {
-                VideoQuality.lowest: '5',
-                VideoQuality.default: '7',
-                VideoQuality.highest: '9'
-            }[quality]
-        elif self is MediaFormats.default:
-            return '0'
+
+class TranscodeStage(ChoiceEnum):
+    """
+    Which encoder profile a transcode was made with, see
+    ``wagtailvideos.formats.get_encoder_profiles``.
+    """
+    preview = 'Preview'
+    final = 'Final'
+
+
+class TranscodeErrorType(ChoiceEnum):
+    """
+    Why a transcode failed, see ``wagtailvideos.failures``.
+    """
+    missing_encoder = 'Encoder not available'
+    corrupt_input = 'Corrupt input'
+    disk_full = 'Disk full'
+    timeout = 'Timed out'
+    abandoned = 'Worker stopped'
+    unknown = 'Unknown error'
+
+
+class ValidationStatus(ChoiceEnum):
+    valid = 'Valid'
+    pending = 'Pending validation'
+    rejected = 'Rejected'
+
+
+class ProcessingStatus(ChoiceEnum):
+    processing = 'Processing'
+    ready = 'Ready'
+    failed = 'Processing failed'
+
+
+def deferred_validation_enabled():
+    if not getattr(settings, 'WAGTAILVIDEOS_DEFERRED_CODEC_VALIDATION', False):
+        return False
+    return bool(getattr(settings, 'WAGTAILVIDEOS_ALLOWED_CODECS', ()))
+
+
+def deduplication_enabled():
+    return getattr(settings, 'WAGTAILVIDEOS_DEDUPLICATE_UPLOADS', True)
+
+
+def delete_unused_file(field_file, queryset):
+    """
+    Delete a stored file, unless another object in ``queryset`` still uses
+    it. Deduplicated videos and their transcodes share files.
+    """
+    if not field_file:
+        return
+    if not queryset.filter(**{field_file.field.name: field_file.name}).exists():
+        field_file.storage.delete(field_file.name)
 
 
 class VideoQuerySet(SearchableQuerySetMixin, models.QuerySet):
-    pass
+    def valid(self):
+        """
+        Videos that can be shown, leaving out those that were rejected or
+        are still waiting to be validated.
+        """
+        return self.filter(validation_status=ValidationStatus.valid)
 
 
 def get_upload_to(instance, filename):
@@ -95,14 +142,52 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
 
     file_size = models.PositiveIntegerField(null=True, editable=False)
 
+    # Populated from a single ffprobe run, see ``set_probe_result``
+    container = models.CharField(max_length=255, blank=True, editable=False, verbose_name=_('container'))
+    video_codec = models.CharField(max_length=50, blank=True, editable=False, verbose_name=_('video codec'))
+    audio_codec = models.CharField(max_length=50, blank=True, editable=False, verbose_name=_('audio codec'))
+    width = models.PositiveIntegerField(null=True, editable=False, verbose_name=_('width'))
+    height = models.PositiveIntegerField(null=True, editable=False, verbose_name=_('height'))
+    fps = models.FloatField(null=True, editable=False, verbose_name=_('frames per second'))
+    bitrate = models.PositiveIntegerField(null=True, editable=False, verbose_name=_('bitrate'))
+    audio_channels = models.PositiveSmallIntegerField(null=True, editable=False, verbose_name=_('audio channels'))
+    rotation = models.SmallIntegerField(null=True, editable=False, verbose_name=_('rotation'))
+
+    # Uploads with the same hash as an existing video share its files
+    content_hash = models.CharField(
+        max_length=64, blank=True, db_index=True, editable=False, verbose_name=_('content hash'))
+
+    # Perceptual hashes of sampled frames, see ``wagtailvideos.fingerprint``
+    fingerprint = models.BinaryField(null=True, editable=False, verbose_name=_('fingerprint'))
+    # How hard the video is to compress, see ``wagtailvideos.complexity``
+    complexity = models.FloatField(null=True, blank=True, editable=False, verbose_name=_('complexity'))
+
+    # With WAGTAILVIDEOS_DEFERRED_CODEC_VALIDATION, new files are accepted as
+    # pending and checked against WAGTAILVIDEOS_ALLOWED_CODECS by a task
+    validation_status = EnumChoiceField(
+        ValidationStatus, default=ValidationStatus.valid, editable=False,
+        verbose_name=_('validation status'))
+    validation_message = models.TextField(blank=True, editable=False, verbose_name=_('validation message'))
+    # Set to ready by the last job processing a new file
+    processing_status = EnumChoiceField(
+        ProcessingStatus, default=ProcessingStatus.ready, editable=False,
+        verbose_name=_('processing status'))
+
     objects = VideoQuerySet.as_manager()
 
+    # Copied from the original when an upload is deduplicated
+    probe_fields = (
+        'duration', 'container', 'video_codec', 'audio_codec', 'width',
+        'height', 'fps', 'bitrate', 'audio_channels', 'rotation',
+    )
+
     search_fields = list(CollectionMember.search_fields) + [
         index.SearchField('title', partial_match=True, boost=10),
         index.RelatedFields('tags', [
             index.SearchField('name', partial_match=True, boost=10),
         ]),
         index.FilterField('uploaded_by_user'),
+        index.FilterField('validation_status'),
     ]
 
     def __init__(self, *args, **kwargs):
@@ -110,6 +195,8 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
         self._initial_file = self.file
 
     def get_file_size(self):
+        if not self.file:
+            return
         if self.file_size is None:
             try:
                 self.file_size = self.file.size
@@ -121,6 +208,24 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
 
         return self.file_size
 
+    def set_probe_result(self, result):
+        """
+        Copy the metadata from an ``ffmpeg.ProbeResult`` on to this video.
+        Does not save the video.
+        """
+        if result is None:
+            return
+        self.duration = result.duration
+        self.container = result.container or ''
+        self.video_codec = result.video_codec or ''
+        self.audio_codec = result.audio_codec or ''
+        self.width = result.width
+        self.height = result.height
+        self.fps = result.fps
+        self.bitrate = result.bitrate
+        self.audio_channels = result.audio_channels
+        self.rotation = result.rotation
+
     def get_thumbnail_path(self):
         head, tail = os.path.split(self.file.name)
         fname, ext = os.path.splitext(tail)
@@ -165,7 +270,161 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
     def __str__(self):
         return self.title
 
+    @property
+    def is_rejected(self):
+        return self.validation_status is ValidationStatus.rejected
+
+    def accept(self):
+        self.validation_status = ValidationStatus.valid
+        self.validation_message = ''
+        self.save(update_fields=['validation_status', 'validation_message'])
+
+    def mark_ready(self):
+        self.processing_status = ProcessingStatus.ready
+        self.save(update_fields=['processing_status'])
+
+    def mark_failed(self):
+        self.processing_status = ProcessingStatus.failed
+        self.save(update_fields=['processing_status'])
+
+    def reject(self, message):
+        """
+        Quarantine a video that failed validation: remove its files and keep
+        the record, with the reason, for editors to see.
+        """
+        log.info("rejecting video %s: %s", self.pk, message)
+        if getattr(settings, 'WAGTAILVIDEOS_DELETE_REJECTED_VIDEOS', False):
+            self.delete()
+            return
+
+        self.validation_status = ValidationStatus.rejected
+        self.validation_message = message
+        others = type(self).objects.exclude(pk=self.pk)
+        delete_unused_file(self.thumbnail, others)
+        delete_unused_file(self.file, others)
+        self.thumbnail = None
+        self.file = None
+        self.save(update_fields=['validation_status', 'validation_message', 'file', 'thumbnail'])
+
+    def find_duplicate(self):
+        """
+        Find an earlier video with the same contents as this one. Videos
+        still pending validation are left out, as they may yet be rejected.
+        """
+        if not self.content_hash:
+            return None
+        return type(self).objects \
+            .filter(content_hash=self.content_hash) \
+            .exclude(pk=self.pk) \
+            .exclude(file='') \
+            .exclude(validation_status=ValidationStatus.rejected) \
+            .exclude(validation_status=ValidationStatus.pending) \
+            .order_by('created_at') \
+            .first()
+
+    def reuse_original(self, original):
+        """
+        Point this video at the stored file, thumbnail and metadata of
+        ``original`` instead of storing and probing the upload again. The
+        transcodes are copied once this video has been saved.
+        """
+        self._duplicate_of = original
+        self.file = original.file.name
+        self.file_size = original.file_size
+        self.thumbnail = original.thumbnail.name if original.thumbnail else None
+        for field in self.probe_fields:
+            setattr(self, field, getattr(original, field))
+        self.fingerprint = original.fingerprint
+        self.complexity = original.complexity
+        self.validation_status = original.validation_status
+        self.validation_message = original.validation_message
+        self.processing_status = original.processing_status
+
+    def copy_transcodes(self, original):
+        """
+        Share the finished transcodes of ``original`` with this video.
+        Returns the number of transcodes copied.
+        """
+        transcodes = original.transcodes \
+            .filter(processing=False, error_message='', stage=TranscodeStage.final) \
+            .exclude(file='').exclude(file__isnull=True)
+        for transcode in transcodes:
+            self.transcodes.update_or_create(media_format=transcode.media_format, defaults={
+                'quality': transcode.quality,
+                'file': transcode.file.name,
+                'processing': False,
+                'error_message': '',
+                'error_type': None,
+            })
+        return len(transcodes)
+
+    @classmethod
+    def get_fingerprint_band_model(cls):
+        return cls.fingerprint_bands.rel.related_model
+
+    def index_fingerprint(self):
+        """
+        Replace the band index entries of this video with those of its
+        current fingerprint.
+        """
+        Band = self.get_fingerprint_band_model()
+        with transaction.atomic():
+            self.fingerprint_bands.all().delete()
+            Band.objects.bulk_create([
+                Band(video=self, position=position, value=value)
+                for position, value in fingerprint.get_bands(self.fingerprint)
+            ])
+
+    @property
+    def is_fingerprinted(self):
+        """
+        Whether the metadata task has been at this video, so that
+        ``find_near_duplicates`` has something to go on if it ever will.
+        """
+        if self.fingerprint is not None or self.thumbnail or self.is_rejected:
+            return True
+        return self.processing_status is ProcessingStatus.ready
+
+    def find_near_duplicates(self, limit=10):
+        """
+        Find other videos that look like re-encodes of this one, closest
+        first. Returns a list of ``(video, distance)`` pairs.
+        """
+        bands = fingerprint.get_bands(self.fingerprint)
+        if not bands:
+            return []
+        query = models.Q()
+        for position, value in bands:
+            query |= models.Q(position=position, value=value)
+        candidate_ids = self.get_fingerprint_band_model().objects \
+            .filter(query).exclude(video=self) \
+            .values_list('video_id', flat=True).distinct()
+
+        max_distance = fingerprint.get_max_distance()
+        matches = []
+        candidates = type(self).objects.filter(pk__in=candidate_ids) \
+            .exclude(validation_status=ValidationStatus.rejected)
+        for video in candidates:
+            distance = fingerprint.distance(self.fingerprint, video.fingerprint)
+            if distance is not None and distance <= max_distance:
+                matches.append((video, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches[:limit]
+
     def save(self, **kwargs):
+        file_changed = self.file and self.file != self._initial_file
+        if self.file and not self.file._committed:
+            self.content_hash = getattr(self.file.file, 'content_hash', None) or hash_file(self.file)
+            original = self.find_duplicate() if file_changed and deduplication_enabled() else None
+            if original is not None:
+                log.info("video %s is a duplicate of video %s", self.pk, original.pk)
+                self.reuse_original(original)
+                file_changed = False
+        if file_changed:
+            self.processing_status = ProcessingStatus.processing
+        if file_changed and deferred_validation_enabled():
+            self.validation_status = ValidationStatus.pending
+            self.validation_message = ''
         super(AbstractVideo, self).save(**kwargs)
 
     @property
@@ -198,6 +457,10 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
             return self.do_transcode(media_format)
 
     def video_tag(self, attrs=None):
+        if not self.file or self.validation_status is not ValidationStatus.valid:
+            # Rejected videos have had their files removed, and pending
+            # ones are not shown until they have been accepted
+            return ''
         if attrs is None:
             attrs = {}
         else:
@@ -205,10 +468,18 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
         if self.thumbnail:
             attrs['poster'] = self.thumbnail.url
 
-        transcodes = self.transcodes.exclude(processing=True).filter(error_message__exact='')
+        # A transcode that is being made again keeps serving its previous
+        # file, such as the preview of a two stage transcode
+        transcodes = self.transcodes.filter(error_message__exact='') \
+            .exclude(file='').exclude(file__isnull=True)
+        # Players that can stream adaptively should find that option first
+        transcodes = sorted(transcodes, key=lambda transcode: transcode.media_format != 'hls')
         sources = []
         for transcode in transcodes:
-            sources.append("<source src='{0}' type='video/{1}' >".format(transcode.url, transcode.media_format.name))
+            media_format = transcode.get_media_format()
+            if media_format is None:
+                continue
+            sources.append("<source src='{0}' type='{1}' >".format(transcode.url, media_format.get_mime_type()))
 
         mime = mimetypes.MimeTypes()
         sources.append("<source src='{0}' type='{1}'>"
@@ -219,19 +490,54 @@ class AbstractVideo(CollectionMember, index.Indexed, models.Model):
             "<video {0}>\n{1}\n</video>".format(flatatt(attrs), "\n".join(sources)))
 
     def do_transcode(self, media_format, quality):
-        transcode, created = self.transcodes.get_or_create(
-            media_format=media_format,
-        )
-        if transcode.processing is False:
-            transcode.processing = True
-            transcode.error_message = ''
-            transcode.quality = quality
-            # Lock the transcode model
-            transcode.save(update_fields=['processing', 'error_message',
-                                          'quality'])
-            TranscodingTask(transcode).start()
-        else:
-            pass  # TODO Queue?
+        # Someone is waiting for this one
+        self.do_transcodes([media_format], quality, interactive=True)
+
+    def do_transcodes(self, media_formats, quality=VideoQuality.default, stage=TranscodeStage.final,
+                      interactive=False):
+        """
+        Transcode this video in to several formats in the background, with
+        a single ffmpeg run unless WAGTAILVIDEOS_MULTI_OUTPUT_TRANSCODING is
+        turned off. ``interactive`` transcodes are scheduled ahead of
+        others, see ``wagtailvideos.scheduling``.
+        """
+        transcodes = self.lock_transcodes(media_formats, quality)
+        if transcodes:
+            TranscodingTask(*transcodes, stage=stage, interactive=interactive).start()
+
+    def lock_transcodes(self, media_formats, quality=VideoQuality.default):
+        """
+        Get or create the transcodes of this video in ``media_formats`` (names
+        from ``wagtailvideos.formats``) and claim them, see
+        ``wagtailvideos.leases``. Transcodes that someone else holds are
+        left out; they are finished by the holder, or handed on once its
+        lease runs out.
+        """
+        owner = leases.new_owner()
+        transcodes = []
+        for media_format in media_formats:
+            transcode, created = self.transcodes.get_or_create(
+                media_format=getattr(media_format, 'name', media_format),
+            )
+            claimed = leases.claim(
+                transcode, owner, error_message='', error_type=None, quality=quality, attempts=1)
+            # Fail now rather than queue a job that can not succeed
+            if claimed and not transcode.reject_unsupported():
+                transcodes.append(transcode)
+        return transcodes
+
+    def transcodes_settled(self, media_formats):
+        """
+        Whether this video has a transcode in each of ``media_formats`` that
+        is either finished, failed, or has a preview to serve until it is.
+        """
+        transcodes = self.transcodes.filter(media_format__in=media_formats)
+        if transcodes.count() < len(set(media_formats)):
+            return False
+        return not transcodes \
+            .filter(processing=True) \
+            .filter(models.Q(file='') | models.Q(file__isnull=True)) \
+            .exists()
 
     class Meta:
         abstract = True
@@ -250,11 +556,19 @@ class Video(AbstractVideo):
 
 
 class TranscodingTask:
-    def __init__(self, transcode):
-        self.transcode = transcode
+    def __init__(self, *transcodes, stage=TranscodeStage.final, interactive=False):
+        self.transcodes = transcodes
+        self.stage = TranscodeStage[getattr(stage, 'name', stage)]
+        self.interactive = interactive
 
     def start(self):
-        transcoding_task.delay(self.transcode.pk)
+        pks = [transcode.pk for transcode in self.transcodes]
+        # The job only runs the transcodes if they are still claimed by the
+        # same owner when it starts
+        kwargs = {'stage': self.stage.name, 'lease_owner': self.transcodes[0].lease_owner}
+        kind = 'preview' if self.stage is TranscodeStage.preview else 'encode'
+        options = scheduling.get_options(self.transcodes[0].video, kind, interactive=self.interactive)
+        transcoding_task.apply_async(args=pks, kwargs=kwargs, **options)
 
 
 class TranscodingThread(threading.Thread):
@@ -268,8 +582,9 @@ class TranscodingThread(threading.Thread):
 # Delete files when model is deleted
 @receiver(pre_delete, sender=Video)
 def video_delete(sender, instance, **kwargs):
-    instance.thumbnail.delete(False)
-    instance.file.delete(False)
+    others = sender.objects.exclude(pk=instance.pk)
+    delete_unused_file(instance.thumbnail, others)
+    delete_unused_file(instance.file, others)
 
 
 # Fields that need the actual video file to create
@@ -277,20 +592,106 @@ def video_delete(sender, instance, **kwargs):
 def video_saved(sender, instance, **kwargs):
     log.debug("video saved...")
     if hasattr(instance, '_initial_file'):
-        if instance.file != instance._initial_file:
-            chain(
-                get_video_metadata.si(object_pk=instance.pk),
-                schedule_default_transcode.si(object_pk=instance.pk),
-            )()
+        if instance.file and instance.file != instance._initial_file:
+            tasks = []
+            metadata_options = scheduling.get_options(instance, 'metadata')
+            # Any job that raises leaves the video failed, rather than
+            # processing for good
+            failed = video_processing_failed.si(instance.pk).set(**metadata_options)
+            original = instance.__dict__.pop('_duplicate_of', None)
+            if original is None:
+                copied = 0
+                if instance.validation_status is ValidationStatus.pending:
+                    tasks.append(validate_video_codec.si(object_pk=instance.pk).set(
+                        **metadata_options).on_error(failed))
+            else:
+                copied = instance.copy_transcodes(original)
+                instance.index_fingerprint()
+            # A duplicate of a video that is still being processed fills in
+            # whatever the original does not have yet
+            if original is None or not instance.thumbnail:
+                tasks.append(get_video_metadata.si(object_pk=instance.pk).set(
+                    **metadata_options).on_error(failed))
+            if not copied:
+                # One job per default format, spread over the workers. The
+                # video is ready once they have all finished; without a
+                # result backend to wait on them, the last job to finish
+                # marks it ready
+                two_stage = getattr(settings, 'WAGTAILVIDEOS_TWO_STAGE_TRANSCODING', False)
+                transcode_options = scheduling.get_options(instance, 'preview' if two_stage else 'encode')
+                media_formats = getattr(settings, 'WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS', ['default'])
+                # Until they are claimed, the transcodes count as queued
+                # work towards the fair share of later uploads
+                for media_format in media_formats:
+                    instance.transcodes.get_or_create(media_format=media_format)
+                join = scheduling.can_join()
+                jobs = [
+                    schedule_default_transcode.si(instance.pk, *job_formats, finalise=not join).set(
+                        **transcode_options).on_error(failed)
+                    for job_formats in scheduling.get_transcode_groups(media_formats)]
+                if join:
+                    tasks.append(chord(jobs, finalise_video.si(instance.pk).set(
+                        **metadata_options).on_error(failed)))
+                else:
+                    tasks.append(group(jobs))
+            elif tasks:
+                tasks.append(finalise_video.si(instance.pk).set(**metadata_options).on_error(failed))
+            if tasks:
+                chain(*tasks)()
+            elif instance.processing_status is ProcessingStatus.processing:
+                # Copied in full from an original that is still being
+                # processed for other formats
+                instance.processing_status = ProcessingStatus.ready
+                sender.objects.filter(pk=instance.pk).update(processing_status=ProcessingStatus.ready)
+
+
+class AbstractVideoFingerprintBand(models.Model):
+    # Which frame of the fingerprint, and which band of its hash
+    position = models.PositiveSmallIntegerField()
+    value = models.PositiveIntegerField()
+
+    class Meta:
+        abstract = True
+
+
+class VideoFingerprintBand(AbstractVideoFingerprintBand):
+    video = models.ForeignKey(Video, related_name='fingerprint_bands', on_delete=models.CASCADE)
+
+    class Meta:
+        index_together = (
+            ('position', 'value')
+        )
 
 
 class AbstractVideoTranscode(models.Model):
-    media_format = EnumChoiceField(MediaFormats, default=MediaFormats.default)
+    # The name of a format in ``wagtailvideos.formats``
+    media_format = models.CharField(max_length=50, default='default', verbose_name=_('media format'))
     quality = EnumChoiceField(VideoQuality, default=VideoQuality.default)
     processing = models.BooleanField(default=False)
     file = models.FileField(null=True, blank=True, verbose_name=_('file'),
                             upload_to=get_upload_to)
+    # The end of the ffmpeg log of a failed transcode
     error_message = models.TextField(blank=True)
+    error_type = EnumChoiceField(TranscodeErrorType, null=True, blank=True, editable=False,
+                                 verbose_name=_('error type'))
+    # The streams of the video were copied, rather than encoded again
+    remuxed = models.BooleanField(default=False, editable=False, verbose_name=_('remuxed'))
+    stage = EnumChoiceField(TranscodeStage, default=TranscodeStage.final, editable=False,
+                            verbose_name=_('stage'))
+    # The CRF or other quality parameter the transcode was made with
+    quality_param = models.CharField(max_length=20, blank=True, editable=False,
+                                     verbose_name=_('quality parameter'))
+    # How far along transcoding is, see ``wagtailvideos.progress``. The
+    # speed is a multiple of real time
+    progress = models.FloatField(null=True, blank=True, editable=False, verbose_name=_('progress'))
+    speed = models.FloatField(null=True, blank=True, editable=False, verbose_name=_('speed'))
+    eta = models.DurationField(null=True, blank=True, editable=False, verbose_name=_('time left'))
+    # Who is working on the transcode, and until when, see
+    # ``wagtailvideos.leases``
+    lease_owner = models.CharField(max_length=32, blank=True, editable=False, verbose_name=_('lease owner'))
+    lease_expires_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                            verbose_name=_('lease expires at'))
+    attempts = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name=_('attempts'))
 
     @property
     def url(self):
@@ -301,72 +702,261 @@ class AbstractVideoTranscode(models.Model):
         filename = self.file.field.storage.get_valid_name(filename)
         return os.path.join(folder_name, filename)
 
-    def run_transcoding(self):
-        transcode = self
-        video = transcode.video
-        media_format = transcode.media_format
-        input_file = video.file.path
-        output_dir = tempfile.mkdtemp()
-        default_ext = getattr(settings, "WAGTAILVIDEOS_DEFAULT_COMPRESSION_EXT", "mov")
-        default_compression_args = getattr(settings, "WAGTAILVIDEOS_DEFAULT_COMPRESSION_ARGS", None)
-        if media_format is MediaFormats.default and default_compression_args is None:
+    def get_media_format(self):
+        return formats.get_format(self.media_format)
+
+    def get_output_name(self):
+        return "{0}.{1}".format(
+            self.video.filename(include_ext=False),
+            self.get_media_format().get_extension())
+
+    def run_transcoding(self, stage=TranscodeStage.final):
+        type(self).run_transcodings([self], stage=stage)
+
+    @classmethod
+    def run_transcodings(cls, transcodes, stage=TranscodeStage.final):
+        """
+        Produce transcodes of one video with a single ffmpeg run that has an
+        output for each of them, so the source is only decoded once. When
+        that run fails the transcodes are retried one at a time, so each one
+        records its own error. Formats the video is already in are remuxed
+        rather than encoded, see ``can_remux``.
+
+        ``stage`` (a ``TranscodeStage`` or its name) picks the encoder
+        profile. Profiles that ask for two passes get them, except for long
+        videos that are encoded in segments.
+        """
+        stage = TranscodeStage[getattr(stage, 'name', stage)]
+        if len(transcodes) > 1 and not getattr(settings, 'WAGTAILVIDEOS_MULTI_OUTPUT_TRANSCODING', True):
+            for transcode in transcodes:
+                cls.run_transcodings([transcode], stage=stage)
             return
-        ext = media_format.name if media_format is not MediaFormats.default \
-            else default_ext
-        transcode_name = "{0}.{1}".format(
-            video.filename(include_ext=False),
-            ext)
-
-        output_file = os.path.join(output_dir, transcode_name)
-        FNULL = open(os.devnull, 'r')
-        quality_param = media_format.get_quality_param(transcode.quality)
-        args = ['ffmpeg', '-hide_banner', '-i', input_file]
+        profile = formats.get_encoder_profile(stage.name)
+
+        output_dir = tempfile.mkdtemp(dir=getattr(settings, 'WAGTAILVIDEOS_TRANSCODE_TEMP_DIR', None))
+        error = None
         try:
-            if media_format is MediaFormats.ogg:
-                subprocess.check_output(args + [
-                    '-codec:v', 'libtheora',
-                    '-qscale:v', quality_param,
-                    '-codec:a', 'libvorbis',
-                    '-qscale:a', '5',
-                    output_file,
-                ], stdin=FNULL, stderr=subprocess.STDOUT)
-            elif media_format is MediaFormats.mp4:
-                subprocess.check_output(args + [
-                    '-codec:v', 'libx264',
-                    '-preset', 'slow',  # TODO Checkout other presets
-                    '-crf', quality_param,
-                    '-codec:a', 'copy',
-                    output_file,
-                ], stdin=FNULL, stderr=subprocess.STDOUT)
-            elif media_format is MediaFormats.webm:
-                subprocess.check_output(args + [
-                    '-codec:v', 'libvpx',
-                    '-crf', quality_param,
-                    '-codec:a', 'libvorbis',
-                    output_file,
-                ], stdin=FNULL, stderr=subprocess.STDOUT)
-            elif media_format is MediaFormats.default:
-                subprocess.check_output(
-                    args + default_compression_args.split() + [output_file],
-                    stdin=FNULL, stderr=subprocess.STDOUT)
-
-            transcode_fname = self.get_upload_to(transcode_name)
-            transcode_path = os.path.join(
-                settings.MEDIA_ROOT,
-                transcode_fname
-            )
-            os.makedirs(os.path.dirname(transcode_path), exist_ok=True)
-            shutil.move(output_file, transcode_path)
-            transcode.file.name = transcode_fname
-            transcode.error_message = ''
-        except subprocess.CalledProcessError as error:
-            transcode.error_message = error.output
+            outputs = []
+            for transcode in transcodes:
+                transcode.remuxed = transcode.can_remux()
+                if transcode.reject_unsupported():
+                    continue
+                # A remux is as quick as a preview, and as good as it gets
+                transcode.stage = TranscodeStage.final if transcode.remuxed else stage
+                # Formats may share an extension, so each gets a directory
+                directory = os.path.join(output_dir, transcode.media_format)
+                output = transcode.get_output(directory, profile)
+                if output is None:
+                    transcode.fail(_("There are no ffmpeg options for this format."), TranscodeErrorType.unknown)
+                    continue
+                os.mkdir(directory)
+                outputs.append((transcode, ) + output)
+            if not outputs:
+                return
+            video = outputs[0][0].video
+
+            # Long videos are split up and encoded in parallel, which needs
+            # to read the source more than once
+            single_pass = []
+            encodes = []
+            for transcode, args, output_file in outputs:
+                if transcode.remuxed or not transcode.get_media_format().segmentable:
+                    single_pass.append((args, output_file))
+                else:
+                    encodes.append((args, output_file))
+            segmented = bool(encodes) and segments.should_segment(video.duration)
+            two_pass = bool(encodes) and profile.two_pass and not segmented
+            tracker = progress.ProgressTracker([output[0] for output in outputs], video.duration)
+            try:
+                with open_source(video.file, seekable=segmented or two_pass) as input_file:
+                    if segmented:
+                        if single_pass:
+                            cls.run_ffmpeg(input_file, single_pass)
+                        segment_dir = os.path.join(output_dir, 'segments')
+                        os.mkdir(segment_dir)
+                        result = cache.probe(input_file, key=cache.get_video_key(video))
+                        segments.transcode(
+                            input_file, encodes, segment_dir,
+                            has_audio=result is None or result.audio_codec is not None,
+                            callback=tracker.report)
+                    elif two_pass:
+                        first_passes, second_passes = cls.get_passes(encodes)
+                        cls.run_ffmpeg(input_file, first_passes, callback=tracker.stage(0, 0.5))
+                        cls.run_ffmpeg(input_file, single_pass + second_passes, callback=tracker.stage(0.5, 0.5))
+                    else:
+                        cls.run_ffmpeg(input_file, single_pass + encodes, callback=tracker.stage())
+            except subprocess.SubprocessError as e:
+                error = e
+                error_type = failures.classify(e)
+                log.warning("transcoding %s failed: %s", video, error_type)
+
+            if error is not None and len(outputs) > 1 and failures.is_retryable(error_type):
+                for transcode, args, output_file in outputs:
+                    cls.run_transcodings([transcode], stage=stage)
+                return
 
+            for transcode, args, output_file in outputs:
+                owner = transcode.lease_owner
+                old_name = transcode.file.name
+                try:
+                    if error is None:
+                        transcode.get_media_format().save_output(transcode, output_file)
+                        transcode.error_message = ''
+                        transcode.error_type = None
+                        transcode.progress = 100
+                    else:
+                        transcode.error_message = failures.get_message(error)
+                        transcode.error_type = TranscodeErrorType[error_type]
+                        transcode.progress = None
+                finally:
+                    leases.release(transcode)
+                    transcode.speed = tracker.speed
+                    transcode.eta = None
+                    held = leases.save_if_held(transcode, owner)
+                if not held:
+                    # The lease ran out and the transcode was handed on
+                    log.warning("lost the lease on %s, discarding the output", transcode.pk)
+                    if transcode.file.name != old_name:
+                        transcode.delete_output(transcode.file.name)
+                elif old_name and old_name != transcode.file.name:
+                    transcode.delete_output(old_name)
         finally:
-            transcode.processing = False
-            transcode.save()
             shutil.rmtree(output_dir, ignore_errors=True)
 
+    @classmethod
+    def reap_expired_leases(cls):
+        """
+        Hand transcodes whose worker has stopped renewing its lease to a new
+        job, or give up on them after too many attempts.
+        """
+        by_video = {}
+        for transcode in cls.objects.filter(leases.expired()).select_related('video'):
+            if transcode.attempts >= leases.get_max_attempts():
+                transcode.fail(_("Gave up after %d attempts.") % transcode.attempts, TranscodeErrorType.abandoned)
+                continue
+            by_video.setdefault(transcode.video_id, []).append(transcode)
+
+        for transcodes in by_video.values():
+            owner = leases.new_owner()
+            claimed = [
+                transcode for transcode in transcodes
+                if leases.claim(transcode, owner, attempts=transcode.attempts + 1)]
+            if claimed:
+                log.warning("requeueing %d transcodes of %s", len(claimed), claimed[0].video)
+                TranscodingTask(*claimed).start()
+
+    @classmethod
+    def get_passes(cls, outputs):
+        """
+        Split ``(args, output_file)`` outputs in to the analysis pass, which
+        writes nothing but a log, and the encoding pass that reads it.
+        """
+        first_passes = []
+        second_passes = []
+        for args, output_file in outputs:
+            log_file = os.path.join(os.path.dirname(output_file), 'passlog')
+            first_passes.append((
+                args + ['-pass', '1', '-passlogfile', log_file, '-an', '-f', 'null'], '-'))
+            second_passes.append((
+                args + ['-pass', '2', '-passlogfile', log_file], output_file))
+        return first_passes, second_passes
+
+    @classmethod
+    def run_ffmpeg(cls, input_file, outputs, callback=None):
+        """
+        Run a single ffmpeg process with an output for each ``(args,
+        output_file)`` in ``outputs``. ``callback`` is given its progress,
+        see ``wagtailvideos.progress.run``.
+        """
+        command = ['ffmpeg', '-hide_banner', '-i', input_file]
+        for args, output_file in outputs:
+            command += args + [output_file]
+        progress.run(command, callback=callback, timeout=progress.get_timeout())
+
+    def can_remux(self):
+        """
+        Whether the streams of the video can be copied in to this format
+        without re-encoding them. Only known once the video has been probed.
+        """
+        video = self.video
+        media_format = self.get_media_format()
+        if not getattr(settings, 'WAGTAILVIDEOS_REMUX_COMPATIBLE_SOURCES', True):
+            return False
+        # A smaller file than the original was asked for
+        if self.quality is VideoQuality.lowest or not video.container or media_format is None:
+            return False
+        video_codecs, audio_codecs = media_format.get_remux_codecs()
+        if video.video_codec not in video_codecs:
+            return False
+        return not video.audio_codec or video.audio_codec in audio_codecs
+
+    def get_missing_encoders(self):
+        """
+        The encoders this transcode needs that the local ffmpeg does not
+        have. Remuxing needs none.
+        """
+        media_format = self.get_media_format()
+        if media_format is None or self.can_remux():
+            return set()
+        return media_format.get_missing_encoders()
+
+    def reject_unsupported(self):
+        """
+        Fail this transcode if the local ffmpeg can not produce it. Returns
+        whether it was failed.
+        """
+        missing_encoders = self.get_missing_encoders()
+        if not missing_encoders:
+            return False
+        self.fail(_("ffmpeg has no %s encoder.") % ', '.join(sorted(missing_encoders)),
+                  TranscodeErrorType.missing_encoder)
+        return True
+
+    def fail(self, message, error_type):
+        """
+        Record that this transcode could not be made, and release it.
+        """
+        leases.release(self)
+        self.error_message = message
+        self.error_type = error_type
+        self.save(update_fields=['processing', 'lease_owner', 'lease_expires_at',
+                                 'error_message', 'error_type'])
+
+    def get_output(self, directory, profile=None):
+        """
+        The ffmpeg options and output path to write this transcode in to
+        ``directory`` with the encoder ``profile`` (``final`` by default),
+        or ``None`` if it can not be produced.
+        """
+        media_format = self.get_media_format()
+        if media_format is None:
+            return None
+        if profile is None:
+            profile = formats.get_encoder_profile(TranscodeStage.final.name)
+        return media_format.get_output(self, directory, profile)
+
+    def save_output(self, output_file):
+        """
+        Save a finished ffmpeg output as the file of this transcode,
+        replacing any earlier one.
+        """
+        old_name = self.file.name
+        self.get_media_format().save_output(self, output_file)
+        if old_name and old_name != self.file.name:
+            self.delete_output(old_name)
+
+    def delete_output(self, name):
+        """
+        Delete a stored output, unless another transcode still uses it.
+        """
+        if type(self).objects.filter(file=name).exclude(pk=self.pk).exists():
+            return
+        media_format = self.get_media_format()
+        if media_format is None:
+            self.file.storage.delete(name)
+        else:
+            media_format.delete_output(self.file.storage, name)
+
     class Meta:
         abstract = True
 
@@ -383,4 +973,5 @@ class VideoTranscode(AbstractVideoTranscode):
 # Delete files when model is deleted
 @receiver(pre_delete, sender=VideoTranscode)
 def transcode_delete(sender, instance, **kwargs):
-    instance.file.delete(False)
+    if instance.file:
+        instance.delete_output(instance.file.name)
@@ -0,0 +1,138 @@
+"""
+Progress of running transcodes.
+
+ffmpeg is run with ``-progress pipe:1``, which makes it write blocks of
+``key=value`` lines to stdout as it goes; ``run`` reads them as they come and
+passes each block to a callback. ``ProgressTracker`` turns the position in
+the video in to the percentage done, the speed (as a multiple of real
+time) and the time left, and stores them on the transcodes. The database is
+written at most every ``WAGTAILVIDEOS_PROGRESS_INTERVAL`` seconds.
+
+Everything else ffmpeg writes is its log. Only the last
+``WAGTAILVIDEOS_FFMPEG_LOG_LINES`` lines are kept, which is where the
+reason for a failure is, so a long encode does not fill memory.
+"""
+import datetime
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from wagtailvideos import runner
+
+PROGRESS_KEYS = {
+    'frame', 'fps', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms',
+    'out_time', 'dup_frames', 'drop_frames', 'speed', 'progress',
+}
+PROGRESS_LINE = re.compile(br'^(\w+)=(.*)$')
+MAX_LINE_LENGTH = 1000
+
+
+def get_interval():
+    return getattr(settings, 'WAGTAILVIDEOS_PROGRESS_INTERVAL', 2)
+
+
+def get_log_lines():
+    return getattr(settings, 'WAGTAILVIDEOS_FFMPEG_LOG_LINES', 50)
+
+
+def get_timeout():
+    return getattr(settings, 'WAGTAILVIDEOS_TRANSCODE_TIMEOUT', None)
+
+
+def run(command, callback=None, timeout=None):
+    """
+    Run an ffmpeg ``command`` with ``wagtailvideos.runner``, calling
+    ``callback`` with a dict of each block of progress values. Like
+    ``subprocess.check_output``, raises ``subprocess.CalledProcessError``
+    with the end of the log of ffmpeg if it fails, and
+    ``subprocess.TimeoutExpired`` if it is killed after ``timeout``
+    seconds.
+    """
+    command = command[:1] + ['-nostats', '-progress', 'pipe:1'] + command[1:]
+    output = deque(maxlen=get_log_lines())
+    values = {}
+    timed_out = []
+    with runner.popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                      stderr=subprocess.STDOUT) as process:
+
+        def kill():
+            timed_out.append(True)
+            runner.kill(process)
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer is not None:
+            timer.start()
+        try:
+            with process.stdout:
+                for line in process.stdout:
+                    match = PROGRESS_LINE.match(line.strip())
+                    if match is None or match.group(1).decode() not in PROGRESS_KEYS:
+                        output.append(line[:MAX_LINE_LENGTH])
+                        continue
+                    key, value = match.group(1).decode(), match.group(2).decode()
+                    values[key] = value
+                    if key == 'progress':
+                        if callback is not None:
+                            callback(values)
+                        values = {}
+            returncode = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+    output = b''.join(output)
+    if timed_out:
+        raise subprocess.TimeoutExpired(command, timeout, output=output)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command, output=output)
+    return output
+
+
+class ProgressTracker(object):
+    """
+    Store the progress of ``transcodes`` of a video ``duration`` long.
+    ``stage`` gives callbacks for the ffmpeg runs that make up the work.
+    """
+    def __init__(self, transcodes, duration):
+        self.transcodes = list(transcodes)
+        self.duration = duration.total_seconds() if duration else None
+        self.start_time = time.monotonic()
+        self.last_write = None
+        self.speed = None
+
+    def stage(self, start=0, share=1):
+        """
+        A ``run`` callback for an ffmpeg run that makes up ``share`` of the
+        work, after ``start`` of it has been done.
+        """
+        def callback(values):
+            out_time = values.get('out_time_us') or values.get('out_time_ms')
+            if not self.duration or not out_time or not out_time.isdigit():
+                return
+            fraction = min(1, int(out_time) / 1000000 / self.duration)
+            self.report(start + share * fraction)
+        return callback
+
+    def report(self, fraction, force=False):
+        """
+        Record that ``fraction`` of the work is done.
+        """
+        if not self.duration or not self.transcodes:
+            return
+        now = time.monotonic()
+        if not force and self.last_write is not None and now - self.last_write < get_interval():
+            return
+        self.last_write = now
+        elapsed = now - self.start_time
+        eta = None
+        if elapsed > 0:
+            self.speed = round(fraction * self.duration / elapsed, 2)
+        if fraction > 0:
+            eta = datetime.timedelta(seconds=int(elapsed * (1 - fraction) / fraction))
+        model = type(self.transcodes[0])
+        # Only touch the progress, the transcodes are saved when they finish
+        model.objects.filter(pk__in=[transcode.pk for transcode in self.transcodes]).update(
+            progress=round(fraction * 100, 1), speed=self.speed, eta=eta)
@@ -0,0 +1,115 @@
+"""
+Running ffmpeg and ffprobe.
+
+Every ffmpeg and ffprobe process is started through here, so that:
+
+* No more than ``WAGTAILVIDEOS_MAX_FFMPEG_PROCESSES`` (by default the
+  number of CPUs) run at once in a process; further calls wait for a slot.
+* Nothing runs forever. Probes, thumbnails and other short jobs are killed
+  after ``WAGTAILVIDEOS_PROBE_TIMEOUT`` seconds, transcodes after
+  ``WAGTAILVIDEOS_TRANSCODE_TIMEOUT``, raising
+  ``subprocess.TimeoutExpired``.
+* Each child gets a process group of its own, and the whole group is killed
+  on a timeout or when the caller gives up, so nothing is left behind.
+
+Processes are waited on by threads rather than an event loop, as ffmpeg is
+run from worker threads (see ``wagtailvideos.segments``) and asyncio can
+only wait on child processes from the main thread before Python 3.8.
+``check_output_async`` is a facade for callers that are coroutines, and
+``run_concurrently`` runs independent jobs, such as a probe and a
+thumbnail, side by side.
+"""
+import asyncio
+import functools
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_semaphore = None
+_semaphore_lock = threading.Lock()
+
+
+def get_max_processes():
+    return getattr(settings, 'WAGTAILVIDEOS_MAX_FFMPEG_PROCESSES', None) or os.cpu_count() or 1
+
+
+def get_probe_timeout():
+    return getattr(settings, 'WAGTAILVIDEOS_PROBE_TIMEOUT', 60)
+
+
+def get_semaphore():
+    global _semaphore
+    with _semaphore_lock:
+        if _semaphore is None:
+            _semaphore = threading.BoundedSemaphore(get_max_processes())
+        return _semaphore
+
+
+def kill(process):
+    """
+    Kill ``process`` and everything it started.
+    """
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        # Already gone
+        pass
+
+
+@contextmanager
+def popen(command, **kwargs):
+    """
+    Start ``command`` once there is a free slot, in a process group of its
+    own. The process is killed if it is still running when the block ends.
+    """
+    with get_semaphore():
+        process = subprocess.Popen(command, start_new_session=True, **kwargs)
+        try:
+            yield process
+        finally:
+            if process.poll() is None:
+                kill(process)
+                process.wait()
+
+
+def check_output(command, input=None, stderr=subprocess.DEVNULL, timeout=None):
+    """
+    Like ``subprocess.check_output``, under the limits above. stdin is
+    ``input`` if given, and empty otherwise.
+    """
+    stdin = subprocess.PIPE if input is not None else subprocess.DEVNULL
+    with popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr) as process:
+        try:
+            output, unused_err = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill(process)
+            output, unused_err = process.communicate()
+            raise subprocess.TimeoutExpired(command, timeout, output=output)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output=output)
+    return output
+
+
+async def check_output_async(command, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(check_output, command, **kwargs))
+
+
+def run_concurrently(*functions):
+    """
+    Call each of ``functions`` at the same time and return their results in
+    order. The first exception raised is raised again.
+    """
+    if len(functions) < 2:
+        return [function() for function in functions]
+    with ThreadPoolExecutor(max_workers=len(functions)) as executor:
+        futures = [executor.submit(function) for function in functions]
+        return [future.result() for future in futures]
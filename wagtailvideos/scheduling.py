@@ -0,0 +1,113 @@
+"""
+Where and how urgently background jobs run.
+
+Jobs are of three kinds: ``metadata`` (validation, probing and thumbnails),
+``preview`` (the quick first stage of two stage transcoding) and ``encode``
+(all other transcoding). ``WAGTAILVIDEOS_TASK_QUEUES`` sends each kind to a
+Celery queue of its own, so that workers can be set aside for each and a
+backlog of long encodes does not hold up the metadata of new uploads::
+
+    WAGTAILVIDEOS_TASK_QUEUES = {
+        'metadata': 'videos-fast',
+        'preview': 'videos-fast',
+        'encode': 'videos-slow',
+    }
+
+Within a queue, jobs get a priority from 0 to 9, highest first. Metadata
+comes before previews, and previews before encodes. Transcodes an editor
+asked for, and videos no longer than ``WAGTAILVIDEOS_SHORT_VIDEO_DURATION``
+seconds, move up. To share workers fairly, jobs move down one step for
+every ``WAGTAILVIDEOS_FAIR_SHARE_STEP`` transcodes already in progress for
+the same uploader (or collection, for videos without one), so one bulk
+upload does not starve everyone else. The transcodes of an upload are
+created when its jobs are queued, so they count before a worker gets to
+them.
+
+Priorities need a broker that supports them. For brokers such as Redis,
+where lower numbers go first, set ``WAGTAILVIDEOS_TASK_PRIORITY_LOW_FIRST``.
+
+The default transcodes of an upload are one job per format, so they are
+spread over the available workers. Set ``WAGTAILVIDEOS_FAN_OUT_TRANSCODES``
+to ``False`` for a single job that decodes the source once for all of them.
+"""
+from celery import current_app
+from celery.backends.base import DisabledBackend
+from django.conf import settings
+from django.db.models import Q
+
+BASE_PRIORITIES = {
+    'metadata': 7,
+    'preview': 5,
+    'encode': 3,
+}
+INTERACTIVE_BOOST = 2
+SHORT_VIDEO_BOOST = 1
+
+
+def get_queue(kind):
+    queues = getattr(settings, 'WAGTAILVIDEOS_TASK_QUEUES', {})
+    if kind in queues:
+        return queues[kind]
+    if kind == 'encode':
+        return getattr(settings, 'WAGTAILVIDEOS_FINAL_TRANSCODE_QUEUE', None)
+    return None
+
+
+def is_short(video):
+    limit = getattr(settings, 'WAGTAILVIDEOS_SHORT_VIDEO_DURATION', 300)
+    return video.duration is not None and video.duration.total_seconds() <= limit
+
+
+def get_backlog(video):
+    """
+    How many transcodes are queued or in progress for the uploader of
+    ``video``, or for its collection if nobody is recorded as uploading it.
+    Queued transcodes have neither a file nor an error yet.
+    """
+    if video.uploaded_by_user_id is not None:
+        same_owner = {'video__uploaded_by_user': video.uploaded_by_user_id}
+    else:
+        same_owner = {'video__uploaded_by_user__isnull': True, 'video__collection': video.collection_id}
+    queued = Q(processing=False, error_message='') & (Q(file='') | Q(file__isnull=True))
+    return video.get_transcode_model().objects.filter(Q(processing=True) | queued, **same_owner).count()
+
+
+def get_priority(video, kind, interactive=False):
+    priority = BASE_PRIORITIES[kind]
+    if interactive:
+        priority += INTERACTIVE_BOOST
+    if is_short(video):
+        priority += SHORT_VIDEO_BOOST
+    priority -= get_backlog(video) // getattr(settings, 'WAGTAILVIDEOS_FAIR_SHARE_STEP', 10)
+    priority = max(0, min(9, priority))
+    if getattr(settings, 'WAGTAILVIDEOS_TASK_PRIORITY_LOW_FIRST', False):
+        priority = 9 - priority
+    return priority
+
+
+def get_options(video, kind, interactive=False):
+    """
+    The Celery options for a job of ``kind`` for ``video``.
+    """
+    options = {'priority': get_priority(video, kind, interactive)}
+    queue = get_queue(kind)
+    if queue is not None:
+        options['queue'] = queue
+    return options
+
+
+def get_transcode_groups(media_formats):
+    """
+    Split ``media_formats`` in to the formats of each transcoding job.
+    """
+    if getattr(settings, 'WAGTAILVIDEOS_FAN_OUT_TRANSCODES', True):
+        return [[media_format] for media_format in media_formats]
+    return [list(media_formats)]
+
+
+def can_join():
+    """
+    Whether a job can wait for a group of other jobs, as a Celery chord.
+    Chords need a result backend.
+    """
+    return not isinstance(current_app.backend, DisabledBackend)
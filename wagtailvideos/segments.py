@@ -0,0 +1,121 @@
+"""
+Parallel transcoding of long videos.
+
+The video stream of the source is cut, without re-encoding, in to segments
+of about ``WAGTAILVIDEOS_SEGMENT_DURATION`` seconds, which always start on a
+keyframe. Segments are encoded by a pool of ``WAGTAILVIDEOS_SEGMENT_WORKERS``
+ffmpeg processes, and a segment that fails is retried up to
+``WAGTAILVIDEOS_SEGMENT_RETRIES`` times. The audio is encoded in one pass,
+as encoders pad each piece of audio they are given, which would be audible
+at every join. Finally the encoded segments and the audio are joined
+without re-encoding.
+"""
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from wagtailvideos import progress
+
+log = logging.getLogger(__name__)
+
+
+def get_segment_duration():
+    return getattr(settings, 'WAGTAILVIDEOS_SEGMENT_DURATION', None)
+
+
+def should_segment(duration):
+    """
+    Only videos of at least two segments are worth splitting up.
+    """
+    segment_duration = get_segment_duration()
+    if not segment_duration or not duration:
+        return False
+    return duration.total_seconds() >= 2 * segment_duration
+
+
+def run(command):
+    return progress.run(command, timeout=progress.get_timeout())
+
+
+def split(input_file, directory):
+    """
+    Cut the video stream of ``input_file`` in to segments at keyframes.
+    Returns the paths of the segments, in order.
+    """
+    run([
+        'ffmpeg', '-hide_banner', '-i', input_file,
+        '-map', '0:v:0', '-codec', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(get_segment_duration()),
+        '-reset_timestamps', '1',
+        os.path.join(directory, 'source_%05d.mkv'),
+    ])
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith('source_'))
+
+
+def encode_segment(segment, args, output_file):
+    retries = getattr(settings, 'WAGTAILVIDEOS_SEGMENT_RETRIES', 2)
+    for attempt in range(retries + 1):
+        try:
+            return run(['ffmpeg', '-hide_banner', '-y', '-i', segment, '-an'] + args + [output_file])
+        except subprocess.CalledProcessError:
+            if attempt == retries:
+                raise
+            log.warning("encoding %s failed, retrying", segment)
+
+
+def concat(segments, audio_file, output_file, directory):
+    list_file = os.path.join(directory, os.path.basename(output_file) + '.txt')
+    with open(list_file, 'w') as f:
+        for segment in segments:
+            f.write("file '{}'\n".format(segment.replace("'", "'\\''")))
+
+    command = ['ffmpeg', '-hide_banner', '-f', 'concat', '-safe', '0', '-i', list_file]
+    if audio_file is not None:
+        command += ['-i', audio_file, '-map', '0:v', '-map', '1:a']
+    run(command + ['-codec', 'copy', output_file])
+
+
+def transcode(input_file, outputs, directory, has_audio=True, callback=None):
+    """
+    Transcode ``input_file`` to each ``(args, output_file)`` in ``outputs``,
+    encoding segments in parallel. ``directory`` is used for intermediate
+    files. ``callback`` is called with the fraction of segments encoded as
+    they finish. Raises ``subprocess.CalledProcessError`` if any step fails.
+    """
+    segments = split(input_file, directory)
+
+    audio_files = [None] * len(outputs)
+    if has_audio:
+        command = ['ffmpeg', '-hide_banner', '-i', input_file]
+        for i, (args, output_file) in enumerate(outputs):
+            audio_files[i] = os.path.join(directory, 'audio_{}{}'.format(
+                i, os.path.splitext(output_file)[1]))
+            command += ['-vn'] + args + [audio_files[i]]
+        run(command)
+
+    workers = getattr(settings, 'WAGTAILVIDEOS_SEGMENT_WORKERS', None) or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = []
+        for i, (args, output_file) in enumerate(outputs):
+            ext = os.path.splitext(output_file)[1]
+            encoded = [
+                os.path.join(directory, 'encoded_{}_{:05d}{}'.format(i, n, ext))
+                for n in range(len(segments))]
+            futures = [
+                executor.submit(encode_segment, segment, args, encoded_segment)
+                for segment, encoded_segment in zip(segments, encoded)]
+            jobs.append((futures, encoded, audio_files[i], output_file))
+
+        all_futures = [future for futures, encoded, audio_file, output_file in jobs for future in futures]
+        for done, future in enumerate(as_completed(all_futures), 1):
+            future.result()
+            if callback is not None:
+                callback(done / len(all_futures))
+        for futures, encoded, audio_file, output_file in jobs:
+            concat(encoded, audio_file, output_file, directory)
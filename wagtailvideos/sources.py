@@ -0,0 +1,318 @@
+"""
+Give ffmpeg access to video files, wherever they are stored.
+
+Files on local storages are read in place. Files on other storages are
+downloaded in to a source cache shared by all workers on a node when ffmpeg
+needs to seek in them or read them more than once, and the copy is used by
+every later task, so the metadata and transcoding tasks for an upload fetch
+the file once between them. See ``SourceCache``.
+
+Files without a copy that are read front to back are read by ffmpeg
+directly from their URL, for storages that serve files over HTTP, or
+streamed from ``storage.open()`` through a named pipe.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.temp import NamedTemporaryFile
+
+from wagtailvideos import cache, ffmpeg
+
+log = logging.getLogger(__name__)
+
+
+def get_local_path(file):
+    try:
+        return file.path
+    except NotImplementedError:
+        return None
+
+
+def get_source_url(file):
+    if not getattr(settings, 'WAGTAILVIDEOS_STREAM_FROM_URL', True):
+        return None
+    try:
+        url = file.url
+    except NotImplementedError:
+        return None
+    if urlparse(url).scheme in ('http', 'https'):
+        return url
+    return None
+
+
+def is_streamable(file):
+    """
+    Check whether ffmpeg can read a file without seeking, by looking at the
+    layout of its container.
+    """
+    window = getattr(settings, 'WAGTAILVIDEOS_CODEC_PROBE_WINDOW', 4 * 1024 * 1024)
+    try:
+        file.open('rb')
+        header = file.read(window)
+    finally:
+        file.close()
+    return not ffmpeg.needs_tail(header)
+
+
+@contextmanager
+def open_source(file, seekable=False):
+    """
+    Get something ffmpeg can use as an input for a stored file: a path, a
+    URL or a named pipe. Use ``seekable=True`` when ffmpeg has to seek within
+    the file or read it more than once, which pipes can not do.
+    """
+    path = get_local_path(file)
+    if path:
+        yield path
+        return
+
+    source_cache = get_source_cache()
+    if source_cache is not None:
+        # Files that are read more than once are worth keeping a copy of
+        with source_cache.get_file(file, download=seekable) as cached_path:
+            if cached_path is not None:
+                yield cached_path
+                return
+
+    url = get_source_url(file)
+    if url:
+        yield url
+        return
+
+    if not seekable and hasattr(os, 'mkfifo') and is_streamable(file):
+        with stream_file(file) as pipe_path:
+            yield pipe_path
+    else:
+        with get_local_file(file) as local_path:
+            yield local_path
+
+
+@contextmanager
+def stream_file(file):
+    """
+    Stream a stored file through a named pipe, so ffmpeg can start working
+    on it before, or without, all of it being on local disk. The pipe can be
+    read once.
+    """
+    directory = tempfile.mkdtemp(prefix='wagtailvideo-')
+    _, ext = os.path.splitext(file.name)
+    pipe_path = os.path.join(directory, 'source' + ext)
+    os.mkfifo(pipe_path)
+
+    def feed():
+        try:
+            # Blocks until ffmpeg opens the pipe
+            with open(pipe_path, 'wb') as pipe:
+                file.open('rb')
+                for chunk in file.chunks():
+                    pipe.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg stopped reading, which is fine if it had all it needed
+            pass
+        except Exception:
+            log.exception("streaming %s failed", file.name)
+        finally:
+            file.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        yield pipe_path
+    finally:
+        while feeder.is_alive():
+            # Nobody read (all of) the pipe. Opening and closing the read end
+            # unblocks the feeder, which then gets a broken pipe.
+            os.close(os.open(pipe_path, os.O_RDONLY | os.O_NONBLOCK))
+            feeder.join(0.1)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def download(file, fileobj):
+    try:
+        file.open('rb')
+        for chunk in file.chunks():
+            fileobj.write(chunk)
+    finally:
+        file.close()
+    fileobj.flush()
+
+
+class SourceCache(object):
+    """
+    Local copies of stored files, kept in ``directory`` and shared between
+    processes. Once the copies take up more than ``max_size`` bytes the
+    least recently used ones are removed.
+
+    Each copy has a lock file next to it. Users of a copy hold a shared lock
+    on it, so copies are never removed while ffmpeg is reading them. The
+    exclusive lock taken to download a copy makes concurrent workers wait
+    for that download instead of starting their own.
+    Lock files are removed along with their copy, or when there turned out
+    to be no copy to share.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_path(self, file):
+        _, ext = os.path.splitext(file.name)
+        digest = cache.get_file_key(file)[len(cache.KEY_PREFIX):]
+        return os.path.join(self.directory, digest + ext)
+
+    @contextmanager
+    def lock(self, path):
+        """
+        Hold a shared lock on the lock file of the copy at ``path``.
+        """
+        lock_path = path + '.lock'
+        while True:
+            with open(lock_path, 'ab') as lock_file:
+                locks.lock(lock_file, locks.LOCK_SH)
+                try:
+                    # Unused lock files are removed, so the one locked may
+                    # no longer be the one in the directory
+                    if is_current(lock_file, lock_path):
+                        yield lock_file
+                        return
+                finally:
+                    locks.unlock(lock_file)
+
+    def discard_lock(self, path, lock_file):
+        """
+        Remove the lock file of the copy at ``path`` if there is no copy
+        and nobody else holds the lock.
+        """
+        try:
+            locks.lock(lock_file, locks.LOCK_EX | locks.LOCK_NB)
+        except OSError:
+            return
+        if not os.path.exists(path):
+            try:
+                os.remove(path + '.lock')
+            except OSError:
+                pass
+
+    @contextmanager
+    def get_file(self, file, download=True):
+        """
+        Get the path to a local copy of ``file``, downloading it first if
+        needed. With ``download=False``, ``None`` is used if there is no
+        copy yet.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.get_path(file)
+        with self.lock(path) as lock_file:
+            if not os.path.exists(path):
+                if not download:
+                    self.discard_lock(path, lock_file)
+                    yield None
+                    return
+                locks.unlock(lock_file)
+                locks.lock(lock_file, locks.LOCK_EX)
+                if not os.path.exists(path):
+                    self.download(file, path)
+                locks.lock(lock_file, locks.LOCK_SH)
+                self.evict()
+            # The modification time orders copies for eviction
+            os.utime(path, None)
+            yield path
+
+    def download(self, file, path):
+        log.debug("caching a local copy of %s", file.name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                download(file, tmp)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        entries = []
+        unused_locks = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.lock'):
+                if not os.path.exists(path[:-len('.lock')]):
+                    unused_locks.append(path[:-len('.lock')])
+                continue
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        for path in unused_locks:
+            with open(path + '.lock', 'ab') as lock_file:
+                self.discard_lock(path, lock_file)
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            with open(path + '.lock', 'ab') as lock_file:
+                try:
+                    locks.lock(lock_file, locks.LOCK_EX | locks.LOCK_NB)
+                except OSError:
+                    # In use
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    os.remove(path + '.lock')
+                except OSError:
+                    pass
+                finally:
+                    locks.unlock(lock_file)
+
+
+def is_current(lock_file, lock_path):
+    try:
+        return os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def get_source_cache():
+    """
+    The source cache, configured with ``WAGTAILVIDEOS_SOURCE_CACHE_DIR`` and
+    ``WAGTAILVIDEOS_SOURCE_CACHE_SIZE`` (in bytes, 0 to disable).
+    """
+    max_size = getattr(settings, 'WAGTAILVIDEOS_SOURCE_CACHE_SIZE', 10 * 1024 ** 3)
+    if not max_size:
+        return None
+    directory = getattr(settings, 'WAGTAILVIDEOS_SOURCE_CACHE_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'wagtailvideos-sources')
+    return SourceCache(directory, max_size)
+
+
+@contextmanager
+def get_local_file(file):
+    """
+    Get a local version of the file, downloading it from the remote storage if
+    required. The returned value should be used as a context manager to
+    ensure any temporary files are cleaned up afterwards.
+    """
+    path = get_local_path(file)
+    source_cache = get_source_cache()
+    if path:
+        with open(path):
+            yield path
+    elif source_cache is not None:
+        with source_cache.get_file(file) as cached_path:
+            yield cached_path
+    else:
+        _, ext = os.path.splitext(file.name)
+        with NamedTemporaryFile(prefix='wagtailvideo-', suffix=ext) as tmp:
+            download(file, tmp)
+            yield tmp.name
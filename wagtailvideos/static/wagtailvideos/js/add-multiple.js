@@ -10,9 +10,32 @@ $(function() {
         e.preventDefault();
     });
 
+    // Identifies a file across page loads, so an interrupted chunked upload
+    // can pick up from where the server says it got to
+    function uploadKey(file) {
+        return [file.name, file.size, file.lastModified].join('-');
+    }
+
+    // Ask the server how much of the file it has, then send the rest
+    function resumeUpload(data) {
+        data.context.data('retrying', false);
+        if (!window.fileupload_opts.chunk_size) {
+            return data.submit();
+        }
+        $.getJSON(window.fileupload_opts.upload_status_url, {
+            upload_key: uploadKey(data.files[0])
+        }).done(function(response) {
+            data.uploadedBytes = response.offset;
+        }).always(function() {
+            data.data = null;
+            data.submit();
+        });
+    }
+
     $('#fileupload').fileupload({
         dataType: 'html',
-        sequentialUploads: true,
+        limitConcurrentUploads: window.fileupload_opts.concurrent_uploads,
+        maxChunkSize: window.fileupload_opts.chunk_size,
         dropZone: $('.drop-zone'),
         acceptFileTypes: window.fileupload_opts.accepted_file_types,
         maxFileSize: window.fileupload_opts.max_file_size,
@@ -42,7 +65,7 @@ $(function() {
                 if ((that._trigger('added', e, data) !== false) &&
                         (options.autoUpload || data.autoUpload) &&
                         data.autoUpload !== false) {
-                    data.submit()
+                    resumeUpload(data);
                 }
             }).fail(function() {
                 if (data.files.error) {
@@ -56,6 +79,12 @@ $(function() {
             });
         },
 
+        submit: function(e, data) {
+            data.formData = $(this).closest('form').serializeArray().concat([
+                {name: 'upload_key', value: uploadKey(data.files[0])}
+            ]);
+        },
+
         processfail: function(e, data) {
             var itemElement = $(data.context);
             itemElement.removeClass('upload-uploading').addClass('upload-failure');
@@ -104,11 +133,26 @@ $(function() {
 
         fail: function(e, data) {
             var itemElement = $(data.context);
+            var retries = itemElement.data('retries') || 0;
+
+            // Retry dropped chunked uploads from the last received byte,
+            // backing off a little more each time
+            if (window.fileupload_opts.chunk_size && data.errorThrown !== 'abort' &&
+                    retries < window.fileupload_opts.max_retries) {
+                itemElement.data('retries', retries + 1).data('retrying', true);
+                setTimeout(function() {
+                    resumeUpload(data);
+                }, (retries + 1) * 1000);
+                return;
+            }
             itemElement.addClass('upload-failure');
         },
 
         always: function(e, data) {
             var itemElement = $(data.context);
+            if (itemElement.data('retrying')) {
+                return;
+            }
             itemElement.removeClass('upload-uploading').addClass('upload-complete');
         }
     });
@@ -1,81 +1,158 @@
-from contextlib import contextmanager
-import os
-from django.core.files.temp import NamedTemporaryFile
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.translation import ugettext as _
 
 from celery import shared_task
 from django.apps import apps
-from wagtailvideos import ffmpeg
+from wagtailvideos import cache, complexity, ffmpeg, fingerprint, leases, runner
+from wagtailvideos.sources import open_source
 import logging
 log = logging.getLogger(__name__)
 
 
+@shared_task
+def validate_video_codec(object_pk, *args):
+    Video = apps.get_model(app_label="wagtailvideos", model_name="Video")
+    instance = Video.objects.get(pk=object_pk)
+    log.debug('validating video codec for %s', instance)
+
+    if not ffmpeg.installed():
+        raise ImproperlyConfigured("ffmpeg could not be found on your system. Transcoding will be disabled")
+
+    # The probe result is cached, so get_video_metadata will not probe again
+    cache_key = cache.get_video_key(instance)
+    with open_source(instance.file) as file_path:
+        result = cache.probe(file_path, key=cache_key)
+
+    codec = result.video_codec if result is not None else None
+    allowed_codecs = getattr(settings, "WAGTAILVIDEOS_ALLOWED_CODECS", ())
+    if allowed_codecs and codec not in allowed_codecs:
+        instance.reject(_("Video codec %s is not allowed.") % codec)
+        return
+
+    instance.accept()
+
+
 @shared_task
 def get_video_metadata(object_pk, *args):
     Video = apps.get_model(app_label="wagtailvideos", model_name="Video")
     instance = Video.objects.get(pk=object_pk)
     log.debug('getting video metadata for %s', instance)
+    if instance.is_rejected:
+        return
 
     if not ffmpeg.installed():
         raise ImproperlyConfigured("ffmpeg could not be found on your system. Transcoding will be disabled")
 
-    with get_local_file(instance.file) as file_path:
-        instance.thumbnail = ffmpeg.get_thumbnail(file_path)
-        instance.duration = ffmpeg.get_duration(file_path)
+    cache_key = cache.get_video_key(instance)
+    # Fingerprinting seeks through the file
+    with open_source(instance.file, seekable=True) as file_path:
+        instance.thumbnail, result = runner.run_concurrently(
+            lambda: ffmpeg.get_thumbnail(file_path),
+            lambda: cache.probe(file_path, key=cache_key))
+        instance.set_probe_result(result)
+        instance.fingerprint = fingerprint.compute(file_path, instance.duration)
+        if complexity.enabled():
+            instance.complexity = complexity.measure(file_path, instance.duration)
 
     instance.file_size = instance.file.size
     instance.save()
+    instance.index_fingerprint()
 
 
 @shared_task
-def schedule_default_transcode(object_pk, *args):
+def schedule_default_transcode(object_pk, *media_formats, finalise=False):
+    """
+    Transcode a new video in ``media_formats``, or in all of
+    ``WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS`` if none are given. With
+    ``finalise``, mark the video as ready if this was the last of its jobs.
+    """
     Video = apps.get_model(app_label="wagtailvideos", model_name="Video")
     instance = Video.objects.get(pk=object_pk)
     log.debug('transcoding video for %s', instance)
+    if instance.is_rejected:
+        return
     if not ffmpeg.installed():
         raise ImproperlyConfigured("ffmpeg could not be found on your system. Transcoding will be disabled")
 
-    transcode, created = instance.transcodes.get_or_create()
-    if transcode.processing is False:
-        transcode.processing = True
-        transcode.error_message = ''
-        # Lock the transcode model
-        transcode.save(update_fields=['processing', 'error_message'])
-        transcode.run_transcoding()
+    if not media_formats:
+        media_formats = getattr(settings, 'WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS', ['default'])
+    transcodes = instance.lock_transcodes(media_formats)
+    Transcode = instance.get_transcode_model()
+    if not getattr(settings, 'WAGTAILVIDEOS_TWO_STAGE_TRANSCODING', False):
+        with leases.heartbeat(transcodes):
+            Transcode.run_transcodings(transcodes)
+    else:
+        # Publish a quick preview first, then replace it with the final
+        # encode in the background
+        with leases.heartbeat(transcodes):
+            Transcode.run_transcodings(transcodes, stage='preview')
+        instance.do_transcodes([
+            transcode.media_format for transcode in transcodes
+            if transcode.stage.name == 'preview'], stage='final')
+
+    if finalise:
+        finalise_video(object_pk, *getattr(settings, 'WAGTAILVIDEOS_DEFAULT_TRANSCODE_FORMATS', ['default']))
 
 
 @shared_task
-def transcoding_task(transcode_pk, *args):
+def finalise_video(object_pk, *media_formats):
+    """
+    Mark a video as ready once it has been processed. If ``media_formats``
+    are given, wait until each of them has a transcode to serve, or one
+    that failed.
+    """
+    Video = apps.get_model(app_label="wagtailvideos", model_name="Video")
+    instance = Video.objects.filter(pk=object_pk).first()
+    # Rejected videos may have been deleted
+    if instance is None:
+        return
+    # A job that failed earlier has the last word
+    if instance.processing_status.name == 'failed':
+        return
+    if media_formats and not instance.transcodes_settled(media_formats):
+        return
+    log.debug('%s is ready', instance)
+    instance.mark_ready()
+
+
+@shared_task
+def video_processing_failed(object_pk, *args):
+    """
+    Called when a processing job for a video raises, so the video does not
+    stay processing for good.
+    """
+    Video = apps.get_model(app_label="wagtailvideos", model_name="Video")
+    instance = Video.objects.filter(pk=object_pk).first()
+    if instance is None:
+        return
+    log.warning('processing %s failed', instance)
+    instance.mark_failed()
+
+
+@shared_task
+def transcoding_task(*transcode_pks, stage='final', lease_owner=None):
     Transcode = apps.get_model(app_label="wagtailvideos", model_name="VideoTranscode")
 
-    transcode = Transcode.objects.get(pk=transcode_pk)
-    transcode.run_transcoding()
+    transcodes = Transcode.objects.filter(pk__in=transcode_pks)
+    if lease_owner is not None:
+        # Transcodes that have been handed on since this job was queued
+        # belong to another job
+        transcodes = transcodes.filter(lease_owner=lease_owner, processing=True)
+    transcodes = list(transcodes)
+    if not transcodes:
+        return
+    with leases.heartbeat(transcodes):
+        Transcode.run_transcodings(transcodes, stage=stage)
 
 
 @shared_task
-def get_video_codec_task(file_path):
-    result = ffmpeg.get_video_codec(file_path)
-    return result
+def reap_expired_leases():
+    Transcode = apps.get_model(app_label="wagtailvideos", model_name="VideoTranscode")
+    Transcode.reap_expired_leases()
 
 
-@contextmanager
-def get_local_file(file):
-    """
-    Get a local version of the file, downloading it from the remote storage if
-    required. The returned value should be used as a context manager to
-    ensure any temporary files are cleaned up afterwards.
-    """
-    try:
-        with open(file.path):
-            yield file.path
-    except NotImplementedError:
-        _, ext = os.path.splitext(file.name)
-        with NamedTemporaryFile(prefix='wagtailvideo-', suffix=ext) as tmp:
-            try:
-                file.open('rb')
-                for chunk in file.chunks():
-                    tmp.write(chunk)
-            finally:
-                file.close()
-            tmp.flush()
-            yield tmp.name
+@shared_task
+def get_video_codec_task(file_path):
+    result = cache.probe(file_path)
+    return result.video_codec if result is not None else None
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+
+def get_hasher():
+    return hashlib.sha256()
+
+
+def hash_file(f):
+    """
+    Hash the contents of a file, reading it a chunk at a time.
+    """
+    hasher = get_hasher()
+    for chunk in f.chunks():
+        hasher.update(chunk)
+    f.seek(0)
+    return hasher.hexdigest()
+
+
+class VideoUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams uploaded files to a temporary file on disk, hashing them and
+    keeping the first few megabytes for codec sniffing as they arrive. The
+    resulting ``TemporaryUploadedFile`` gets two extra attributes:
+
+    ``content_hash``
+        The hex digest of the file contents
+
+    ``content_header``
+        The first ``WAGTAILVIDEOS_CODEC_PROBE_WINDOW`` bytes of the file
+    """
+    def new_file(self, *args, **kwargs):
+        super(VideoUploadHandler, self).new_file(*args, **kwargs)
+        self.hasher = get_hasher()
+        self.header = bytearray()
+        self.header_size = getattr(settings, 'WAGTAILVIDEOS_CODEC_PROBE_WINDOW', 4 * 1024 * 1024)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        missing = self.header_size - len(self.header)
+        if missing > 0:
+            self.header.extend(raw_data[:missing])
+        return super(VideoUploadHandler, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        f = super(VideoUploadHandler, self).file_complete(file_size)
+        f.content_hash = self.hasher.hexdigest()
+        f.content_header = bytes(self.header)
+        return f
+
+
+def use_video_upload_handler(view_func):
+    """
+    Make a view handle uploads with ``VideoUploadHandler``.
+
+    Upload handlers can not be changed once the request body has been read,
+    which the CSRF middleware does for POST requests. The view is exempted
+    from the middleware and protected by ``csrf_protect`` after the handler
+    is installed instead.
+    """
+    protected_view = csrf_protect(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [VideoUploadHandler(request)]
+        return protected_view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def parse_content_range(header):
+    """
+    Parse a ``Content-Range: bytes start-end/total`` header, as sent by the
+    multiple uploader for each chunk of a file. Returns ``None`` for
+    requests that are not chunked.
+    """
+    match = CONTENT_RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    return tuple(int(group) for group in match.groups())
+
+
+def get_chunked_upload_dir():
+    return getattr(settings, 'WAGTAILVIDEOS_CHUNKED_UPLOAD_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'wagtailvideos-uploads')
+
+
+class ChunkOffsetError(Exception):
+    def __init__(self, offset):
+        super(ChunkOffsetError, self).__init__(
+            "Expected a chunk starting at byte {}".format(offset))
+        self.offset = offset
+
+
+class ChunkedUploadedFile(UploadedFile):
+    """
+    A completely assembled chunked upload. Like ``TemporaryUploadedFile``,
+    storage backends can move it in to place instead of copying it.
+    """
+    def __init__(self, path, name, content_type, size):
+        super(ChunkedUploadedFile, self).__init__(open(path, 'rb'), name, content_type, size)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class ChunkedUpload(object):
+    """
+    A partially received file, uploaded in chunks by the multiple uploader.
+    Chunks must arrive in order; the offset of the next expected byte is the
+    size of the partial file, so an interrupted upload can resume from
+    ``offset``.
+
+    Partial files are kept in ``WAGTAILVIDEOS_CHUNKED_UPLOAD_DIR`` and are
+    removed once they have not been written to for
+    ``WAGTAILVIDEOS_CHUNKED_UPLOAD_EXPIRY`` seconds.
+    """
+    def __init__(self, user, upload_key):
+        identity = '{}:{}'.format(user.pk, upload_key).encode('utf-8')
+        self.directory = get_chunked_upload_dir()
+        self.path = os.path.join(self.directory, hashlib.sha1(identity).hexdigest() + '.part')
+
+    @property
+    def offset(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def append(self, start, chunk):
+        """
+        Write ``chunk`` to the end of the partial file, returning the new
+        offset. Raises ``ChunkOffsetError`` if the chunk does not start
+        where the last one ended.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if start == 0:
+            self.remove_expired()
+        with open(self.path, 'ab') as f:
+            # Retried requests for the same chunk can race each other
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                if offset != start:
+                    raise ChunkOffsetError(offset)
+                for data in chunk.chunks():
+                    f.write(data)
+                return f.tell()
+            finally:
+                locks.unlock(f)
+
+    def get_file(self, name, content_type):
+        f = ChunkedUploadedFile(self.path, name, content_type, self.offset)
+        f.content_hash = hash_file(f)
+        window = getattr(settings, 'WAGTAILVIDEOS_CODEC_PROBE_WINDOW', 4 * 1024 * 1024)
+        f.content_header = f.read(window)
+        f.seek(0)
+        return f
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def remove_expired(self):
+        expiry = getattr(settings, 'WAGTAILVIDEOS_CHUNKED_UPLOAD_EXPIRY', 60 * 60 * 24)
+        now = time.time()
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            try:
+                if entry.endswith('.part') and now - os.path.getmtime(path) > expiry:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -13,8 +13,10 @@ urlpatterns = [
     url(r'^usage/(\d+)/$', videos.usage, name='video_usage'),
 
     url(r'^multiple/add/$', multiple.add, name='add_multiple'),
+    url(r'^multiple/upload_status/$', multiple.upload_status, name='upload_status'),
     url(r'^multiple/(\d+)/$', multiple.edit, name='edit_multiple'),
     url(r'^multiple/(\d+)/delete/$', multiple.delete, name='delete_multiple'),
+    url(r'^multiple/(\d+)/near_duplicates/$', multiple.near_duplicates, name='near_duplicates'),
 
     url(r'^chooser/$', chooser.chooser, name='chooser'),
     url(r'^chooser/(\d+)/$', chooser.video_chosen, name='video_chosen'),
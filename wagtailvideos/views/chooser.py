@@ -15,6 +15,7 @@ from wagtail.search import index as search_index
 from wagtailvideos.forms import get_video_form
 from wagtailvideos.models import Video
 from wagtailvideos.permissions import permission_policy
+from wagtailvideos.uploadhandler import use_video_upload_handler
 
 permission_checker = PermissionPolicyChecker(permission_policy)
 
@@ -48,7 +49,7 @@ def chooser(request):
     VideoForm = get_video_form(Video)
     uploadform = VideoForm()
 
-    videos = Video.objects.order_by('-created_at')
+    videos = Video.objects.valid().order_by('-created_at')
 
     q = None
     if (
@@ -113,6 +114,7 @@ def video_chosen(request, video_id):
     )
 
 
+@use_video_upload_handler
 @permission_checker.require('add')
 def chooser_upload(request):
     VideoForm = get_video_form(Video)
@@ -137,7 +139,7 @@ def chooser_upload(request):
     else:
         form = VideoForm()
 
-    videos = Video.objects.order_by('title')
+    videos = Video.objects.valid().order_by('title')
     paginator = Paginator(videos, per_page=12)
     videos = paginator.get_page(request.GET.get('p'))
 
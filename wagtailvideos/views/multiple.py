@@ -11,6 +11,9 @@ from wagtail.search.backends import get_search_backends
 from wagtailvideos.forms import get_video_form
 from wagtailvideos.models import Video
 from wagtailvideos.permissions import permission_policy
+from wagtailvideos.uploadhandler import (
+    ChunkedUpload, ChunkOffsetError, parse_content_range,
+    use_video_upload_handler)
 
 permission_checker = PermissionPolicyChecker(permission_policy)
 
@@ -29,6 +32,31 @@ def get_video_edit_form(VideoModel):
     return VideoEditForm
 
 
+def chunk_response(offset, status=200):
+    """
+    Tell the uploader how much of a chunked upload has been received. The
+    Range header is read by jQuery File Upload to pick the next chunk.
+    """
+    response = JsonResponse({'success': status == 200, 'offset': offset}, status=status)
+    if offset:
+        response['Range'] = '0-{}'.format(offset - 1)
+    return response
+
+
+@permission_checker.require('add')
+def upload_status(request):
+    """
+    Report how much of a chunked upload has been received, so an interrupted
+    upload can resume where it stopped.
+    """
+    upload_key = request.GET.get('upload_key')
+    if not upload_key:
+        return HttpResponseBadRequest("Must give an upload_key")
+    return JsonResponse({'offset': ChunkedUpload(request.user, upload_key).offset})
+
+
+@permission_checker.require('add')
+@use_video_upload_handler
 @vary_on_headers('X-Requested-With')
 def add(request):
     VideoForm = get_video_form(Video)
@@ -47,25 +75,56 @@ def add(request):
         if not request.FILES:
             return HttpResponseBadRequest("Must upload a file")
 
+        upload = request.FILES['files[]']
+        chunked_upload = None
+        content_range = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+        if content_range is not None:
+            start, end, total = content_range
+            max_upload_size = VideoForm.base_fields['file'].max_upload_size
+            if max_upload_size is not None and total > max_upload_size:
+                return JsonResponse({
+                    'success': False,
+                    'error_message': VideoForm.base_fields['file'].error_messages['file_too_large_unknown_size'],
+                })
+
+            chunked_upload = ChunkedUpload(request.user, request.POST.get('upload_key') or upload.name)
+            try:
+                offset = chunked_upload.append(start, upload)
+            except ChunkOffsetError as e:
+                return chunk_response(e.offset, status=409)
+            if offset < total:
+                return chunk_response(offset)
+
+            # The last chunk has arrived, validate the whole file
+            upload = chunked_upload.get_file(upload.name, upload.content_type)
+
         # Build a form for validation
         form = VideoForm({
-            'title': request.FILES['files[]'].name,
+            'title': upload.name,
             'collection': request.POST.get('collection'),
         }, {
-            'file': request.FILES['files[]'],
+            'file': upload,
         })
-        if form.is_valid():
-            # Save
-            video = form.save(commit=False)
-            video.uploaded_by_user = request.user
-            video.save()
-
+        try:
+            valid = form.is_valid()
+            if valid:
+                # Save
+                video = form.save(commit=False)
+                video.uploaded_by_user = request.user
+                video.save()
+        finally:
+            if chunked_upload is not None:
+                upload.close()
+                chunked_upload.discard()
+
+        if valid:
             # Success! Send back an edit form
             return JsonResponse({
                 'success': True,
                 'video_id': int(video.id),
                 'form': render_to_string('wagtailvideos/multiple/edit_form.html', {
                     'video': video,
+                    'near_duplicates': video.find_near_duplicates(),
                     'form': get_video_edit_form(Video)(
                         instance=video, prefix='video-%d' % video.id),
                 }, request=request),
@@ -83,6 +142,8 @@ def add(request):
 
     accepted_file_types = getattr(settings, "WAGTAILVIDEOS_ACCEPTED_FILETYPES", None)
     return render(request, 'wagtailvideos/multiple/add.html', {
+        'chunk_size': getattr(settings, 'WAGTAILVIDEOS_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+        'concurrent_uploads': getattr(settings, 'WAGTAILVIDEOS_CONCURRENT_UPLOADS', 1),
         'max_filesize': form.fields['file'].max_upload_size,
         'help_text': form.fields['file'].help_text,
         'error_max_file_size': form.fields['file'].error_messages['file_too_large_unknown_size'],
@@ -122,6 +183,7 @@ def edit(request, video_id, callback=None):
             'video_id': int(video_id),
             'form': render_to_string('wagtailvideos/multiple/edit_form.html', {
                 'video': video,
+                'near_duplicates': video.find_near_duplicates(),
                 'form': form,
             }, request=request),
         })
@@ -140,3 +202,18 @@ def delete(request, video_id):
         'success': True,
         'video_id': int(video_id),
     })
+
+
+@permission_checker.require('add')
+def near_duplicates(request, video_id):
+    """
+    The videos an upload looks like a copy of. Uploads are only fingerprinted
+    by their metadata task, so the upload page asks until ``done``.
+    """
+    video = get_object_or_404(Video, id=video_id)
+    return JsonResponse({
+        'done': video.is_fingerprinted,
+        'html': render_to_string('wagtailvideos/videos/_near_duplicates.html', {
+            'near_duplicates': video.find_near_duplicates(),
+        }, request=request),
+    })
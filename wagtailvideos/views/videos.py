@@ -13,8 +13,9 @@ from wagtail.search.backends import get_search_backends
 
 from wagtailvideos import ffmpeg
 from wagtailvideos.forms import VideoTranscodeAdminForm, get_video_form
-from wagtailvideos.models import Video
+from wagtailvideos.models import Video, delete_unused_file
 from wagtailvideos.permissions import permission_policy
+from wagtailvideos.uploadhandler import use_video_upload_handler
 
 permission_checker = PermissionPolicyChecker(permission_policy)
 
@@ -82,7 +83,7 @@ def edit(request, video_id):
                 # if providing a new video file, delete the old one and all renditions.
                 # NB Doing this via original_file.delete() clears the file field,
                 # which definitely isn't what we want...
-                original_file.storage.delete(original_file.name)
+                delete_unused_file(original_file, Video.objects.exclude(pk=video.pk))
 
                 # Set new video file size
                 video.file_size = video.file.size
@@ -115,6 +116,7 @@ def edit(request, video_id):
         'video': video,
         'form': form,
         'filesize': video.get_file_size(),
+        'near_duplicates': video.find_near_duplicates(),
         'can_transcode': ffmpeg.installed(),
         'transcodes': video.transcodes.all(),
         'transcode_form': VideoTranscodeAdminForm(video=video),
@@ -147,6 +149,7 @@ def delete(request, video_id):
     })
 
 
+@use_video_upload_handler
 @permission_checker.require('add')
 def add(request):
     VideoForm = get_video_form(Video)